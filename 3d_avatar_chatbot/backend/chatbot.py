@@ -1,10 +1,36 @@
+import asyncio
 import json
 import logging
+import os
 
 import realtime as rt
+from adaptive_aggregator import AdaptiveTokenAggregator
+from realtime_examples.pools import (
+    AzureSynthesizerPool,
+    PooledAzureTTS,
+    PooledDeepgramSTT,
+    PooledGroqLLM,
+    close_deepgram_pools,
+    close_on_disconnect,
+    deepgram_pool,
+    warm_llm_client,
+)
+from streaming_json import JSONFieldExtractor
+from tts_cache import CachedTTS
+from viseme_aligner import VisemeAligner
 
 logging.basicConfig(level=logging.INFO)
 
+# Set CHATBOT_STREAMING=1 to stream the LLM response and start speaking its
+# text field while the rest of the JSON is still being generated. Streaming
+# gives up Groq's JSON mode, so by default the whole response is awaited.
+STREAMING_ENABLED = os.getenv("CHATBOT_STREAMING", "0") == "1"
+
+VOICE_ID = "en-US-AvaMultilingualNeural"
+
+# Shared by all connections; `run` has no access to the app instance.
+azure_pool = AzureSynthesizerPool(voice_id=VOICE_ID)
+
 
 @rt.App()
 class Chatbot:
@@ -18,41 +44,84 @@ class Chatbot:
     """
 
     async def setup(self):
-        pass
+        # Clients that send no sample rate are assumed to be at 48kHz.
+        await asyncio.gather(
+            deepgram_pool(48000),
+            azure_pool.start(),
+            warm_llm_client(PooledGroqLLM.shared_client()),
+        )
 
     @rt.websocket()
     async def run(audio_input_stream: rt.AudioStream, message_stream: rt.TextStream):
-        deepgram_node = rt.DeepgramSTT(sample_rate=audio_input_stream.sample_rate)
-        llm_node = rt.GroqLLM(
-            system_prompt="You are a virtual assistant.\
-            You will always reply with a JSON object.\
-            Each message has a text, facialExpression, and animation property.\
-            The text property is a short response to the user (no emoji).\
-            The different facial expressions are: smile, sad, angry, and default.\
-            The different animations are: Talking_0, Talking_1, Talking_2, Crying, Laughing, Rumba, Idle, Terrified, and Angry.",
-            temperature=0.9,
-            response_format={"type": "json_object"},
-            stream=False,
+        deepgram_node = PooledDeepgramSTT(
+            await deepgram_pool(audio_input_stream.sample_rate)
+        )
+        if STREAMING_ENABLED:
+            # Groq's JSON mode does not stream, so the format is left to the
+            # prompt. The expression and animation come first so the avatar
+            # has them before it starts talking.
+            llm_node = PooledGroqLLM(
+                system_prompt="You are a virtual assistant.\
+                You will always reply with a JSON object and nothing else.\
+                Each message has a facialExpression, animation, and text property, in that order.\
+                The text property is a short response to the user (no emoji).\
+                The different facial expressions are: smile, sad, angry, and default.\
+                The different animations are: Talking_0, Talking_1, Talking_2, Crying, Laughing, Rumba, Idle, Terrified, and Angry.",
+                temperature=0.9,
+                stream=True,
+            )
+        else:
+            llm_node = PooledGroqLLM(
+                system_prompt="You are a virtual assistant.\
+                You will always reply with a JSON object.\
+                Each message has a text, facialExpression, and animation property.\
+                The text property is a short response to the user (no emoji).\
+                The different facial expressions are: smile, sad, angry, and default.\
+                The different animations are: Talking_0, Talking_1, Talking_2, Crying, Laughing, Rumba, Idle, Terrified, and Angry.",
+                temperature=0.9,
+                response_format={"type": "json_object"},
+                stream=False,
+            )
+        azure_node = PooledAzureTTS(azure_pool, stream=True)
+        tts_node = CachedTTS(
+            azure_node,
+            provider="azure",
+            voice_id=VOICE_ID,
+            sample_rate=16000,
         )
-        tts_node = rt.AzureTTS(stream=True)
 
         deepgram_stream = deepgram_node.run(audio_input_stream)
         deepgram_stream = rt.merge([deepgram_stream, message_stream])
 
         llm_token_stream, chat_history_stream = llm_node.run(deepgram_stream)
 
-        json_text_stream = rt.map(
-            llm_token_stream.clone(), lambda x: json.loads(x).get("text")
-        )
+        viseme_aligner_node = VisemeAligner()
+        nodes = [deepgram_node, llm_node, tts_node, viseme_aligner_node]
+        if STREAMING_ENABLED:
+            json_field_node = JSONFieldExtractor()
+            token_aggregator_node = AdaptiveTokenAggregator()
+            json_text_stream, llm_message_stream = json_field_node.run(llm_token_stream)
+            json_text_stream = token_aggregator_node.run(json_text_stream)
+            nodes += [json_field_node, token_aggregator_node]
+        else:
+            json_text_stream = rt.map(
+                llm_token_stream.clone(), lambda x: json.loads(x).get("text")
+            )
+            llm_message_stream = llm_token_stream
 
         tts_stream, viseme_stream = tts_node.run(json_text_stream)
+        tts_stream, viseme_stream = viseme_aligner_node.run(tts_stream, viseme_stream)
+
+        llm_with_viseme_stream = rt.merge([llm_message_stream, viseme_stream])
 
-        llm_with_viseme_stream = rt.merge([llm_token_stream, viseme_stream])
+        # Give the pooled connections back and stop the session's tasks when
+        # the client disconnects. The cache stage closes the Azure node it wraps.
+        close_on_disconnect(nodes)
 
         return tts_stream, llm_with_viseme_stream
 
     async def teardown(self):
-        pass
+        await asyncio.gather(azure_pool.close(), close_deepgram_pools())
 
 
 if __name__ == "__main__":
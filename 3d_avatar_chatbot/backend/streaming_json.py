@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import realtime as rt
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = " \t\r\n"
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class IncrementalJSONParser:
+    """
+    Parses the top-level fields of a JSON object as it streams in.
+
+    `feed()` takes the next piece of the document and returns the events it
+    completes, as (key, value, done) tuples:
+
+    - For string fields in `stream_fields`, the characters decoded from each
+      piece are returned as they arrive with done=False, and the whole value
+      again with done=True once the closing quote is seen.
+    - Every other field is returned once, with done=True, as soon as its
+      value is complete.
+
+    Anything before the opening brace, such as a markdown code fence, is
+    skipped. Completed fields are also kept in `fields`.
+
+    Args:
+        stream_fields (Iterable[str]): The string fields to stream character by character.
+    """
+
+    def __init__(self, stream_fields: Iterable[str] = ("text",)) -> None:
+        self.stream_fields = set(stream_fields)
+        self.reset()
+
+    def reset(self) -> None:
+        """Get ready to parse the next document."""
+        self.fields: Dict[str, Any] = {}
+        self.started: bool = False
+        self._state: str = "start"
+        self._key: str = ""
+        self._buffer: List[str] = []
+        # None outside of an escape sequence, else the characters after the backslash.
+        self._escape: Optional[str] = None
+        self._high_surrogate: Optional[str] = None
+        # For nested objects and arrays, which are collected raw and decoded at the end.
+        self._depth: int = 0
+        self._in_string: bool = False
+
+    def _read_string_char(self, c: str) -> Tuple[Optional[str], bool]:
+        """Consume one character of a string; return the decoded character, if any, and whether the string ended."""
+        if self._escape is None:
+            if c == "\\":
+                self._escape = ""
+                return None, False
+            if c == '"':
+                return None, True
+            return c, False
+        self._escape += c
+        if self._escape[0] != "u":
+            decoded = _ESCAPES.get(c, c)
+            self._escape = None
+            return decoded, False
+        if len(self._escape) < 5:
+            return None, False
+        decoded = chr(int(self._escape[1:], 16))
+        self._escape = None
+        if "\ud800" <= decoded <= "\udbff":
+            self._high_surrogate = decoded
+            return None, False
+        if self._high_surrogate is not None:
+            decoded = (
+                (self._high_surrogate + decoded)
+                .encode("utf-16", "surrogatepass")
+                .decode("utf-16")
+            )
+            self._high_surrogate = None
+        return decoded, False
+
+    def _complete(self, value: Any, events: List[Tuple[str, Any, bool]]) -> None:
+        self.fields[self._key] = value
+        events.append((self._key, value, True))
+        self._state = "before_key"
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any, bool]]:
+        events: List[Tuple[str, Any, bool]] = []
+        delta: List[str] = []
+        for c in chunk:
+            state = self._state
+            if state == "start":
+                if c == "{":
+                    self.started = True
+                    self._state = "before_key"
+            elif state == "before_key":
+                if c == '"':
+                    self._buffer = []
+                    self._state = "key"
+                elif c == "}":
+                    self._state = "done"
+            elif state == "key":
+                decoded, ended = self._read_string_char(c)
+                if ended:
+                    self._key = "".join(self._buffer)
+                    self._state = "colon"
+                elif decoded is not None:
+                    self._buffer.append(decoded)
+            elif state == "colon":
+                if c == ":":
+                    self._state = "before_value"
+            elif state == "before_value":
+                if c in _WHITESPACE:
+                    continue
+                self._buffer = [] if c == '"' else [c]
+                if c == '"':
+                    self._state = "string"
+                elif c in "{[":
+                    self._depth = 1
+                    self._in_string = False
+                    self._state = "nested"
+                else:
+                    self._state = "scalar"
+            elif state == "string":
+                decoded, ended = self._read_string_char(c)
+                if ended:
+                    if delta:
+                        events.append((self._key, "".join(delta), False))
+                        delta = []
+                    self._complete("".join(self._buffer), events)
+                elif decoded is not None:
+                    self._buffer.append(decoded)
+                    if self._key in self.stream_fields:
+                        delta.append(decoded)
+            elif state == "scalar":
+                if c in ",}" or c in _WHITESPACE:
+                    try:
+                        value = json.loads("".join(self._buffer))
+                    except ValueError:
+                        value = "".join(self._buffer)
+                    self._complete(value, events)
+                    if c == "}":
+                        self._state = "done"
+                else:
+                    self._buffer.append(c)
+            elif state == "nested":
+                self._buffer.append(c)
+                if self._in_string:
+                    if self._escape is not None:
+                        self._escape = None
+                    elif c == "\\":
+                        self._escape = ""
+                    elif c == '"':
+                        self._in_string = False
+                elif c == '"':
+                    self._in_string = True
+                elif c in "{[":
+                    self._depth += 1
+                elif c in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        try:
+                            value = json.loads("".join(self._buffer))
+                        except ValueError:
+                            value = "".join(self._buffer)
+                        self._complete(value, events)
+        if delta:
+            events.append((self._key, "".join(delta), False))
+        return events
+
+
+class JSONFieldExtractor:
+    """
+    Splits a streamed JSON response from the LLM into speech and avatar cues.
+
+    The characters of `text_field` are sent to the text stream as they arrive,
+    so speech can start at about the LLM's time to first token rather than
+    after the whole response. Every other field, e.g. facialExpression and
+    animation, is sent to the message stream as a JSON object of its own as
+    soon as its value is complete, and so is the whole text once it is.
+    Both streams get a None at the end of each response.
+
+    A response that is not a JSON object at all is spoken as is.
+
+    Args:
+        text_field (str): The field holding the text to speak.
+    """
+
+    def __init__(self, text_field: str = "text") -> None:
+        self.text_field: str = text_field
+        self.text_stream: rt.TextStream = rt.TextStream()
+        self.message_stream: rt.TextStream = rt.TextStream()
+        self._task: Optional[asyncio.Task] = None
+
+    def run(self, input_queue: rt.TextStream) -> Tuple[rt.TextStream, rt.TextStream]:
+        """
+        Start extracting fields.
+
+        Args:
+            input_queue (rt.TextStream): The LLM token stream.
+
+        Returns:
+            Tuple[rt.TextStream, rt.TextStream]: The text stream and the message stream.
+        """
+        self.input_queue = input_queue
+        self._task = asyncio.create_task(self._extract())
+        return self.text_stream, self.message_stream
+
+    async def _extract(self) -> None:
+        parser = IncrementalJSONParser(stream_fields=(self.text_field,))
+        response = ""
+        first_token_at = None
+        text_started = False
+        while True:
+            token = await self.input_queue.get()
+            if token is None:
+                if not parser.started and response.strip():
+                    logger.warning("LLM response is not a JSON object: %s", response)
+                    self.text_stream.put_nowait(response)
+                self.text_stream.put_nowait(None)
+                self.message_stream.put_nowait(None)
+                parser.reset()
+                response = ""
+                first_token_at = None
+                text_started = False
+                continue
+
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            response += token
+            for key, value, done in parser.feed(token):
+                if not done:
+                    if not text_started:
+                        text_started = True
+                        logger.info(
+                            "First text %.0f ms after first token",
+                            1000 * (time.monotonic() - first_token_at),
+                        )
+                    self.text_stream.put_nowait(value)
+                else:
+                    self.message_stream.put_nowait(json.dumps({key: value}))
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
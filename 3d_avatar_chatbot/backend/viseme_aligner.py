@@ -0,0 +1,246 @@
+import asyncio
+import bisect
+import json
+import logging
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import realtime as rt
+
+logger = logging.getLogger(__name__)
+
+
+class _PhraseVisemes:
+    """The visemes of one TTS phrase, with times relative to the start of the phrase's audio."""
+
+    __slots__ = ("turn", "start", "starts", "ends", "ids", "values")
+
+    def __init__(self) -> None:
+        self.turn: int = -1
+        # Where the phrase's audio starts in its turn, once its first frame is seen.
+        self.start: Optional[float] = None
+        self.starts: array = array("f")
+        self.ends: array = array("f")
+        self.ids: array = array("B")
+        self.values: array = array("B")
+
+    def set_cues(self, cues: List[dict]) -> None:
+        self.starts = array("f", (cue["start"] for cue in cues))
+        self.ends = array("f", (cue["end"] for cue in cues))
+        self.ids = array("B", (cue["azure_viseme_id"] for cue in cues))
+        self.values = array("B", (ord(cue["value"]) for cue in cues))
+
+
+class VisemeAligner:
+    """
+    Puts the avatar's visemes on the same clock as its audio.
+
+    Audio from the TTS stage is passed through unchanged, and its duration is
+    used to track where each phrase starts within the current turn, i.e. the
+    stretch of audio the client plays without running dry, which is what the
+    client times lip sync against. Viseme times, which the TTS reports
+    relative to each phrase, are shifted onto that timeline.
+
+    Instead of the whole cue list on every viseme event, every `interval`
+    seconds while audio is playing the client gets the cues from
+    `lookbehind` seconds before to `lookahead` seconds after the estimated
+    playback position, if any of them are new. Cues needed before the next
+    batch wake the sender early, and between turns it waits for the next
+    turn's audio rather than polling. Visemes are kept in arrays, and phrases
+    that have been played are dropped, so memory per session stays bounded
+    by `max_cues`.
+
+    Args:
+        interval (float): Seconds between viseme batches.
+        lookahead (float): Seconds of cues ahead of playback sent in each batch.
+        lookbehind (float): Seconds of cues behind playback sent in each batch, to cover network delay.
+        turn_gap (float): Seconds after the end of the audio sent so far when the client is assumed to have run dry.
+        max_cues (int): Maximum cues kept.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.25,
+        lookahead: float = 1.0,
+        lookbehind: float = 0.5,
+        turn_gap: float = 0.3,
+        max_cues: int = 1024,
+    ) -> None:
+        self.interval: float = interval
+        self.lookahead: float = lookahead
+        self.lookbehind: float = lookbehind
+        self.turn_gap: float = turn_gap
+        self.max_cues: int = max_cues
+        self.viseme_stream: rt.TextStream = rt.TextStream()
+        # TTS phrases by index, in the order the TTS produces them.
+        self._phrases: Dict[int, _PhraseVisemes] = {}
+        self._audio_phrase: int = 0
+        self._audio_phrase_started: bool = False
+        self._viseme_phrase: int = 0
+        self._turn: int = 0
+        self._turn_start: float = 0.0
+        self._pts: float = 0.0
+        self._playback_end: float = 0.0
+        self._sent_until: float = -1.0
+        self._wake: asyncio.Event = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.viseme_events: int = 0
+        self.batches: int = 0
+
+    def run(
+        self, audio_stream: rt.AudioStream, viseme_stream: rt.TextStream
+    ) -> Tuple[rt.AudioStream, rt.TextStream]:
+        """
+        Start aligning.
+
+        Args:
+            audio_stream (rt.AudioStream): The TTS audio, with a None after each phrase.
+            viseme_stream (rt.TextStream): The TTS visemes, with a None after each phrase.
+
+        Returns:
+            Tuple[rt.AudioStream, rt.TextStream]: The audio, and the viseme batches for the client.
+        """
+        self.audio_input = audio_stream
+        self.viseme_input = viseme_stream
+        self.output_queue = type(audio_stream)()
+        self._tasks = [
+            asyncio.create_task(self._read_audio()),
+            asyncio.create_task(self._read_visemes()),
+            asyncio.create_task(self._send_batches()),
+        ]
+        return self.output_queue, self.viseme_stream
+
+    def _phrase(self, index: int) -> _PhraseVisemes:
+        if index not in self._phrases:
+            self._phrases[index] = _PhraseVisemes()
+        return self._phrases[index]
+
+    def _start_phrase(self) -> None:
+        phrase = self._phrase(self._audio_phrase)
+        phrase.turn = self._turn
+        phrase.start = self._pts
+        self._audio_phrase_started = True
+
+    def _new_turn(self, now: float) -> None:
+        if self._audio_phrase_started:
+            # The client ran dry in the middle of a phrase; the rest of it
+            # plays from the start of the new turn.
+            phrase = self._phrase(self._audio_phrase)
+            phrase.turn = self._turn + 1
+            phrase.start -= self._pts
+        self._turn += 1
+        self._turn_start = now
+        self._pts = 0.0
+        self._sent_until = -1.0
+        self._wake.set()
+
+    async def _read_audio(self) -> None:
+        while True:
+            frame = await self.audio_input.get()
+            if frame is None:
+                if not self._audio_phrase_started:
+                    self._start_phrase()
+                self._audio_phrase += 1
+                self._audio_phrase_started = False
+                self.output_queue.put_nowait(None)
+                continue
+            now = time.monotonic()
+            if now > self._playback_end + self.turn_gap:
+                self._new_turn(now)
+            if not self._audio_phrase_started:
+                self._start_phrase()
+            duration = frame.get_duration_seconds()
+            self._playback_end = max(self._playback_end, now) + duration
+            self._pts += duration
+            self.output_queue.put_nowait(frame)
+
+    async def _read_visemes(self) -> None:
+        while True:
+            message = await self.viseme_input.get()
+            if message is None:
+                self._viseme_phrase += 1
+                continue
+            phrase = self._phrase(self._viseme_phrase)
+            # The TTS sends all of the phrase's cues so far with every event.
+            phrase.set_cues(json.loads(message)["mouthCues"])
+            self.viseme_events += 1
+            if (
+                phrase.turn == self._turn
+                and phrase.start is not None
+                and phrase.starts
+                and phrase.start + phrase.starts[-1]
+                < time.monotonic() - self._turn_start + self.interval
+            ):
+                self._wake.set()
+
+    def _window(self, low: float, high: float) -> List[dict]:
+        cues = []
+        for index in sorted(self._phrases):
+            phrase = self._phrases[index]
+            if phrase.turn != self._turn or phrase.start is None:
+                continue
+            first = bisect.bisect_right(phrase.ends, low - phrase.start)
+            last = bisect.bisect_right(phrase.starts, high - phrase.start)
+            for i in range(first, last):
+                cues.append(
+                    {
+                        "value": chr(phrase.values[i]),
+                        "azure_viseme_id": phrase.ids[i],
+                        "start": round(phrase.start + phrase.starts[i], 3),
+                        "end": round(phrase.start + phrase.ends[i], 3),
+                    }
+                )
+        return cues
+
+    def _evict(self, before: float) -> None:
+        """Drop the phrases that have been played, then the oldest ones if over `max_cues`."""
+        for index in list(self._phrases):
+            phrase = self._phrases[index]
+            if phrase.start is None:
+                continue
+            if phrase.turn < self._turn or (
+                phrase.ends and phrase.start + phrase.ends[-1] < before
+            ):
+                del self._phrases[index]
+        total = sum(len(phrase.starts) for phrase in self._phrases.values())
+        for index in sorted(self._phrases):
+            if total <= self.max_cues:
+                break
+            total -= len(self._phrases.pop(index).starts)
+
+    async def _send_batches(self) -> None:
+        playing = False
+        while True:
+            if playing:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Nothing to send until the audio of the next turn arrives.
+                await self._wake.wait()
+            self._wake.clear()
+            now = time.monotonic()
+            if now > self._playback_end + self.turn_gap:
+                if playing:
+                    playing = False
+                    logger.info(
+                        "Visemes: %d batches sent for %d TTS events",
+                        self.batches,
+                        self.viseme_events,
+                    )
+                continue
+            playing = True
+            position = now - self._turn_start
+            self._evict(position - self.lookbehind)
+            cues = self._window(position - self.lookbehind, position + self.lookahead)
+            # The client keeps the last batch, so only send when there is something new.
+            if cues and cues[-1]["start"] > self._sent_until:
+                self._sent_until = cues[-1]["start"]
+                self.viseme_stream.put_nowait(json.dumps({"mouthCues": cues}))
+                self.batches += 1
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
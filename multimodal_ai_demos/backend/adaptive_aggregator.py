@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from realtime.plugins.token_aggregator import SENTENCE_ENDINGS, TokenAggregator
+
+logger = logging.getLogger(__name__)
+
+# Natural breaks at which the first clause of a response may be cut.
+CLAUSE_BREAKS: List[str] = [",", ";", ":"] + SENTENCE_ENDINGS
+
+
+class AdaptiveTokenAggregator(TokenAggregator):
+    """
+    A TokenAggregator that trades chunk size for time to first audio.
+
+    The first chunk of every response is emitted as soon as it ends on a
+    natural break (comma, colon, sentence ending) and has at least
+    `first_min_words` words, or, failing that, at a word boundary once it
+    reaches `first_max_words` words or has been held for `first_max_hold`
+    seconds. After that, chunks are cut at sentence endings and only once
+    they have at least `min_chunk_chars` characters, which gives the TTS whole
+    sentences for better prosody and fewer calls.
+
+    The chunk sizes and hold times chosen for each response are logged and
+    kept in `last_response`.
+
+    Args:
+        first_min_words (int): Minimum words before the first chunk may be cut at a natural break.
+        first_max_words (int): Words after which the first chunk is cut at a word boundary.
+        first_max_hold (float): Seconds after which the first chunk is cut at a word boundary.
+        min_chunk_chars (int): Minimum characters in later chunks.
+    """
+
+    def __init__(
+        self,
+        first_min_words: int = 3,
+        first_max_words: int = 10,
+        first_max_hold: float = 0.5,
+        min_chunk_chars: int = 40,
+    ) -> None:
+        super().__init__()
+        self.first_min_words: int = first_min_words
+        self.first_max_words: int = first_max_words
+        self.first_max_hold: float = first_max_hold
+        self.min_chunk_chars: int = min_chunk_chars
+        # (characters, hold time in seconds) of each chunk of the last response.
+        self.last_response: List[Tuple[int, float]] = []
+        self._chunks: List[Tuple[int, float]] = []
+        self._held_since: Optional[float] = None
+
+    def _cut(self, first: bool, hold_expired: bool) -> int:
+        """Return the index to cut the buffer at, or -1 to keep aggregating."""
+        if first:
+            i = max((self.buffer.rfind(b) for b in CLAUSE_BREAKS), default=-1)
+            if i != -1 and len(self.buffer[: i + 1].split()) >= self.first_min_words:
+                return i + 1
+            if hold_expired or len(self.buffer.split()) > self.first_max_words:
+                # Only cut after a complete word.
+                i = self.buffer.rstrip().rfind(" ")
+                return i if i > 0 else -1
+            return -1
+        i = max((self.buffer.rfind(e) for e in SENTENCE_ENDINGS), default=-1)
+        if i != -1 and len(self.buffer[: i + 1].strip()) >= self.min_chunk_chars:
+            return i + 1
+        return -1
+
+    async def _emit(self, chunk: str) -> None:
+        now = time.monotonic()
+        hold = now - self._held_since if self._held_since is not None else 0.0
+        self._chunks.append((len(chunk), hold))
+        self._held_since = now if self.buffer.strip() else None
+        await self.output_queue.put(chunk)
+
+    async def _aggregate_tokens(self) -> None:
+        self.buffer = ""
+        self._chunks = []
+        self._held_since = None
+        first = True
+        hold_expired = False
+        while True:
+            timeout = None
+            if first and not hold_expired and self._held_since is not None:
+                timeout = max(
+                    self.first_max_hold - (time.monotonic() - self._held_since), 0
+                )
+            try:
+                token = await asyncio.wait_for(self.input_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                hold_expired = True
+                token = ""
+
+            if token is None:
+                if self.buffer.strip():
+                    chunk, self.buffer = self.buffer, ""
+                    await self._emit(chunk)
+                self.buffer = ""
+                if self._chunks:
+                    self.last_response = self._chunks
+                    logger.info(
+                        "Aggregated chunks (chars, hold ms): %s",
+                        [(size, round(hold * 1000)) for size, hold in self._chunks],
+                    )
+                self._chunks = []
+                self._held_since = None
+                first = True
+                hold_expired = False
+                await self.output_queue.put(None)
+                continue
+
+            if token:
+                if self._held_since is None:
+                    self._held_since = time.monotonic()
+                self.buffer += token
+
+            i = self._cut(first, hold_expired)
+            if i != -1:
+                chunk, self.buffer = self.buffer[:i], self.buffer[i:]
+                await self._emit(chunk)
+                first = False
+
+    @property
+    def generating(self) -> bool:
+        return bool(self.buffer.strip())
+
+    def interrupt(self) -> List[asyncio.Task]:
+        """Drop the text held back for the current response and start afresh."""
+        old, self._task = self._task, asyncio.create_task(self._aggregate_tokens())
+        old.cancel()
+        return [old]
@@ -6,13 +6,17 @@ from typing import Tuple
 logging.basicConfig(level=logging.ERROR)
 
 import realtime
+from realtime.plugins.audio_convertor import AudioConverter
 from realtime.plugins.deepgram_stt import DeepgramSTT
 from realtime.plugins.eleven_labs_tts import ElevenLabsTTS
-from realtime.plugins.openai_vision import OpenAIVision
-from realtime.plugins.token_aggregator import TokenAggregator
 from realtime.streams import AudioStream, VideoStream, Stream, TextStream, ByteStream
-from realtime.plugins.silero_vad import SileroVAD
-from realtime.plugins.audio_convertor import AudioConverter
+
+from adaptive_aggregator import AdaptiveTokenAggregator
+from bounded_stream import monitor, pipe
+from interrupt import AudioPacer, InterruptibleOpenAIVision, PipelineInterrupt
+from ring_buffer import AudioRingReader, RingBuffer, VideoRingReader
+from tts_cache import CachedTTS
+from vad_service import BatchedVADService
 
 
 @realtime.App()
@@ -21,56 +25,88 @@ class CookingAssistant:
         self.deepgram_node = DeepgramSTT(
             api_key=os.environ.get("DEEPGRAM_API_KEY"), sample_rate=8000
         )
-        self.openai_node = OpenAIVision(
+        self.openai_node = InterruptibleOpenAIVision(
             api_key=os.environ.get("OPENAI_API_KEY"),
             system_prompt="You are a chef. Your job is to provide feedback and guide the user on how to cook a dish. First tell them the recipe and then guide them on how to cook it. Take into account previous responses for a smooth flow. Do not repeat yourself. Keep the output within 15 words.",
             auto_respond=10,
             wait_for_first_user_response=True,
         )
-        self.token_aggregator_node = TokenAggregator()
+        self.token_aggregator_node = AdaptiveTokenAggregator()
         self.elevenlabs_node = ElevenLabsTTS(
             api_key=os.environ.get("ELEVEN_LABS_API_KEY")
         )
-        self.silero_vad_node = SileroVAD()
+        self.tts_cache_node = CachedTTS(
+            self.elevenlabs_node,
+            provider="elevenlabs",
+            voice_id=self.elevenlabs_node._voice_id,
+            sample_rate=self.elevenlabs_node.sample_rate,
+        )
+        # Shared by all sessions; each session gets its own VAD node in run().
+        self.vad_service = BatchedVADService()
         self.audio_convertor_node = AudioConverter()
+        self.audio_pacer_node = AudioPacer()
+        # One VAD event cancels and flushes everything from the LLM to the transport.
+        self.interrupt = PipelineInterrupt(
+            [
+                self.openai_node,
+                self.token_aggregator_node,
+                self.tts_cache_node,
+                self.elevenlabs_node,
+                self.audio_convertor_node,
+                self.audio_pacer_node,
+            ]
+        )
 
     @realtime.streaming_endpoint()
     async def run(
         self, audio_input_stream: AudioStream, video_input_stream: VideoStream
     ) -> Tuple[Stream, ...]:
-        audio_input_stream_copy = await audio_input_stream.clone()
-
-        deepgram_stream: TextStream = await self.deepgram_node.run(audio_input_stream)
-        silero_vad_stream: TextStream = await self.silero_vad_node.run(
-            audio_input_stream_copy
+        # The input streams are moved into ring buffers right away and each
+        # branch reads them through its own cursor, so every frame is held
+        # once and freed as soon as all branches have read it. A slow branch
+        # skips old audio, and the vision model only ever sees the latest
+        # frame, instead of memory growing for the whole session.
+        audio_buffer = RingBuffer(capacity=64, name="audio_input")
+        stt_audio = audio_buffer.reader(AudioRingReader, name="stt_audio")
+        vad_audio = audio_buffer.reader(AudioRingReader, name="vad_audio")
+        video_buffer = RingBuffer(capacity=8, name="video_input")
+        vision_video = video_buffer.reader(
+            VideoRingReader, name="vision_video", max_lag=1
         )
+        output_video = video_buffer.reader(VideoRingReader, name="output_video")
+        pipe(audio_input_stream, audio_buffer)
+        pipe(video_input_stream, video_buffer)
+        monitor([audio_buffer, video_buffer])
+        vad_node = self.vad_service.session()
+
+        deepgram_stream: TextStream = await self.deepgram_node.run(stt_audio)
+        silero_vad_stream: TextStream = await vad_node.run(vad_audio)
         openai_stream: TextStream
         openai_stream, chat_history = await self.openai_node.run(
-            deepgram_stream, video_input_stream
+            deepgram_stream, vision_video
         )
         token_aggregator_stream: TextStream = await self.token_aggregator_node.run(
             openai_stream
         )
-        elevenlabs_stream: ByteStream = await self.elevenlabs_node.run(
-            token_aggregator_stream
-        )
-        audio_stream: AudioStream = await self.audio_convertor_node.run(
+        elevenlabs_stream: ByteStream = self.tts_cache_node.run(token_aggregator_stream)
+        converted_stream: AudioStream = await self.audio_convertor_node.run(
             elevenlabs_stream
         )
+        audio_stream: AudioStream = await self.audio_pacer_node.run(converted_stream)
 
-        await self.openai_node.set_interrupt(silero_vad_stream)
-        await self.elevenlabs_node.set_interrupt(await silero_vad_stream.clone())
-        await self.token_aggregator_node.set_interrupt(await silero_vad_stream.clone())
+        await self.interrupt.run(silero_vad_stream)
 
-        return audio_stream, await video_input_stream.clone(), chat_history
+        return audio_stream, output_video, chat_history
 
     async def teardown(self):
         await self.deepgram_node.close()
         await self.openai_node.close()
         await self.token_aggregator_node.close()
-        await self.elevenlabs_node.close()
-        await self.silero_vad_node.close()
+        await self.tts_cache_node.close()
+        await self.vad_service.close()
         await self.audio_convertor_node.close()
+        await self.audio_pacer_node.close()
+        await self.interrupt.close()
 
 
 if __name__ == "__main__":
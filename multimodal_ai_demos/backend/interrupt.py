@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from realtime.plugins.openai_vision import OpenAIVision
+from realtime.streams import AudioStream
+
+logger = logging.getLogger(__name__)
+
+
+def frame_duration(frame) -> float:
+    """Return the duration in seconds of an av.AudioFrame or AudioData."""
+    if hasattr(frame, "samples"):
+        return frame.samples / frame.sample_rate
+    return frame.get_duration_seconds()
+
+
+class AudioPacer:
+    """
+    Releases audio to the transport at playback speed.
+
+    The transport buffers whatever it is given, so audio that is produced
+    faster than it plays ends up queued where it cannot be flushed. The pacer
+    keeps at most `lead` seconds of audio ahead of playback and holds the rest
+    in its own input queue, which `PipelineInterrupt` can drain when the pacer
+    is the last of its stages.
+
+    Args:
+        lead (float): How many seconds of audio to hand to the transport ahead of playback.
+    """
+
+    def __init__(self, lead: float = 0.2) -> None:
+        self.lead: float = lead
+        self.output_queue: AudioStream = AudioStream()
+        self._playback_end: float = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def generating(self) -> bool:
+        return False
+
+    async def run(self, input_queue: asyncio.Queue) -> AudioStream:
+        self.input_queue = input_queue
+        self._task = asyncio.create_task(self.pace())
+        return self.output_queue
+
+    def interrupt(self) -> List[asyncio.Task]:
+        """Drop the frame being held back and start pacing afresh."""
+        old, self._task = self._task, asyncio.create_task(self.pace())
+        old.cancel()
+        return [old]
+
+    async def pace(self) -> None:
+        self._playback_end = 0.0
+        while True:
+            frame = await self.input_queue.get()
+            if frame is None:
+                self.output_queue.put_nowait(frame)
+                continue
+            now = time.monotonic()
+            self._playback_end = max(self._playback_end, now)
+            ahead = self._playback_end - now
+            if ahead > self.lead:
+                await asyncio.sleep(ahead - self.lead)
+            self._playback_end += frame_duration(frame)
+            self.output_queue.put_nowait(frame)
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+
+class InterruptibleOpenAIVision(OpenAIVision):
+    """
+    OpenAIVision with a working `set_interrupt` path.
+
+    The vision plugins restart `self._task` when interrupted, which
+    OpenAIVision never sets, so every completion loop registers itself there.
+    The loop also catches the CancelledError of a request in flight and
+    carries on, so a loop that survives being cancelled is cancelled again
+    once it has moved on, rather than left to take the next prompt.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._task: Optional[asyncio.Task] = None
+        self._interrupt_task: Optional[asyncio.Task] = None
+
+    @property
+    def generating(self) -> bool:
+        return self._generating
+
+    async def _stream_chat_completions(self) -> None:
+        self._task = asyncio.current_task()
+        await super()._stream_chat_completions()
+
+    async def _interrupt(self) -> None:
+        while True:
+            user_speaking = await self.interrupt_queue.get()
+            if not (self._generating and user_speaking) or self._task is None:
+                continue
+            old = self._task
+            old.cancel()
+            while not self.output_queue.empty():
+                self.output_queue.get_nowait()
+            self._generating = False
+            asyncio.create_task(self._stream_chat_completions())
+            for _ in range(3):
+                await asyncio.wait([old], timeout=0.05)
+                if old.done():
+                    break
+                old.cancel()
+            else:
+                logger.warning("OpenAI vision completion did not stop after barge-in")
+
+    async def close(self) -> None:
+        await super().close()
+        for task in (self._task, self._interrupt_task):
+            if task:
+                task.cancel()
+
+
+class PipelineInterrupt:
+    """
+    Barge-in handling for a whole pipeline.
+
+    On a single VAD event, every stage is interrupted and every stage's
+    output queue is drained, upstream first. In-flight LLM and TTS requests
+    are dropped with their tasks, so no more tokens or audio are paid for. The
+    time taken to flush is logged and kept in `last_flush`.
+
+    Realtime plugins are interrupted through their own `set_interrupt`
+    handlers, which are signalled first and given one pass of the event loop
+    to restart. Stages with an `interrupt()` method, which drops the work in
+    progress and starts the stage's loop afresh, are then interrupted and all
+    queues drained in one step, so that nothing can be refilled in between.
+    Stages with neither, such as AudioConverter, only have their output
+    drained. A stage's `generating` flag, if it has one, counts as work to
+    interrupt.
+
+    Args:
+        stages (List[object]): The pipeline nodes in order from upstream to
+            downstream. End with an `AudioPacer` to also flush audio not yet played.
+
+    Raises:
+        TypeError: If a stage has no output queue.
+    """
+
+    def __init__(self, stages: List[object]) -> None:
+        unsupported = [
+            type(node).__name__ for node in stages if not hasattr(node, "output_queue")
+        ]
+        if unsupported:
+            raise TypeError(
+                f"Pipeline stages without an output queue: {', '.join(unsupported)}"
+            )
+        self.stages: List[object] = stages
+        self.interrupts: int = 0
+        self.last_flush: Optional[float] = None
+        # One queue per plugin stage, set up by the first `run()`.
+        self._signals: Optional[List[asyncio.Queue]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, vad_stream: asyncio.Queue) -> None:
+        """
+        Interrupt the pipeline whenever `vad_stream` reports that the user started speaking.
+
+        The stages are shared, so a new session's VAD stream replaces the
+        previous session's.
+        """
+        if self._signals is None:
+            self._signals = []
+            for node in self.stages:
+                if not hasattr(node, "interrupt") and hasattr(node, "set_interrupt"):
+                    signal = asyncio.Queue()
+                    await node.set_interrupt(signal)
+                    self._signals.append(signal)
+        if self._task:
+            self._task.cancel()
+        self._task = asyncio.create_task(self._listen(vad_stream))
+
+    async def _listen(self, vad_stream: asyncio.Queue) -> None:
+        while True:
+            user_speaking = await vad_stream.get()
+            if user_speaking and self.busy():
+                await self.interrupt()
+
+    def _queues(self) -> List[asyncio.Queue]:
+        return [node.output_queue for node in self.stages]
+
+    def busy(self) -> bool:
+        """Whether any stage is generating or has output waiting."""
+        return any(getattr(node, "generating", False) for node in self.stages) or any(
+            not queue.empty() for queue in self._queues()
+        )
+
+    async def interrupt(self) -> float:
+        """Flush the pipeline and return how long it took, in seconds."""
+        start = time.monotonic()
+        for signal in self._signals or []:
+            signal.put_nowait(True)
+        await asyncio.sleep(0)
+        for node in self.stages:
+            if hasattr(node, "interrupt"):
+                node.interrupt()
+        dropped = 0
+        for queue in self._queues():
+            while not queue.empty():
+                queue.get_nowait()
+                dropped += 1
+
+        self.interrupts += 1
+        self.last_flush = time.monotonic() - start
+        logger.info(
+            "Barge-in: flushed pipeline in %.1f ms, dropped %d queued items",
+            self.last_flush * 1000,
+            dropped,
+        )
+        return self.last_flush
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
@@ -0,0 +1,223 @@
+import asyncio
+import io
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from realtime.plugins.base_plugin import Plugin
+from realtime.streams import VideoStream
+from realtime.utils.images import convert_yuv420_to_pil
+
+logger = logging.getLogger(__name__)
+
+# (left, top, right, bottom) as fractions of the frame width and height.
+Box = Tuple[float, float, float, float]
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)).astype(
+        np.float32
+    )
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    """Return the 64-bit DCT perceptual hash of a grayscale image."""
+    small = np.asarray(
+        Image.fromarray(gray).resize((32, 32), Image.BOX), dtype=np.float32
+    )
+    low = (_DCT_32 @ small @ _DCT_32.T)[:8, :8].reshape(-1)
+    # The DC term only reflects overall brightness, so it is left out of the median.
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _crop(array: np.ndarray, box: Box) -> np.ndarray:
+    height, width = array.shape[:2]
+    left, top, right, bottom = box
+    return array[
+        int(top * height) : int(bottom * height), int(left * width) : int(right * width)
+    ]
+
+
+class KeyFrameSelector(Plugin):
+    """
+    Picks the video frames worth sending to a vision model.
+
+    A drop-in replacement for KeyFrameDetector that keeps the cost of the
+    vision model bounded:
+
+    - Scene change is measured on a small grayscale thumbnail of `roi`, e.g.
+      the table and cards, taken from the luma plane, so frames are only
+      converted to color once they are picked.
+    - Scene changes whose perceptual hash is within `dedupe_distance` bits of
+      one of the last `dedupe_history` keyframes, e.g. lighting flicker or
+      the camera returning to a view it just showed, are dropped.
+    - Picked frames are cropped to `crop`, resized to at most `max_side`
+      pixels and JPEG compressed before they are sent.
+    - At most `max_per_minute` keyframes are sent in any 60 second window.
+      Frames over budget are dropped, and the next frame that differs from
+      the last keyframe is picked once the budget frees up.
+
+    Every `max_interval` seconds a frame is sent even if nothing changed,
+    like KeyFrameDetector, so the commentator keeps seeing the table.
+
+    Args:
+        roi (Box): The region used for scene change and deduplication.
+        crop (Optional[Box]): The region sent to the vision model, defaults to `roi`.
+        scene_threshold (float): Mean absolute luma difference (0-1) to the last keyframe that counts as a scene change.
+        min_interval (float): Minimum seconds between keyframes.
+        max_interval (Optional[float]): Seconds after which a keyframe is sent regardless of change.
+        dedupe_distance (int): Perceptual hashes at most this many bits apart are duplicates.
+        dedupe_history (int): How many recent keyframes to compare against.
+        max_side (int): Maximum width and height of the image sent.
+        jpeg_quality (int): JPEG quality of the image sent.
+        max_per_minute (int): Maximum keyframes sent per minute.
+    """
+
+    def __init__(
+        self,
+        roi: Box = (0.0, 0.5, 0.5, 1.0),
+        crop: Optional[Box] = None,
+        scene_threshold: float = 0.05,
+        min_interval: float = 1.0,
+        max_interval: Optional[float] = 15,
+        dedupe_distance: int = 6,
+        dedupe_history: int = 8,
+        max_side: int = 768,
+        jpeg_quality: int = 80,
+        max_per_minute: int = 6,
+    ) -> None:
+        super().__init__()
+        self.roi: Box = roi
+        self.crop: Box = crop or roi
+        self.scene_threshold: float = scene_threshold
+        self.min_interval: float = min_interval
+        self.max_interval: Optional[float] = max_interval
+        self.dedupe_distance: int = dedupe_distance
+        self.max_side: int = max_side
+        self.jpeg_quality: int = jpeg_quality
+        self.max_per_minute: int = max_per_minute
+        self.output_queue: VideoStream = VideoStream()
+        self._generating: bool = False
+        self._tasks: List[asyncio.Task] = []
+        self._last_thumbnail: Optional[np.ndarray] = None
+        self._last_time: float = 0.0
+        self._hashes: Deque[int] = deque(maxlen=dedupe_history)
+        self._sent_times: Deque[float] = deque()
+        self.sent: int = 0
+        self.sent_bytes: int = 0
+        self.dropped: Dict[str, int] = {"duplicate": 0, "budget": 0}
+
+    async def run(self, image_input_queue: asyncio.Queue) -> VideoStream:
+        self.image_input_queue = image_input_queue
+        self._tasks = [asyncio.create_task(self.process_video())]
+        return self.output_queue
+
+    def _thumbnail(self, roi: np.ndarray) -> np.ndarray:
+        height, width = roi.shape
+        size = (64, max(1, round(64 * height / width)))
+        return np.asarray(
+            Image.fromarray(roi).resize(size, Image.BOX), dtype=np.float32
+        )
+
+    def _encode(self, frame) -> Tuple[Image.Image, int]:
+        image = convert_yuv420_to_pil(frame).convert("RGB")
+        width, height = image.size
+        left, top, right, bottom = self.crop
+        image = image.crop(
+            (
+                int(left * width),
+                int(top * height),
+                int(right * width),
+                int(bottom * height),
+            )
+        )
+        image.thumbnail((self.max_side, self.max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.jpeg_quality, optimize=True)
+        return Image.open(buffer), buffer.tell()
+
+    def _within_budget(self, now: float) -> bool:
+        while self._sent_times and now - self._sent_times[0] > 60:
+            self._sent_times.popleft()
+        return len(self._sent_times) < self.max_per_minute
+
+    async def process_video(self) -> None:
+        i = 1
+        last_log = time.monotonic()
+        while True:
+            frame = await self.image_input_queue.get()
+            while self.image_input_queue.qsize() > 0:
+                frame = self.image_input_queue.get_nowait()
+
+            now = time.monotonic()
+            if now - last_log > 60:
+                last_log = now
+                logger.info(
+                    "Keyframes: sent=%d (%d KB) dropped=%s",
+                    self.sent,
+                    self.sent_bytes // 1024,
+                    self.dropped,
+                )
+            if (
+                self._last_thumbnail is not None
+                and now - self._last_time < self.min_interval
+            ):
+                continue
+
+            # The luma plane is the top two thirds of a yuv420p frame.
+            yuv = frame.to_ndarray(format="yuv420p")
+            roi = _crop(yuv[: round(yuv.shape[0] * 2 / 3)], self.roi)
+            thumbnail = self._thumbnail(roi)
+
+            scene_change = self._last_thumbnail is None or (
+                np.abs(thumbnail - self._last_thumbnail).mean() / 255
+                >= self.scene_threshold
+            )
+            timed_out = (
+                self.max_interval is not None
+                and now - self._last_time > self.max_interval
+            )
+            if not scene_change and not timed_out:
+                continue
+
+            if not self._within_budget(now):
+                self.dropped["budget"] += 1
+                continue
+
+            frame_hash = perceptual_hash(roi)
+            if not timed_out and any(
+                hamming_distance(frame_hash, h) <= self.dedupe_distance
+                for h in self._hashes
+            ):
+                # Compare later frames against this one so the duplicate is
+                # not hashed again on every frame.
+                self._last_thumbnail = thumbnail
+                self.dropped["duplicate"] += 1
+                continue
+
+            image, size = await asyncio.to_thread(self._encode, frame)
+            self._last_thumbnail = thumbnail
+            self._last_time = now
+            self._hashes.append(frame_hash)
+            self._sent_times.append(now)
+            self.sent += 1
+            self.sent_bytes += size
+            await self.output_queue.put((image, i))
+            i += 1
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
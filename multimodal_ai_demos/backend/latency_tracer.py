@@ -0,0 +1,270 @@
+import asyncio
+import bisect
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import realtime as rt
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds, Prometheus style.
+LATENCY_BUCKETS: List[float] = [
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    1.5,
+    2.5,
+    5.0,
+    10.0,
+]
+
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed buckets.
+
+    Args:
+        buckets (List[float]): The bucket upper bounds in seconds.
+    """
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS) -> None:
+        self.buckets: List[float] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class LatencyRegistry:
+    """
+    Process-wide collection of latency histograms shared by all sessions.
+
+    Args:
+        prefix (str): The prefix used for metric names when exporting.
+    """
+
+    def __init__(self, prefix: str = "voice_bot") -> None:
+        self.prefix: str = prefix
+        self.histograms: Dict[str, Histogram] = {}
+
+    def observe(self, name: str, value: float) -> None:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(value)
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Return count, mean and approximate p50/p90/p99 for each histogram."""
+        return {
+            name: {
+                "count": h.count,
+                "mean": h.sum / h.count if h.count else None,
+                "p50": h.quantile(0.5),
+                "p90": h.quantile(0.9),
+                "p99": h.quantile(0.99),
+            }
+            for name, h in self.histograms.items()
+        }
+
+    def render_prometheus(self) -> str:
+        """Render all histograms in the Prometheus text exposition format."""
+        lines = []
+        for name, h in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+            lines.append(f"{metric}_sum {h.sum}")
+            lines.append(f"{metric}_count {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = LatencyRegistry()
+
+
+class LatencyTracer:
+    """
+    Per-session tracer that stamps items crossing stream boundaries.
+
+    The tracer reads from clones of the pipeline streams, so it never delays
+    the pipeline itself. Items are correlated into utterances: an utterance
+    starts when text reaches the LLM and ends when the TTS signals the end of
+    its audio. For each utterance it records:
+
+    - stt_final_latency: last voiced input audio -> final transcript
+    - llm_time_to_first_token: LLM input -> first token
+    - aggregator_hold: first token of a chunk -> aggregated chunk emitted
+    - tts_time_to_first_byte: first aggregated chunk -> first audio
+    - time_to_first_audio: last voiced input audio (or LLM input) -> first audio
+
+    Args:
+        registry (LatencyRegistry): Where histograms are recorded.
+        speech_rms_threshold (float): RMS of int16 samples above which an input
+            audio frame counts as speech.
+        log_every (int): Log a histogram summary every this many utterances.
+    """
+
+    def __init__(
+        self,
+        registry: LatencyRegistry = registry,
+        speech_rms_threshold: float = 500.0,
+        log_every: int = 10,
+    ) -> None:
+        self.registry: LatencyRegistry = registry
+        self.speech_rms_threshold: float = speech_rms_threshold
+        self.log_every: int = log_every
+        self.utterances: int = 0
+        self._last_voiced_at: Optional[float] = None
+        self._speech_end: Optional[float] = None
+        self._utterance: Optional[Dict[str, float]] = None
+        self._pending_since: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def observe_audio_input(self, stream: rt.AudioStream) -> None:
+        """Track when the user was last heard speaking on the input audio."""
+        self._observe(stream, self._on_audio_input)
+
+    def observe_stt(self, stream: rt.TextStream) -> None:
+        self._observe(stream, self._on_stt)
+
+    def observe_llm_input(self, stream: rt.TextStream) -> None:
+        self._observe(stream, self._on_llm_input)
+
+    def observe_llm_output(self, stream: rt.TextStream) -> None:
+        self._observe(stream, self._on_llm_token)
+
+    def observe_aggregator_output(self, stream: rt.TextStream) -> None:
+        self._observe(stream, self._on_chunk)
+
+    def observe_tts_output(self, stream: rt.AudioStream) -> None:
+        self._observe(stream, self._on_audio_output)
+
+    def _observe(self, stream, callback) -> None:
+        clone = stream.clone()
+
+        async def consume() -> None:
+            while True:
+                item = await clone.get()
+                try:
+                    callback(item, time.monotonic())
+                except Exception as e:
+                    logger.error("Error in latency tracer: %s", e)
+
+        self._tasks.append(asyncio.create_task(consume()))
+
+    def _on_audio_input(self, audio_data: rt.AudioData, now: float) -> None:
+        samples = np.frombuffer(audio_data.get_bytes(), dtype=np.int16)
+        if (
+            samples.size
+            and np.sqrt(np.mean(samples.astype(np.float32) ** 2))
+            > self.speech_rms_threshold
+        ):
+            self._last_voiced_at = now
+
+    def _on_stt(self, transcript: str, now: float) -> None:
+        if transcript and self._last_voiced_at is not None:
+            self.registry.observe("stt_final_latency", now - self._last_voiced_at)
+            self._speech_end = self._last_voiced_at
+
+    def _on_llm_input(self, text: Optional[str], now: float) -> None:
+        if not text:
+            return
+        self._finish_utterance()
+        self._utterance = {"llm_input": now}
+        # Typed text has no speech to attribute, so only use a speech end that
+        # was claimed by a transcript.
+        if self._speech_end is not None:
+            self._utterance["speech_end"] = self._speech_end
+            self._speech_end = None
+        self._pending_since = None
+
+    def _on_llm_token(self, token: Optional[str], now: float) -> None:
+        if self._utterance is None:
+            return
+        if token is None:
+            self._utterance.setdefault("llm_end", now)
+            return
+        if "llm_first_token" not in self._utterance:
+            self._utterance["llm_first_token"] = now
+            self.registry.observe(
+                "llm_time_to_first_token", now - self._utterance["llm_input"]
+            )
+        if self._pending_since is None:
+            self._pending_since = now
+
+    def _on_chunk(self, chunk: Optional[str], now: float) -> None:
+        if self._utterance is None or not chunk:
+            return
+        if self._pending_since is not None:
+            self.registry.observe("aggregator_hold", now - self._pending_since)
+            self._pending_since = None
+        self._utterance.setdefault("first_chunk", now)
+
+    def _on_audio_output(self, audio_data: Optional[rt.AudioData], now: float) -> None:
+        if self._utterance is None:
+            return
+        if audio_data is None:
+            if "llm_end" in self._utterance:
+                self._finish_utterance()
+            return
+        if "first_audio" in self._utterance:
+            return
+        self._utterance["first_audio"] = now
+        if "first_chunk" in self._utterance:
+            self.registry.observe(
+                "tts_time_to_first_byte", now - self._utterance["first_chunk"]
+            )
+        start = self._utterance.get("speech_end", self._utterance["llm_input"])
+        self.registry.observe("time_to_first_audio", now - start)
+
+    def _finish_utterance(self) -> None:
+        if self._utterance is None:
+            return
+        start = self._utterance["llm_input"]
+        logger.info(
+            "latency_trace %s",
+            json.dumps(
+                {
+                    "utterance": self.utterances,
+                    **{k: round(v - start, 4) for k, v in self._utterance.items()},
+                }
+            ),
+        )
+        self._utterance = None
+        self.utterances += 1
+        if self.utterances % self.log_every == 0:
+            logger.info("latency_summary %s", json.dumps(self.registry.summary()))
+
+    async def close(self) -> None:
+        """Stop observing the pipeline and log the utterance in progress."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._finish_utterance()
@@ -6,20 +6,26 @@ logging.basicConfig(level=logging.INFO)
 
 import realtime
 from realtime.plugins.eleven_labs_tts import ElevenLabsTTS
-from realtime.plugins.token_aggregator import TokenAggregator
 from realtime.plugins.deepgram_stt import DeepgramSTT
 from realtime.plugins.gemini_vision import GeminiVision
-from realtime.plugins.key_frame_detector import KeyFrameDetector
 from realtime.streams import AudioStream, VideoStream, Stream, TextStream, ByteStream
 from realtime.plugins.audio_convertor import AudioConverter
 
+from adaptive_aggregator import AdaptiveTokenAggregator
+from bounded_stream import monitor, pipe
+from ring_buffer import RingBuffer, VideoRingReader
+from keyframe_selector import KeyFrameSelector
+
 
 @realtime.App()
 class PokerCommentator:
     async def setup(self):
         self.deepgram_node = DeepgramSTT(sample_rate=8000)
-        self.keyframe_node = KeyFrameDetector(
-            key_frame_threshold=0.2, key_frame_max_time=15
+        # The table and cards are in the bottom left quadrant of the stream.
+        # Sending at most 6 keyframes a minute keeps the vision calls, and
+        # so the commentary cost and latency, bounded during fast hands.
+        self.keyframe_node = KeyFrameSelector(
+            roi=(0.0, 0.5, 0.5, 1.0), max_interval=15, max_per_minute=6
         )
         self.llm_node = GeminiVision(
             system_prompt="You are a poker commentator. Your job is to provide useful and deep insights on the strategy. Use exclamation points to show excitement. Do not mention the pot size. Make sure to read the cards correctly. If no cards are shown then just say something to pass time. Comment on the latest move. Do not state the obvious. Do not assume anything if no action is visible. Mention player names. Keep the response within 1-2 sentences. Do not mention all-in. Do not say tough spot or great spot. For example:\n\n 1. The table is silent, waiting for the next move as the dealer flips the turn card.\n2. Sara folds, deciding not to risk more chips on a weak hand.\n3. The dealer flips the turn card, and Alex bets 100 chips.",
@@ -27,7 +33,7 @@ class PokerCommentator:
             temperature=0.9,
             chat_history=True,
         )
-        self.token_aggregator_node = TokenAggregator()
+        self.token_aggregator_node = AdaptiveTokenAggregator()
         self.tts_node = ElevenLabsTTS(
             optimize_streaming_latency=3,
             voice_id="iF9Lv1Pii7eCFPy5XZlZ",
@@ -40,7 +46,18 @@ class PokerCommentator:
     ) -> Tuple[Stream, ...]:
         deepgram_stream: TextStream = await self.deepgram_node.run(audio_input_stream)
 
-        key_frame_stream: VideoStream = await self.keyframe_node.run(video_input_stream)
+        # Both branches read the video through their own cursor on one ring
+        # buffer. The keyframe selector only looks at the latest frame, and
+        # the echoed video skips old frames if the transport falls behind.
+        video_buffer = RingBuffer(capacity=8, name="video_input")
+        keyframe_video = video_buffer.reader(
+            VideoRingReader, name="keyframe_video", max_lag=1
+        )
+        output_video_stream = video_buffer.reader(VideoRingReader, name="output_video")
+        pipe(video_input_stream, video_buffer)
+        monitor([video_buffer])
+
+        key_frame_stream: VideoStream = await self.keyframe_node.run(keyframe_video)
 
         llm_token_stream: TextStream
         chat_history_stream: TextStream
@@ -54,7 +71,6 @@ class PokerCommentator:
 
         tts_stream: ByteStream = await self.tts_node.run(token_aggregator_stream)
 
-        output_video_stream = await video_input_stream.clone()
         audio_stream: AudioStream = await self.audio_convertor_node.run(tts_stream)
 
         return audio_stream, chat_history_stream, output_video_stream
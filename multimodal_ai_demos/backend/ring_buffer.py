@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Type
+
+from realtime.streams import AudioStream, VideoStream
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    A single-producer, multi-consumer ring buffer for fanning out a stream.
+
+    Every item is stored once, and each consumer reads it through a reader
+    that only advances its own cursor. A slot is cleared, and the frame in it
+    freed, as soon as every reader has passed it.
+
+    When the producer laps a reader, a reader created with `skip_ahead`
+    loses its oldest unread items; otherwise `put()` waits until that reader
+    catches up. `put_nowait()` cannot wait, so it always skips laggards
+    ahead. Readers can also be limited to the latest `max_lag` items, e.g.
+    one for a vision model that should only ever see the newest frame.
+
+    Args:
+        capacity (int): The number of slots.
+        name (str): The name used in stats.
+    """
+
+    def __init__(self, capacity: int = 64, name: str = "ring_buffer") -> None:
+        self.capacity: int = capacity
+        self.name: str = name
+        self._slots: List[Any] = [None] * capacity
+        # Sequence numbers: the next item is written at `_head`, and every
+        # item before `_tail` has been read by all readers.
+        self._head: int = 0
+        self._tail: int = 0
+        self._readers: List["RingReaderMixin"] = []
+        self._written: asyncio.Event = asyncio.Event()
+        self._read: asyncio.Event = asyncio.Event()
+        self.puts: int = 0
+        self.stall_time: float = 0.0
+
+    def reader(
+        self,
+        reader_class: Type["RingReaderMixin"],
+        name: str,
+        max_lag: Optional[int] = None,
+        skip_ahead: bool = True,
+        **kwargs,
+    ) -> "RingReaderMixin":
+        """
+        Create a reader that starts at the next item written.
+
+        Args:
+            reader_class (Type[RingReaderMixin]): The reader class, e.g. AudioRingReader or VideoRingReader.
+            name (str): The name used in stats.
+            max_lag (Optional[int]): Only the latest `max_lag` unread items are kept for this reader.
+            skip_ahead (bool): Whether the producer skips this reader ahead rather than waiting for it.
+            **kwargs: Passed to the stream class, e.g. sample_rate.
+        """
+        reader = reader_class(
+            self, name=name, max_lag=max_lag, skip_ahead=skip_ahead, **kwargs
+        )
+        self._readers.append(reader)
+        return reader
+
+    def _notify(self, attribute: str) -> None:
+        # Wake everyone waiting on the current event and start a new one.
+        getattr(self, attribute).set()
+        setattr(self, attribute, asyncio.Event())
+
+    def _release(self) -> None:
+        """Clear the slots every reader has passed."""
+        tail = min((reader.cursor for reader in self._readers), default=self._head)
+        for seq in range(self._tail, tail):
+            self._slots[seq % self.capacity] = None
+        self._tail = max(self._tail, tail)
+
+    def _write(self) -> None:
+        for reader in self._readers:
+            if self._head - reader.cursor >= self.capacity:
+                reader._skip_to(self._head - self.capacity + 1)
+        self._release()
+
+    def put_nowait(self, item: Any) -> None:
+        self._write()
+        self._slots[self._head % self.capacity] = item
+        self._head += 1
+        self.puts += 1
+        self._notify("_written")
+
+    async def put(self, item: Any) -> None:
+        start = None
+        while any(
+            not reader.skip_ahead and self._head - reader.cursor >= self.capacity
+            for reader in self._readers
+        ):
+            start = start or time.monotonic()
+            await self._read.wait()
+        if start is not None:
+            self.stall_time += time.monotonic() - start
+        self.put_nowait(item)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": self._head - self._tail,
+            "puts": self.puts,
+            "stall_ms": round(self.stall_time * 1000),
+            "readers": {reader.name: reader.stats() for reader in self._readers},
+        }
+
+
+class RingReaderMixin:
+    """
+    One consumer's view of a `RingBuffer`, usable wherever a stream is read.
+
+    Mixed into the realtime stream classes below, so readers can be passed
+    to plugins and returned from endpoints. Only the reading side of the
+    queue interface is backed by the ring buffer.
+
+    Args:
+        buffer (RingBuffer): The buffer to read from.
+        name (str): The name used in stats.
+        max_lag (Optional[int]): Only the latest `max_lag` unread items are kept.
+        skip_ahead (bool): Whether the producer skips this reader ahead rather than waiting for it.
+    """
+
+    def __init__(
+        self,
+        buffer: RingBuffer,
+        *args,
+        name: str = "reader",
+        max_lag: Optional[int] = None,
+        skip_ahead: bool = True,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.buffer: RingBuffer = buffer
+        self.name: str = name
+        self.max_lag: Optional[int] = max_lag
+        self.skip_ahead: bool = skip_ahead
+        self.cursor: int = buffer._head
+        self.reads: int = 0
+        self.skipped: int = 0
+        self.max_depth: int = 0
+
+    def _skip_to(self, cursor: int) -> None:
+        if cursor > self.cursor:
+            self.skipped += cursor - self.cursor
+            self.cursor = cursor
+
+    def qsize(self) -> int:
+        depth = self.buffer._head - self.cursor
+        return depth if self.max_lag is None else min(depth, self.max_lag)
+
+    def empty(self) -> bool:
+        return self.cursor >= self.buffer._head
+
+    def full(self) -> bool:
+        return False
+
+    def get_nowait(self) -> Any:
+        if self.empty():
+            raise asyncio.QueueEmpty
+        depth = self.buffer._head - self.cursor
+        self.max_depth = max(self.max_depth, depth)
+        if self.max_lag is not None:
+            self._skip_to(self.buffer._head - self.max_lag)
+        item = self.buffer._slots[self.cursor % self.buffer.capacity]
+        self.cursor += 1
+        self.reads += 1
+        self.buffer._release()
+        self.buffer._notify("_read")
+        return item
+
+    async def get(self) -> Any:
+        while self.empty():
+            await self.buffer._written.wait()
+        return self.get_nowait()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.qsize(),
+            "max_depth": self.max_depth,
+            "reads": self.reads,
+            "skipped": self.skipped,
+        }
+
+
+class AudioRingReader(RingReaderMixin, AudioStream):
+    pass
+
+
+class VideoRingReader(RingReaderMixin, VideoStream):
+    pass
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from typing import List, Optional, Tuple
+
+import aiohttp
+
+import realtime as rt
+from realtime_examples.pools import DeepgramPool, PooledDeepgramSTT, PooledFireworksLLM
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_transcript(text: str) -> str:
+    """Lowercase `text` and strip punctuation so that interim and final transcripts compare equal."""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+class InterimTranscripts:
+    """
+    A Deepgram websocket that also copies the interim transcripts it receives to a queue.
+
+    Messages are passed on unchanged, so the plugin's receive loop still
+    handles the final transcripts.
+
+    Args:
+        ws (aiohttp.ClientWebSocketResponse): The Deepgram websocket.
+        queue (rt.TextStream): Where interim transcripts are sent.
+        confidence_threshold (float): The minimum confidence of a transcript to send.
+    """
+
+    def __init__(
+        self,
+        ws: aiohttp.ClientWebSocketResponse,
+        queue: rt.TextStream,
+        confidence_threshold: float,
+    ) -> None:
+        self.ws: aiohttp.ClientWebSocketResponse = ws
+        self.queue: rt.TextStream = queue
+        self.confidence_threshold: float = confidence_threshold
+
+    async def receive(self) -> aiohttp.WSMessage:
+        msg = await self.ws.receive()
+        if msg.type == aiohttp.WSMsgType.TEXT:
+            data = json.loads(msg.data)
+            if data.get("is_final") is False:
+                top_choice = data["channel"]["alternatives"][0]
+                if (
+                    top_choice["transcript"]
+                    and top_choice["confidence"] > self.confidence_threshold
+                ):
+                    await self.queue.put(top_choice["transcript"])
+        return msg
+
+
+class PooledInterimDeepgramSTT(PooledDeepgramSTT):
+    """
+    PooledDeepgramSTT that also reports interim transcripts.
+
+    Final transcripts are sent to the output stream exactly like
+    PooledDeepgramSTT. Interim transcripts for the segment currently being
+    spoken are sent to `interim_queue`. The pool must be created with
+    `interim_results=True`.
+
+    Args:
+        pool (DeepgramPool): The pool to lease the connection from.
+    """
+
+    def __init__(self, pool: DeepgramPool) -> None:
+        super().__init__(pool)
+        self.interim_queue: rt.TextStream = rt.TextStream()
+
+    def run(self, input_queue: asyncio.Queue) -> Tuple[rt.TextStream, rt.TextStream]:
+        return super().run(input_queue), self.interim_queue
+
+    async def _recv_task(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        await super()._recv_task(
+            InterimTranscripts(ws, self.interim_queue, self.confidence_threshold)
+        )
+
+
+class Generation:
+    """
+    A single LLM completion whose tokens are held back until it is committed.
+
+    Args:
+        text (str): The user text the completion was started from.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text: str = text
+        self.key: str = normalize_transcript(text)
+        self.tokens: List[str] = []
+        self.committed: bool = False
+        self.done: asyncio.Event = asyncio.Event()
+        self.started_at: float = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class SpeculativeFireworksLLM(PooledFireworksLLM):
+    """
+    PooledFireworksLLM that starts generating from stable interim transcripts.
+
+    An interim transcript is stable once Deepgram repeats it unchanged. A
+    speculative completion is then started in the background and its tokens are
+    buffered. When the final transcript arrives and matches the speculation, the
+    buffered tokens are flushed and the rest stream through as usual, so the
+    aggregator and TTS only ever see committed text. If the final transcript
+    diverges, the speculation is cancelled and the turn is regenerated.
+
+    Args:
+        **kwargs: Passed through to PooledFireworksLLM.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._speculation: Optional[Generation] = None
+        self._last_interim: Optional[str] = None
+        self._interim_task: Optional[asyncio.Task] = None
+        self.speculations: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def run(
+        self, input_queue: rt.TextStream, interim_queue: rt.TextStream
+    ) -> Tuple[rt.TextStream, rt.TextStream]:
+        """
+        Start the LLM.
+
+        Args:
+            input_queue (rt.TextStream): Final user text, one message per turn.
+            interim_queue (rt.TextStream): Interim transcripts to speculate on.
+
+        Returns:
+            Tuple[rt.TextStream, rt.TextStream]: The token stream and the chat history stream.
+        """
+        self.input_queue = input_queue
+        self.interim_queue = interim_queue
+        self._task = asyncio.create_task(self._handle_final())
+        self._interim_task = asyncio.create_task(self._handle_interim())
+        return self.output_queue, self.chat_history_queue
+
+    async def close(self) -> None:
+        await super().close()
+        if self._interim_task:
+            self._interim_task.cancel()
+        self._cancel_speculation()
+
+    def _start(self, text: str, messages: list) -> Generation:
+        generation = Generation(text)
+        generation.task = asyncio.create_task(self._generate(generation, messages))
+        return generation
+
+    def _cancel_speculation(self) -> None:
+        if self._speculation is not None:
+            self._speculation.task.cancel()
+            self._speculation = None
+
+    async def _generate(self, generation: Generation, messages: list) -> None:
+        try:
+            chunk_stream = await self._client.chat.completions.create(
+                model=self._model,
+                stream=True,
+                messages=messages,
+                temperature=self._temperature,
+            )
+            async for chunk in chunk_stream:
+                if len(chunk.choices) == 0 or not chunk.choices[0].delta.content:
+                    continue
+                token = chunk.choices[0].delta.content
+                if generation.first_token_at is None:
+                    generation.first_token_at = time.monotonic()
+                generation.tokens.append(token)
+                if generation.committed:
+                    self.output_queue.put_nowait(token)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error streaming chat completions: %s", e)
+        finally:
+            generation.done.set()
+
+    async def _handle_interim(self) -> None:
+        while True:
+            text = await self.interim_queue.get()
+            # Don't speculate while a committed turn is still speaking, since its
+            # reply is not in the history yet.
+            if not text or self._generating:
+                self._last_interim = None
+                continue
+            key = normalize_transcript(text)
+            stable = key == self._last_interim
+            self._last_interim = key
+            if not stable or (
+                self._speculation is not None and self._speculation.key == key
+            ):
+                continue
+            self._cancel_speculation()
+            self.speculations += 1
+            self._speculation = self._start(
+                text, self._history + [{"role": "user", "content": text}]
+            )
+
+    async def _handle_final(self) -> None:
+        while True:
+            text = await self.input_queue.get()
+            if text is None:
+                continue
+            self._generating = True
+            self._last_interim = None
+            generation = self._speculation
+            self._speculation = None
+            if generation is not None and generation.key == normalize_transcript(text):
+                self.hits += 1
+                head_start = time.monotonic() - generation.started_at
+                logger.info("Speculation hit, %.0f ms head start", head_start * 1000)
+            else:
+                if generation is not None:
+                    self.misses += 1
+                    generation.task.cancel()
+                generation = self._start(
+                    text, self._history + [{"role": "user", "content": text}]
+                )
+
+            self._history.append({"role": "user", "content": text})
+            self.chat_history_queue.put_nowait(json.dumps(self._history[-1]))
+
+            # Flush what the speculation has buffered, then let the rest stream.
+            for token in generation.tokens:
+                self.output_queue.put_nowait(token)
+            generation.committed = True
+            await generation.done.wait()
+
+            self._history.append(
+                {"role": "assistant", "content": "".join(generation.tokens)}
+            )
+            logger.info("llm: %s", self._history[-1]["content"])
+            self.chat_history_queue.put_nowait(json.dumps(self._history[-1]))
+            logger.info(
+                "Speculation stats: started=%d hits=%d misses=%d",
+                self.speculations,
+                self.hits,
+                self.misses,
+            )
+            self._generating = False
+            await self.output_queue.put(None)
@@ -0,0 +1,619 @@
+import asyncio
+import contextlib
+import hashlib
+import inspect
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import realtime as rt
+
+logger = logging.getLogger(__name__)
+
+# In-memory budget for cached audio, in bytes.
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Directory for the on-disk tier; set to an empty string to disable it.
+TTS_CACHE_DIRECTORY = os.getenv(
+    "TTS_CACHE_DIRECTORY", os.path.join(tempfile.gettempdir(), "tts_cache")
+)
+TTS_CACHE_MAX_DISK_BYTES = int(os.getenv("TTS_CACHE_MAX_DISK_BYTES", 512 * 1024 * 1024))
+# Longer phrases rarely repeat, so they are synthesized but not cached.
+TTS_CACHE_MAX_PHRASE_CHARS = int(os.getenv("TTS_CACHE_MAX_PHRASE_CHARS", 160))
+# Seconds to wait for the next audio chunk of a phrase before giving up on it.
+TTS_CACHE_SYNTHESIS_TIMEOUT = float(os.getenv("TTS_CACHE_SYNTHESIS_TIMEOUT", 15))
+
+
+def normalize_phrase(text: str) -> str:
+    """Collapse whitespace and case; punctuation is kept since it changes the intonation."""
+    return " ".join(text.lower().split())
+
+
+class CachedPhrase:
+    """
+    Synthesized audio for a single phrase.
+
+    Args:
+        chunks (List[bytes]): The PCM audio chunks in the order the TTS produced them.
+        sample_rate (int): The sample rate of the audio.
+        channels (int): The number of audio channels.
+        sample_width (int): The width of each sample in bytes.
+        visemes (Optional[str]): The final viseme message for the phrase, if the TTS produces visemes.
+    """
+
+    def __init__(
+        self,
+        chunks: List[bytes],
+        sample_rate: int,
+        channels: int = 1,
+        sample_width: int = 2,
+        visemes: Optional[str] = None,
+    ) -> None:
+        self.chunks: List[bytes] = chunks
+        self.sample_rate: int = sample_rate
+        self.channels: int = channels
+        self.sample_width: int = sample_width
+        self.visemes: Optional[str] = visemes
+
+    @property
+    def size(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks) + len(self.visemes or "")
+
+    def audio_data(self) -> List[rt.AudioData]:
+        return [
+            rt.AudioData(
+                chunk,
+                sample_rate=self.sample_rate,
+                channels=self.channels,
+                sample_width=self.sample_width,
+            )
+            for chunk in self.chunks
+        ]
+
+
+class TTSCache:
+    """
+    LRU cache of synthesized phrases with an on-disk tier.
+
+    Phrases are kept in memory up to `max_bytes`. When a directory is given,
+    every phrase is also written to disk, where the least recently used files
+    are evicted beyond `max_disk_bytes`. A memory miss falls back to disk and
+    promotes the phrase back into memory.
+
+    Args:
+        max_bytes (int): The in-memory budget in bytes.
+        directory (Optional[str]): Where to store phrases on disk, or None to keep them in memory only.
+        max_disk_bytes (int): The on-disk budget in bytes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = TTS_CACHE_MAX_BYTES,
+        directory: Optional[str] = TTS_CACHE_DIRECTORY,
+        max_disk_bytes: int = TTS_CACHE_MAX_DISK_BYTES,
+    ) -> None:
+        self.max_bytes: int = max_bytes
+        self.directory: Optional[str] = directory or None
+        self.max_disk_bytes: int = max_disk_bytes
+        self._entries: "OrderedDict[str, CachedPhrase]" = OrderedDict()
+        self._bytes: int = 0
+        self.hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(provider: str, voice_id: str, sample_rate: int, text: str) -> str:
+        return hashlib.sha256(
+            json.dumps(
+                [provider, voice_id, sample_rate, normalize_phrase(text)]
+            ).encode()
+        ).hexdigest()
+
+    async def get(self, key: str) -> Optional[CachedPhrase]:
+        phrase = self._entries.get(key)
+        if phrase is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return phrase
+        if self.directory:
+            phrase = await asyncio.to_thread(self._read, key)
+            if phrase is not None:
+                self._remember(key, phrase)
+                self.hits += 1
+                self.disk_hits += 1
+                return phrase
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, phrase: CachedPhrase) -> None:
+        self._remember(key, phrase)
+        if self.directory:
+            await asyncio.to_thread(self._write, key, phrase)
+
+    def _remember(self, key: str, phrase: CachedPhrase) -> None:
+        if phrase.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).size
+        self._entries[key] = phrase
+        self._bytes += phrase.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    def _read(self, key: str) -> Optional[CachedPhrase]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.read(int.from_bytes(f.read(4), "big")))
+                audio = f.read()
+        except (OSError, ValueError):
+            return None
+        # Touch the file so eviction is least-recently-used. Another process
+        # may have evicted it since it was read.
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        chunks, offset = [], 0
+        for length in header["chunks"]:
+            chunks.append(audio[offset : offset + length])
+            offset += length
+        return CachedPhrase(
+            chunks,
+            header["sample_rate"],
+            header["channels"],
+            header["sample_width"],
+            header["visemes"],
+        )
+
+    def _write(self, key: str, phrase: CachedPhrase) -> None:
+        header = json.dumps(
+            {
+                "chunks": [len(chunk) for chunk in phrase.chunks],
+                "sample_rate": phrase.sample_rate,
+                "channels": phrase.channels,
+                "sample_width": phrase.sample_width,
+                "visemes": phrase.visemes,
+            }
+        ).encode()
+        # Written under a unique name, since other sessions or processes may
+        # be writing the same phrase.
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as f:
+            f.write(len(header).to_bytes(4, "big"))
+            f.write(header)
+            f.write(b"".join(phrase.chunks))
+        os.replace(f.name, self._path(key))
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            # Files still being written are left alone.
+            if not name.endswith(".pcm"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            # Another process sharing the directory may have evicted it first.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+
+tts_cache = TTSCache()
+
+
+def _split_chunks(chunks: List[bytes], offsets: List[int]) -> List[List[bytes]]:
+    """Split audio chunks at the given byte offsets, keeping their sizes elsewhere."""
+    parts: List[List[bytes]] = [[]]
+    position = 0
+    offsets = list(offsets)
+    for chunk in chunks:
+        while offsets and offsets[0] < position + len(chunk):
+            head = max(offsets.pop(0) - position, 0)
+            if head:
+                parts[-1].append(chunk[:head])
+            chunk = chunk[head:]
+            position += head
+            parts.append([])
+        if chunk:
+            parts[-1].append(chunk)
+        position += len(chunk)
+    parts.extend([] for _ in offsets)
+    return parts
+
+
+class CachedTTS:
+    """
+    A caching stage in front of a TTS node.
+
+    Each phrase from the token aggregator is looked up by provider, voice,
+    sample rate and normalized text. Hits are replayed as audio frames (and
+    visemes, for TTS nodes that produce them) in their place in the response.
+    Misses are passed on to the wrapped TTS node, whose audio is forwarded as
+    it arrives and split back into phrases to be stored for next time.
+
+    How the audio is split depends on the node:
+
+    - Nodes that keep a context open across chunks, such as PooledCartesiaTTS,
+      must put word timestamps on a `timestamp_stream`. Consecutive misses are
+      streamed into one context, so the voice keeps its prosody from one
+      sentence to the next, and the context is only closed at the end of the
+      response or ahead of a hit. Its audio is split at the first word of each
+      phrase, and a single None ends the response, as without the cache.
+    - Other nodes, such as AzureTTS and ElevenLabsTTS, synthesize each chunk on
+      its own and end its audio with a None. They are sent one phrase at a
+      time, and the audio and viseme streams get a None after each phrase.
+
+    Args:
+        tts_node: The TTS node to wrap, e.g. PooledCartesiaTTS or rt.AzureTTS.
+        provider (str): The TTS provider name, part of the cache key.
+        voice_id (str): The voice the node synthesizes with, part of the cache key.
+        sample_rate (int): The output sample rate of the node, part of the cache key.
+        cache (TTSCache): The cache to use, shared across sessions by default.
+        max_phrase_chars (int): Phrases longer than this are not cached.
+        synthesis_timeout (float): Seconds to wait for the next audio chunk of a
+            phrase. A phrase that times out is ended early and not cached.
+    """
+
+    def __init__(
+        self,
+        tts_node,
+        provider: str,
+        voice_id: str,
+        sample_rate: int,
+        cache: TTSCache = tts_cache,
+        max_phrase_chars: int = TTS_CACHE_MAX_PHRASE_CHARS,
+        synthesis_timeout: float = TTS_CACHE_SYNTHESIS_TIMEOUT,
+    ) -> None:
+        self.tts_node = tts_node
+        self.provider: str = provider
+        self.voice_id: str = voice_id
+        self.sample_rate: int = sample_rate
+        self.cache: TTSCache = cache
+        self.max_phrase_chars: int = max_phrase_chars
+        self.synthesis_timeout: float = synthesis_timeout
+        self.output_queue = type(tts_node.output_queue)()
+        # Nodes that report word timestamps get whole responses in one context.
+        self._streaming: bool = hasattr(tts_node, "timestamp_stream")
+        self.viseme_stream: Optional[rt.TextStream] = (
+            rt.TextStream()
+            if hasattr(tts_node, "viseme_stream") and not self._streaming
+            else None
+        )
+        self._tts_input: rt.TextStream = rt.TextStream()
+        self._last_visemes: Optional[str] = None
+        self._generating: bool = False
+        # Set after a phrase timed out or was interrupted, since its audio may
+        # still arrive late.
+        self._out_of_sync: bool = False
+        # The (text, key) of each phrase sent into the current context, which
+        # is open until an empty chunk is sent and owed audio until the node's
+        # end marker.
+        self._context: List[Tuple[str, Optional[str]]] = []
+        self._context_open: bool = False
+        self._context_chunks: List[rt.AudioData] = []
+        self._context_done: asyncio.Event = asyncio.Event()
+        self._last_received: float = 0.0
+        self._start_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self._receive_task: Optional[asyncio.Task] = None
+        self._viseme_task: Optional[asyncio.Task] = None
+        self._interrupt_task: Optional[asyncio.Task] = None
+
+    def run(self, input_queue: rt.TextStream):
+        """
+        Start the caching stage.
+
+        Args:
+            input_queue (rt.TextStream): The phrases to synthesize, with a None
+                at the end of each response.
+
+        Returns:
+            The audio output stream, plus the viseme stream if the wrapped node produces visemes.
+        """
+        self.input_queue = input_queue
+        self._start_task = asyncio.create_task(self._start())
+        if self.viseme_stream is not None:
+            return self.output_queue, self.viseme_stream
+        return self.output_queue
+
+    async def _start(self) -> None:
+        result = self.tts_node.run(self._tts_input)
+        if inspect.isawaitable(result):
+            await result
+        if self._streaming:
+            self._receive_task = asyncio.create_task(self._receive())
+        if self.viseme_stream is not None:
+            self._viseme_task = asyncio.create_task(self._forward_visemes())
+        self._task = asyncio.create_task(self._synthesize_phrases())
+
+    @property
+    def generating(self) -> bool:
+        return self._generating
+
+    async def _forward_visemes(self) -> None:
+        while True:
+            visemes = await self.tts_node.viseme_stream.get()
+            self._last_visemes = visemes
+            self.viseme_stream.put_nowait(visemes)
+
+    async def _synthesize_phrases(self) -> None:
+        while True:
+            text = await self.input_queue.get()
+            if text is None:
+                # Nodes that synthesize phrase by phrase have ended each one.
+                if self._streaming:
+                    await self._close_context()
+                    self.output_queue.put_nowait(None)
+                continue
+            if not text.strip():
+                continue
+            key = None
+            if len(text) <= self.max_phrase_chars:
+                key = TTSCache.key(self.provider, self.voice_id, self.sample_rate, text)
+                phrase = await self.cache.get(key)
+                if phrase is not None:
+                    logger.info("TTS cache hit: %s", text)
+                    if self._streaming:
+                        # The audio of the phrases before it plays first.
+                        await self._close_context()
+                    self._replay(phrase)
+                    continue
+            if self._streaming:
+                self._stream(text, key)
+            else:
+                await self._synthesize(text, key)
+
+    def _replay(self, phrase: CachedPhrase) -> None:
+        if self.viseme_stream is not None:
+            if phrase.visemes is not None:
+                self.viseme_stream.put_nowait(phrase.visemes)
+            self.viseme_stream.put_nowait(None)
+        for audio_data in phrase.audio_data():
+            self.output_queue.put_nowait(audio_data)
+        if not self._streaming:
+            self.output_queue.put_nowait(None)
+
+    def _stream(self, text: str, key: Optional[str]) -> None:
+        if not self._context_open:
+            # Timestamps left by a context that was interrupted are stale.
+            while not self.tts_node.timestamp_stream.empty():
+                self.tts_node.timestamp_stream.get_nowait()
+            self._context_chunks = []
+            self._context_done.clear()
+            self._context_open = True
+            self._generating = True
+        self._context.append((text, key))
+        self._tts_input.put_nowait(text)
+
+    async def _close_context(self) -> None:
+        """End the open context and wait for the rest of its audio."""
+        if not self._context_open:
+            return
+        self._context_open = False
+        self._tts_input.put_nowait("")
+        loop = asyncio.get_running_loop()
+        self._last_received = loop.time()
+        while not self._context_done.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._context_done.wait(),
+                    self._last_received + self.synthesis_timeout - loop.time(),
+                )
+            except asyncio.TimeoutError:
+                if loop.time() - self._last_received < self.synthesis_timeout:
+                    continue
+                logger.error(
+                    "TTS produced no audio for %.1fs, skipping: %s",
+                    self.synthesis_timeout,
+                    " ".join(text for text, _ in self._context),
+                )
+                self._context = []
+                self._generating = False
+                self._out_of_sync = True
+                return
+
+    async def _receive(self) -> None:
+        while True:
+            audio_data = await self.tts_node.output_queue.get()
+            self._last_received = asyncio.get_running_loop().time()
+            if not self._context:
+                # The rest of a context that was interrupted or timed out.
+                continue
+            if audio_data is not None:
+                self.output_queue.put_nowait(audio_data)
+                self._context_chunks.append(audio_data)
+                continue
+            if self._context_open:
+                # Not the end of this context, which is still open, but of one
+                # dropped before it. Its audio may be mixed into this one.
+                self._out_of_sync = True
+                continue
+            phrases, self._context = self._context, []
+            chunks, self._context_chunks = self._context_chunks, []
+            out_of_sync, self._out_of_sync = self._out_of_sync, False
+            self._generating = False
+            self._context_done.set()
+            if not out_of_sync:
+                await self._store_context(phrases, chunks)
+
+    async def _store_context(
+        self, phrases: List[Tuple[str, Optional[str]]], chunks: List[rt.AudioData]
+    ) -> None:
+        """Split the audio of a context into its phrases and cache them."""
+        starts = []
+        while not self.tts_node.timestamp_stream.empty():
+            starts.extend(self.tts_node.timestamp_stream.get_nowait()["start"])
+        counts = [len(text.split()) for text, _ in phrases]
+        if not chunks or len(starts) != sum(counts):
+            logger.warning(
+                "TTS returned %d word timestamps for %d words, not caching: %s",
+                len(starts),
+                sum(counts),
+                " ".join(text for text, _ in phrases),
+            )
+            return
+        audio_format = chunks[0]
+        frame_bytes = audio_format.channels * audio_format.sample_width
+        # Each phrase runs up to the first word of the next one.
+        offsets, words = [], 0
+        for count in counts[:-1]:
+            words += count
+            offsets.append(
+                round(starts[words] * audio_format.sample_rate) * frame_bytes
+            )
+        parts = _split_chunks(
+            [audio_data.get_bytes() for audio_data in chunks], offsets
+        )
+        for (_, key), part in zip(phrases, parts):
+            if key is not None and part:
+                await self._store(
+                    key,
+                    CachedPhrase(
+                        part,
+                        audio_format.sample_rate,
+                        audio_format.channels,
+                        audio_format.sample_width,
+                    ),
+                )
+
+    async def _synthesize(self, text: str, key: Optional[str]) -> None:
+        self._generating = True
+        self._last_visemes = None
+        if self._out_of_sync:
+            # Drop what arrived late for the phrase that timed out, and don't
+            # cache this phrase since more of that audio may still follow.
+            while not self.tts_node.output_queue.empty():
+                self.tts_node.output_queue.get_nowait()
+            key = None
+        self._tts_input.put_nowait(text)
+        chunks = []
+        audio_format = None
+        timed_out = False
+        while True:
+            try:
+                audio_data = await asyncio.wait_for(
+                    self.tts_node.output_queue.get(), self.synthesis_timeout
+                )
+            except asyncio.TimeoutError:
+                logger.error(
+                    "TTS produced no audio for %.1fs, skipping: %s",
+                    self.synthesis_timeout,
+                    text,
+                )
+                timed_out = True
+                break
+            if audio_data is None:
+                break
+            self.output_queue.put_nowait(audio_data)
+            chunks.append(audio_data.get_bytes())
+            audio_format = audio_data
+        self.output_queue.put_nowait(None)
+        if self.viseme_stream is not None:
+            # Visemes are sent ahead of their audio, so by now the wrapped
+            # node has produced all of them for this phrase.
+            while not self.tts_node.viseme_stream.empty():
+                self._last_visemes = self.tts_node.viseme_stream.get_nowait()
+                self.viseme_stream.put_nowait(self._last_visemes)
+            self.viseme_stream.put_nowait(None)
+        self._generating = False
+        self._out_of_sync = timed_out
+        if timed_out:
+            return
+        if key is not None and chunks:
+            await self._store(
+                key,
+                CachedPhrase(
+                    chunks,
+                    audio_format.sample_rate,
+                    audio_format.channels,
+                    audio_format.sample_width,
+                    self._last_visemes,
+                ),
+            )
+
+    async def _store(self, key: str, phrase: CachedPhrase) -> None:
+        await self.cache.put(key, phrase)
+        logger.info(
+            "TTS cache: hits=%d (disk %d) misses=%d",
+            self.cache.hits,
+            self.cache.disk_hits,
+            self.cache.misses,
+        )
+
+    async def close(self) -> None:
+        for task in (
+            self._start_task,
+            self._task,
+            self._receive_task,
+            self._viseme_task,
+            self._interrupt_task,
+        ):
+            if task:
+                task.cancel()
+        await self.tts_node.close()
+
+    def interrupt(self) -> List[asyncio.Task]:
+        """
+        Drop the phrases being synthesized, without caching them, and start afresh.
+
+        Text already handed to the wrapped node is dropped too, but the node
+        itself is not interrupted; audio it still produces for the dropped
+        phrases is discarded. An open context is closed, but nodes that keep
+        one should be interrupted along with the cache so that it is cancelled
+        rather than finished.
+
+        Returns:
+            List[asyncio.Task]: The cancelled tasks.
+        """
+        if self._task is None:
+            return []
+        old, self._task = self._task, asyncio.create_task(self._synthesize_phrases())
+        old.cancel()
+        for queue in (self._tts_input, self.tts_node.output_queue):
+            while not queue.empty():
+                queue.get_nowait()
+        if self._context_open:
+            self._tts_input.put_nowait("")
+            self._context_open = False
+        self._context = []
+        self._context_chunks = []
+        if self._generating:
+            self._out_of_sync = True
+            self._generating = False
+        return [old]
+
+    async def _interrupt(self) -> None:
+        while True:
+            user_speaking = await self.interrupt_queue.get()
+            if user_speaking and (self._generating or not self.output_queue.empty()):
+                self.interrupt()
+                while not self.output_queue.empty():
+                    self.output_queue.get_nowait()
+                logger.info("Done cancelling TTS cache")
+
+    async def set_interrupt(self, interrupt_queue: asyncio.Queue) -> None:
+        """
+        Set up the interrupt mechanism.
+
+        Args:
+            interrupt_queue (asyncio.Queue): The queue to receive interrupt signals from.
+        """
+        self.interrupt_queue = interrupt_queue
+        self._interrupt_task = asyncio.create_task(self._interrupt())
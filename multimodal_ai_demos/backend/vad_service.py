@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from realtime.utils.cloneable_queue import CloneableQueue
+
+logger = logging.getLogger(__name__)
+
+# Silero VAD v5 scores fixed windows of 256 samples at 8kHz and 512 at 16kHz,
+# prefixed with the tail of the previous window of the same stream.
+WINDOW_SAMPLES = {8000: 256, 16000: 512}
+CONTEXT_SAMPLES = {8000: 32, 16000: 64}
+# Windows a session may have waiting to be scored; the oldest are dropped
+# beyond this, e.g. while the model is failing. 32 is about 1s at 8kHz.
+VAD_MAX_PENDING_WINDOWS = int(os.getenv("VAD_MAX_PENDING_WINDOWS", 32))
+
+
+class VADSession:
+    """
+    One session's view of a `BatchedVADService`.
+
+    Behaves like the SileroVAD plugin: it reads audio frames from its input
+    queue and puts True on its output queue when the user starts speaking.
+    Windows are scored by the shared service, and the session keeps its own
+    recurrent state so that sessions don't disturb each other.
+
+    Args:
+        service (BatchedVADService): The service that scores this session's windows.
+        sensitivity_threshold (float): Speech probability above which a window counts as speech.
+        min_speech_windows (int): Consecutive speech windows needed to report speech.
+        max_pending (int): Windows kept waiting to be scored before the oldest are dropped.
+    """
+
+    def __init__(
+        self,
+        service: "BatchedVADService",
+        sensitivity_threshold: float = 0.91,
+        min_speech_windows: int = 3,
+        max_pending: int = VAD_MAX_PENDING_WINDOWS,
+    ) -> None:
+        self.service: BatchedVADService = service
+        self.sensitivity_threshold: float = sensitivity_threshold
+        self.min_speech_windows: int = min_speech_windows
+        self.max_pending: int = max_pending
+        self.output_queue: CloneableQueue = CloneableQueue()
+        self.user_speaking: bool = False
+        self.state: torch.Tensor = torch.zeros((2, 1, 128))
+        self.context: torch.Tensor = torch.zeros(
+            (1, CONTEXT_SAMPLES[service.sample_rate])
+        )
+        self.pending: Deque[np.ndarray] = deque()
+        self.dropped: int = 0
+        self._buffer: np.ndarray = np.zeros(0, dtype=np.float32)
+        self._speech_windows: int = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, input_queue: asyncio.Queue) -> CloneableQueue:
+        self.input_queue = input_queue
+        self.service.register(self)
+        self._task = asyncio.create_task(self._read_audio())
+        return self.output_queue
+
+    async def _read_audio(self) -> None:
+        window = WINDOW_SAMPLES[self.service.sample_rate]
+        while True:
+            audio_frame = await self.input_queue.get()
+            if audio_frame is None:
+                continue
+            if hasattr(audio_frame, "to_ndarray"):
+                samples = audio_frame.to_ndarray().reshape(-1)
+            else:
+                samples = np.frombuffer(audio_frame.get_bytes(), dtype=np.int16)
+            samples = samples.astype(np.float32) / 32768
+            self._buffer = np.concatenate((self._buffer, samples))
+            while len(self._buffer) >= window:
+                if len(self.pending) >= self.max_pending:
+                    self.pending.popleft()
+                    self.dropped += 1
+                    self.service.dropped_windows += 1
+                self.pending.append(self._buffer[:window])
+                self._buffer = self._buffer[window:]
+
+    def on_result(self, confidence: float) -> None:
+        """Called by the service with the speech probability of the oldest pending window."""
+        if confidence <= self.sensitivity_threshold:
+            self._speech_windows = 0
+            self.user_speaking = False
+            return
+        self._speech_windows += 1
+        if self._speech_windows >= self.min_speech_windows and not self.user_speaking:
+            self.user_speaking = True
+            self.output_queue.put_nowait(True)
+
+    async def close(self) -> None:
+        self.service.unregister(self)
+        if self._task:
+            self._task.cancel()
+
+
+class BatchedVADService:
+    """
+    A Silero VAD model shared by every session in the process.
+
+    On every tick, the oldest pending window of each active session is
+    stacked into one batch and scored in a single forward pass on a worker
+    thread. The model's recurrent state is swapped in from and back out to
+    the sessions around each pass, so every session keeps its own state.
+    Sessions with a backlog get another pass in the same tick. A window
+    is only taken off its session's queue once it has been scored, so a
+    failed pass is retried on the next tick.
+
+    The Silero model has no API for passing the state in, so the swap writes
+    the attributes the model keeps it in. They are checked when the service
+    starts, so a model with a different layout fails there rather than
+    mixing up sessions.
+
+    Args:
+        sample_rate (int): The sample rate of the session audio, 8000 or 16000.
+        tick (float): Seconds between batches.
+        max_batch_size (int): Maximum number of windows per forward pass.
+    """
+
+    def __init__(
+        self, sample_rate: int = 8000, tick: float = 0.02, max_batch_size: int = 64
+    ) -> None:
+        if sample_rate not in WINDOW_SAMPLES:
+            raise ValueError("Silero VAD only supports 8KHz and 16KHz sample rates")
+        self.sample_rate: int = sample_rate
+        self.tick: float = tick
+        self.max_batch_size: int = max_batch_size
+
+        torch.set_num_threads(1)
+        # Pinned, since batching relies on the v5 layout of the recurrent state.
+        self.model, _ = torch.hub.load(
+            repo_or_dir="snakers4/silero-vad:v5.1", model="silero_vad"
+        )
+        self._check_model()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._sessions: Dict[int, VADSession] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches: int = 0
+        self.windows: int = 0
+        self.dropped_windows: int = 0
+        self.inference_time: float = 0.0
+
+    def _check_model(self) -> None:
+        """Raise RuntimeError unless the model keeps its batched state where `_forward` swaps it."""
+        batch_size = 2
+        with torch.no_grad():
+            self.model(
+                torch.zeros(batch_size, WINDOW_SAMPLES[self.sample_rate]),
+                self.sample_rate,
+            )
+        state = getattr(self.model, "_state", None)
+        context = getattr(self.model, "_context", None)
+        if (
+            not isinstance(state, torch.Tensor)
+            or tuple(state.shape) != (2, batch_size, 128)
+            or not isinstance(context, torch.Tensor)
+            or tuple(context.shape) != (batch_size, CONTEXT_SAMPLES[self.sample_rate])
+            or getattr(self.model, "_last_sr", None) != self.sample_rate
+            or getattr(self.model, "_last_batch_size", None) != batch_size
+        ):
+            raise RuntimeError(
+                "The Silero VAD model does not keep its state as v5 does, "
+                "so it cannot be shared between sessions"
+            )
+
+    def session(self, **kwargs) -> VADSession:
+        """Create a session node that can be used in place of the SileroVAD plugin."""
+        return VADSession(self, **kwargs)
+
+    def register(self, session: VADSession) -> None:
+        self._sessions[id(session)] = session
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, session: VADSession) -> None:
+        self._sessions.pop(id(session), None)
+
+    async def close(self) -> None:
+        """Stop scoring and close every session."""
+        for session in list(self._sessions.values()):
+            await session.close()
+        if self._task:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _forward(
+        self, sessions: List[VADSession], windows: List[np.ndarray]
+    ) -> List[float]:
+        windows = np.stack(windows)
+        self.model._state = torch.cat([session.state for session in sessions], dim=1)
+        self.model._context = torch.cat(
+            [session.context for session in sessions], dim=0
+        )
+        # Matching the batch size and sample rate of the last call stops the
+        # model from resetting the state we just set.
+        self.model._last_sr = self.sample_rate
+        self.model._last_batch_size = len(sessions)
+        with torch.no_grad():
+            confidences = self.model(torch.from_numpy(windows), self.sample_rate)
+        for i, session in enumerate(sessions):
+            session.state = self.model._state[:, i : i + 1].clone()
+            session.context = self.model._context[i : i + 1].clone()
+        return confidences[:, 0].tolist()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_log = time.monotonic()
+        while self._sessions:
+            await asyncio.sleep(self.tick)
+            while True:
+                ready = [s for s in self._sessions.values() if s.pending]
+                if not ready:
+                    break
+                ready = ready[: self.max_batch_size]
+                windows = [session.pending[0] for session in ready]
+                start = time.monotonic()
+                try:
+                    confidences = await loop.run_in_executor(
+                        self._executor, self._forward, ready, windows
+                    )
+                except Exception as e:
+                    logger.error("Error in batched VAD: %s", e)
+                    break
+                for session, window in zip(ready, windows):
+                    # Unless the session dropped it as too old in the meantime.
+                    if session.pending and session.pending[0] is window:
+                        session.pending.popleft()
+                self.inference_time += time.monotonic() - start
+                self.batches += 1
+                self.windows += len(ready)
+                for session, confidence in zip(ready, confidences):
+                    session.on_result(confidence)
+
+            if time.monotonic() - last_log > 60 and self.batches:
+                last_log = time.monotonic()
+                logger.info(
+                    "Batched VAD: sessions=%d batches=%d mean_batch=%.1f mean_inference_ms=%.2f dropped=%d",
+                    len(self._sessions),
+                    self.batches,
+                    self.windows / self.batches,
+                    1000 * self.inference_time / self.batches,
+                    self.dropped_windows,
+                )
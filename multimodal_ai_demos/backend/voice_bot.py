@@ -1,10 +1,39 @@
+import asyncio
 import logging
+import os
+from typing import List
+
+from fastapi.responses import PlainTextResponse
 
 import realtime as rt
+from adaptive_aggregator import AdaptiveTokenAggregator
+from latency_tracer import LatencyTracer, registry as latency_registry
+from realtime_examples.pools import (
+    CartesiaPool,
+    DeepgramPool,
+    PooledCartesiaTTS,
+    PooledDeepgramSTT,
+    PooledFireworksLLM,
+    close_on_disconnect,
+    warm_llm_client,
+)
+from speculative import PooledInterimDeepgramSTT, SpeculativeFireworksLLM
+from tts_cache import CachedTTS
 
 # Set up basic logging configuration
 logging.basicConfig(level=logging.INFO)
 
+# Set VOICE_BOT_TRACING=1 to record per-stage latencies for each utterance.
+# Traces are logged as JSON and histograms are served at /metrics.
+TRACING_ENABLED = os.getenv("VOICE_BOT_TRACING", "0") == "1"
+
+# Set VOICE_BOT_SPECULATIVE=1 to start the LLM on stable interim transcripts.
+# Speculative tokens are only released to the TTS once the final transcript
+# matches; otherwise the turn is regenerated.
+SPECULATIVE_ENABLED = os.getenv("VOICE_BOT_SPECULATIVE", "0") == "1"
+
+VOICE_ID = "95856005-0332-41b0-935f-352e296aa0df"
+
 """
 The @realtime.App() decorator is used to wrap the VoiceBot class.
 This tells the realtime server which functions to run.
@@ -27,7 +56,19 @@ class VoiceBot:
         This method is called when the app starts. It should be used to set up
         services, load models, and perform any necessary initialization.
         """
-        pass
+        # Connections shared by all sessions, opened before the first one
+        # arrives so that no session pays for the handshakes.
+        self.deepgram_pool = DeepgramPool(
+            sample_rate=8000, interim_results=SPECULATIVE_ENABLED
+        )
+        self.cartesia_pool = CartesiaPool(voice_id=VOICE_ID)
+        await asyncio.gather(
+            self.deepgram_pool.start(),
+            self.cartesia_pool.start(),
+            warm_llm_client(PooledFireworksLLM.shared_client()),
+        )
+        # Tracers of the sessions served so far, stopped at teardown.
+        self.tracers: List[LatencyTracer] = []
 
     @rt.streaming_endpoint()
     async def run(
@@ -47,17 +88,29 @@ class VoiceBot:
             rt.AudioStream: The output stream of generated audio responses.
         """
         # Initialize the AI services
-        self.deepgram_node = rt.DeepgramSTT(sample_rate=8000)
-        self.llm_node = rt.FireworksLLM(
-            system_prompt="You are a helpful assistant. Keep your answers very short. No special characters in responses.",
-        )
-        self.token_aggregator_node = rt.TokenAggregator()
-        self.tts_node = rt.CartesiaTTS(
-            voice_id="95856005-0332-41b0-935f-352e296aa0df",
+        system_prompt = "You are a helpful assistant. Keep your answers very short. No special characters in responses."
+        if SPECULATIVE_ENABLED:
+            self.deepgram_node = PooledInterimDeepgramSTT(self.deepgram_pool)
+            self.llm_node = SpeculativeFireworksLLM(system_prompt=system_prompt)
+        else:
+            self.deepgram_node = PooledDeepgramSTT(self.deepgram_pool)
+            self.llm_node = PooledFireworksLLM(system_prompt=system_prompt)
+        self.token_aggregator_node = AdaptiveTokenAggregator()
+        cartesia_node = PooledCartesiaTTS(self.cartesia_pool)
+        self.tts_node = CachedTTS(
+            cartesia_node,
+            provider="cartesia",
+            voice_id=VOICE_ID,
+            sample_rate=16000,
         )
 
         # Set up the AI service pipeline
-        deepgram_stream: rt.TextStream = self.deepgram_node.run(audio_input_queue)
+        deepgram_stream: rt.TextStream
+        interim_stream: rt.TextStream
+        if SPECULATIVE_ENABLED:
+            deepgram_stream, interim_stream = self.deepgram_node.run(audio_input_queue)
+        else:
+            deepgram_stream = self.deepgram_node.run(audio_input_queue)
 
         llm_input_queue: rt.TextStream = rt.merge(
             [deepgram_stream, text_input_queue],
@@ -65,15 +118,46 @@ class VoiceBot:
 
         llm_token_stream: rt.TextStream
         chat_history_stream: rt.TextStream
-        llm_token_stream, chat_history_stream = self.llm_node.run(llm_input_queue)
+        if SPECULATIVE_ENABLED:
+            llm_token_stream, chat_history_stream = self.llm_node.run(
+                llm_input_queue, interim_stream
+            )
+        else:
+            llm_token_stream, chat_history_stream = self.llm_node.run(llm_input_queue)
 
         token_aggregator_stream: rt.TextStream = self.token_aggregator_node.run(
             llm_token_stream
         )
         tts_stream: rt.AudioStream = self.tts_node.run(token_aggregator_stream)
 
+        if TRACING_ENABLED:
+            tracer = LatencyTracer()
+            tracer.observe_audio_input(audio_input_queue)
+            tracer.observe_stt(deepgram_stream)
+            tracer.observe_llm_input(llm_input_queue)
+            tracer.observe_llm_output(llm_token_stream)
+            tracer.observe_aggregator_output(token_aggregator_stream)
+            tracer.observe_tts_output(tts_stream)
+            self.tracers.append(tracer)
+
+        # Give the pooled connections back when the caller hangs up. The
+        # cache stage closes the Cartesia node it wraps.
+        close_on_disconnect(
+            [
+                self.deepgram_node,
+                self.llm_node,
+                self.token_aggregator_node,
+                self.tts_node,
+            ]
+        )
+
         return tts_stream
 
+    @rt.web_endpoint(method="GET", path="/metrics")
+    async def metrics():
+        """Serve the per-stage latency histograms in Prometheus text format."""
+        return PlainTextResponse(latency_registry.render_prometheus())
+
     async def teardown(self) -> None:
         """
         Clean up resources when the VoiceBot is shutting down.
@@ -81,7 +165,11 @@ class VoiceBot:
         This method is called when the app stops or is shut down unexpectedly.
         It should be used to release resources and perform any necessary cleanup.
         """
-        pass
+        await asyncio.gather(
+            self.deepgram_pool.close(),
+            self.cartesia_pool.close(),
+            *(tracer.close() for tracer in self.tracers),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""
+Offline benchmark for the OCR pipeline in ocr.py.
+
+Replays a video (or the bundled test image with simulated camera motion)
+through `ReplayBot.run` against a local stand-in for the Google Vision client,
+and reports per-stage timings, end-to-end latency percentiles, output fps and
+dropped frames. No network access or GPU is needed.
+
+Usage:
+    python benchmark.py --frames 300 --fps 30 --latency 0.4
+    python benchmark.py --video clip.mp4 --response response.json --json
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from fractions import Fraction
+from types import SimpleNamespace
+
+import av
+import numpy as np
+from PIL import Image
+
+from google.cloud import vision
+from realtime.streams import VideoStream
+
+import ocr
+
+stage_timings = defaultdict(list)
+
+
+def timed(stage, fn):
+    """Wraps `fn` so that each call's duration is recorded under `stage`."""
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stage_timings[stage].append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def atimed(stage, fn):
+    """Async version of `timed`."""
+
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            stage_timings[stage].append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def make_document(width, height, paragraphs=6, confidence=0.95):
+    """Builds a canned `full_text_annotation` with evenly spaced paragraphs."""
+
+    def box(x0, y0, x1, y1):
+        return SimpleNamespace(
+            vertices=[
+                SimpleNamespace(x=x0, y=y0),
+                SimpleNamespace(x=x1, y=y0),
+                SimpleNamespace(x=x1, y=y1),
+                SimpleNamespace(x=x0, y=y1),
+            ]
+        )
+
+    row_height = height // (paragraphs + 1)
+    blocks = []
+    for i in range(paragraphs):
+        y0 = row_height * i + row_height // 2
+        y1 = y0 + row_height // 2
+        x0, x1 = width // 10, width - width // 10
+        symbols = [
+            SimpleNamespace(text=c, bounding_box=box(x0, y0, x1, y1))
+            for c in f"paragraph {i}"
+        ]
+        word = SimpleNamespace(symbols=symbols, bounding_box=box(x0, y0, x1, y1))
+        paragraph = SimpleNamespace(
+            words=[word], confidence=confidence, bounding_box=box(x0, y0, x1, y1)
+        )
+        blocks.append(
+            SimpleNamespace(paragraphs=[paragraph], bounding_box=box(x0, y0, x1, y1))
+        )
+    return SimpleNamespace(pages=[SimpleNamespace(blocks=blocks)])
+
+
+class FakeImageAnnotatorClient:
+    """Stand-in for `vision.ImageAnnotatorClient` with configurable latency.
+
+    Args:
+        document: the `full_text_annotation` returned for every request.
+        latency: the mean simulated round-trip time in seconds.
+        jitter: the maximum random deviation from `latency` in seconds.
+    """
+
+    def __init__(self, document, latency=0.4, jitter=0.1):
+        self.document = document
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.bytes_received = 0
+
+    def document_text_detection(self, image):
+        self.requests += 1
+        self.bytes_received += len(image.content)
+        time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+        return SimpleNamespace(full_text_annotation=self.document)
+
+
+def load_frames(args):
+    """Returns the list of yuv420p frames to replay."""
+    frames = []
+    if args.video:
+        with av.open(args.video) as container:
+            for frame in container.decode(video=0):
+                frames.append(frame.reformat(format="yuv420p"))
+                if len(frames) >= args.frames:
+                    break
+        return frames
+
+    # Simulate a hand-held camera over the bundled test page.
+    image = Image.open(os.path.join(os.path.dirname(__file__), "test.PNG"))
+    image = np.array(image.convert("RGB").resize((args.width, args.height)))
+    for i in range(args.frames):
+        dx = int(args.motion * np.sin(i / 15))
+        dy = int(args.motion * np.cos(i / 20))
+        shifted = np.roll(image, (dy, dx), axis=(0, 1))
+        frames.append(
+            av.VideoFrame.from_ndarray(shifted, format="rgb24").reformat(
+                format="yuv420p"
+            )
+        )
+    return frames
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 50),
+        "p90_ms": 1000 * percentile(values, 90),
+        "p99_ms": 1000 * percentile(values, 99),
+    }
+
+
+async def benchmark(args):
+    frames = load_frames(args)
+    if args.response:
+        with open(args.response) as f:
+            document = vision.AnnotateImageResponse.from_json(
+                f.read()
+            ).full_text_annotation
+    else:
+        document = make_document(frames[0].width, frames[0].height)
+    client = FakeImageAnnotatorClient(document, args.latency, args.jitter)
+
+    os.environ["OCR_MAX_IN_FLIGHT"] = str(args.max_in_flight)
+    os.environ["OCR_MAX_LATENCY"] = str(args.max_latency)
+    ocr.vision.ImageAnnotatorClient = lambda **kwargs: client
+    ocr.convert_yuv420_to_pil = timed("decode", ocr.convert_yuv420_to_pil)
+    ocr.encode_jpeg = timed("jpeg_encode", ocr.encode_jpeg)
+    ocr.request_document = atimed("api_wait", ocr.request_document)
+    ocr.parse_document_bounds = timed("bound_sorting", ocr.parse_document_bounds)
+    ocr.composite_boxes = timed("composite", ocr.composite_boxes)
+
+    # @realtime.App() wraps the class; drive the user instance directly and
+    # bypass the streaming_endpoint wrapper, which would start a WebRTC server.
+    bot = ocr.ReplayBot()._user_cls_instance
+    await bot.setup()
+    # streaming_endpoint() returns a RealtimeFunction around a functools.wraps wrapper.
+    run = type(bot).run
+    run = inspect.unwrap(getattr(run, "raw_f", run))
+    input_stream = VideoStream()
+    output_stream = await run(bot, input_stream)
+
+    sent_at = {}
+    latencies = []
+    received = 0
+    first_output = last_output = None
+
+    async def feed():
+        interval = 1 / args.fps
+        start = time.perf_counter()
+        for i, frame in enumerate(frames):
+            await asyncio.sleep(max(start + i * interval - time.perf_counter(), 0))
+            # ReplayBot accumulates pts, so send one tick per frame.
+            frame.pts = 1
+            frame.time_base = Fraction(1, round(args.fps))
+            sent_at[i + 1] = time.perf_counter()
+            await input_stream.put(frame)
+
+    async def collect():
+        nonlocal received, first_output, last_output
+        while True:
+            video_frame = await output_stream.get()
+            now = time.perf_counter()
+            latencies.append(now - sent_at[video_frame.pts])
+            received += 1
+            first_output = first_output or now
+            last_output = now
+
+    collector = asyncio.create_task(collect())
+    await feed()
+    # Give in-flight frames time to drain.
+    await asyncio.sleep(args.max_latency + args.latency + args.jitter)
+    collector.cancel()
+    await bot.teardown()
+
+    elapsed = (last_output - first_output) if received > 1 else 0.0
+    return {
+        "frames_sent": len(frames),
+        "frames_delivered": received,
+        "frames_dropped": len(frames) - received,
+        "output_fps": (received - 1) / elapsed if elapsed else 0.0,
+        "ocr_requests": client.requests,
+        "upload_bytes": client.bytes_received,
+        "end_to_end": summarize(latencies),
+        "stages": {stage: summarize(t) for stage, t in stage_timings.items()},
+    }
+
+
+def print_report(report):
+    print(
+        f"frames sent={report['frames_sent']} delivered={report['frames_delivered']} "
+        f"dropped={report['frames_dropped']} output_fps={report['output_fps']:.1f}"
+    )
+    print(
+        f"ocr requests={report['ocr_requests']} upload_bytes={report['upload_bytes']}"
+    )
+    print(f"{'stage':<16}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+    rows = [("end_to_end", report["end_to_end"])] + list(report["stages"].items())
+    for stage, s in rows:
+        print(
+            f"{stage:<16}{s['count']:>8}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+            f"{s['p90_ms']:>10.2f}{s['p99_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--video", help="video file to replay instead of test.PNG")
+    parser.add_argument("--response", help="Vision response JSON to return")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--motion", type=int, default=20, help="max camera shift (px)")
+    parser.add_argument("--latency", type=float, default=0.4, help="Vision latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-latency", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(args))
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
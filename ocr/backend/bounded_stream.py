@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+from realtime.streams import AudioStream, ByteStream, TextStream, VideoStream
+
+logger = logging.getLogger(__name__)
+
+# Default capacity of bounded streams, in items.
+STREAM_MAXSIZE = int(os.getenv("STREAM_MAXSIZE", 64))
+# Seconds between stream stats log lines.
+STREAM_STATS_INTERVAL = float(os.getenv("STREAM_STATS_INTERVAL", 60))
+
+
+class OverflowPolicy(Enum):
+    # Producers awaiting put() wait for room; put_nowait() drops the oldest item.
+    BLOCK = 1
+    # The oldest item is dropped to make room.
+    DROP_OLDEST = 2
+    # Only the newest item is kept, e.g. for video read by a slower consumer.
+    KEEP_LATEST = 3
+
+
+class BoundedStreamMixin:
+    """
+    Gives a realtime stream a capacity and an overflow policy.
+
+    Mixed into the realtime stream classes below, so bounded streams can be
+    returned from endpoints and passed to plugins like the unbounded ones.
+    Clones get the same capacity and policy, and every stream counts its
+    puts, drops, peak depth and the time producers spent waiting for room.
+
+    Args:
+        maxsize (int): The capacity in items; KEEP_LATEST streams hold one.
+        policy (OverflowPolicy): What to do when the stream is full.
+        name (str): The name used in stats.
+        on_drop (Optional[Callable[[Any], None]]): Called with every item dropped.
+    """
+
+    def __init__(
+        self,
+        *args,
+        maxsize: int = STREAM_MAXSIZE,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        name: str = "stream",
+        on_drop: Optional[Callable[[Any], None]] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._maxsize = 1 if policy is OverflowPolicy.KEEP_LATEST else maxsize
+        self._clones: List[BoundedStreamMixin] = []
+        self.policy: OverflowPolicy = policy
+        self.name: str = name
+        self.on_drop: Optional[Callable[[Any], None]] = on_drop
+        self.puts: int = 0
+        self.drops: int = 0
+        self.max_depth: int = 0
+        self.stall_time: float = 0.0
+        self._has_room: asyncio.Event = asyncio.Event()
+
+    def _count_put(self) -> None:
+        self.puts += 1
+        self.max_depth = max(self.max_depth, self.qsize())
+
+    def _offer(self, item: Any) -> None:
+        if self.full():
+            dropped = asyncio.Queue.get_nowait(self)
+            self.drops += 1
+            if self.on_drop is not None:
+                self.on_drop(dropped)
+        asyncio.Queue.put_nowait(self, item)
+        self._count_put()
+
+    async def _wait_put(self, item: Any) -> None:
+        # asyncio.Queue.put() would come back through our put_nowait(), so
+        # wait for room here instead.
+        if self.full():
+            start = time.monotonic()
+            while self.full():
+                self._has_room.clear()
+                await self._has_room.wait()
+            self.stall_time += time.monotonic() - start
+        asyncio.Queue.put_nowait(self, item)
+        self._count_put()
+
+    def get_nowait(self) -> Any:
+        # get() ends with get_nowait() too.
+        item = super().get_nowait()
+        self._has_room.set()
+        return item
+
+    def put_nowait(self, item: Any) -> None:
+        for queue in (self, *self._clones):
+            queue._offer(item)
+
+    async def put(self, item: Any) -> None:
+        if self.policy is not OverflowPolicy.BLOCK:
+            self.put_nowait(item)
+            return
+        # The slowest consumer sets the pace for the producer.
+        for queue in (self, *self._clones):
+            await queue._wait_put(item)
+
+    def clone(self) -> "BoundedStreamMixin":
+        kwargs = {}
+        if hasattr(self, "sample_rate"):
+            kwargs["sample_rate"] = self.sample_rate
+        clone = type(self)(
+            maxsize=self._maxsize,
+            policy=self.policy,
+            name=f"{self.name}[{len(self._clones) + 1}]",
+            on_drop=self.on_drop,
+            **kwargs,
+        )
+        self._clones.append(clone)
+        return clone
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.qsize(),
+            "max_depth": self.max_depth,
+            "puts": self.puts,
+            "drops": self.drops,
+            "stall_ms": round(self.stall_time * 1000),
+        }
+
+
+class BoundedAudioStream(BoundedStreamMixin, AudioStream):
+    pass
+
+
+class BoundedVideoStream(BoundedStreamMixin, VideoStream):
+    pass
+
+
+class BoundedTextStream(BoundedStreamMixin, TextStream):
+    pass
+
+
+class BoundedByteStream(BoundedStreamMixin, ByteStream):
+    pass
+
+
+def pipe(source: asyncio.Queue, *sinks: BoundedStreamMixin) -> asyncio.Task:
+    """Move everything from `source`, e.g. an endpoint's input stream, into bounded `sinks`."""
+
+    async def forward() -> None:
+        while True:
+            item = await source.get()
+            for sink in sinks:
+                await sink.put(item)
+
+    return asyncio.create_task(forward())
+
+
+def monitor(streams: list, interval: float = STREAM_STATS_INTERVAL) -> asyncio.Task:
+    """Log the stats of `streams`, and of their clones, every `interval` seconds."""
+
+    async def log_stats() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for stream in streams:
+                for queue in (stream, *getattr(stream, "_clones", [])):
+                    logger.info("Stream %s: %s", queue.name, queue.stats())
+
+    return asyncio.create_task(log_stats())
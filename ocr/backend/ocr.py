@@ -2,6 +2,8 @@ import asyncio
 import colorsys
 import logging
 import os
+import time
+from collections import namedtuple
 from typing import Tuple
 
 import realtime
@@ -14,6 +16,8 @@ import numpy as np
 import av
 from io import BytesIO
 
+from bounded_stream import BoundedVideoStream, OverflowPolicy, pipe
+
 from google.cloud import vision
 from concurrent.futures import ThreadPoolExecutor
 
@@ -79,31 +83,316 @@ def draw_boxes(image, bounds, color):
     return out
 
 
-async def get_document_bounds(pil_image, feature, client, executor):
-    """Finds the document bounds given an image and feature type.
+def plane_array(plane, height, width):
+    """Returns a writable (height, width) uint8 view of a video plane, skipping line padding."""
+    array = np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)
+    return array[:height, :width]
 
-    Args:
-        image_file: path to the image file.
-        feature: feature type to detect.
 
-    Returns:
-        List of coordinates for the corresponding feature type.
+class FrameSimilarityFilter:
+    """Decides whether a frame is close enough to the last OCR'd frame to reuse its bounds.
+
+    Frames are compared on a small luma thumbnail using the mean absolute
+    difference (0-255 scale), which is cheap enough to run on every frame.
     """
 
-    bounds = []
+    def __init__(self, threshold=4.0, thumbnail_size=(36, 64), stride=4):
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.stride = stride
+        self.hits = 0
+        self.misses = 0
+        self._reference = None
+        self._bounds = None
+
+    def signature(self, frame):
+        """Computes the downscaled luma thumbnail used for comparisons."""
+        luma = plane_array(frame.planes[0], frame.height, frame.width)[
+            :: self.stride, :: self.stride
+        ]
+        th, tw = self.thumbnail_size
+        h, w = luma.shape
+        if h < th or w < tw:
+            return luma.astype(np.float32)
+        luma = luma[: h - h % th, : w - w % tw]
+        return luma.reshape(th, luma.shape[0] // th, tw, luma.shape[1] // tw).mean(
+            axis=(1, 3), dtype=np.float32
+        )
+
+    def lookup(self, signature):
+        """Returns the cached bounds if `signature` matches the reference frame, else None."""
+        if (
+            self._reference is not None
+            and self._reference.shape == signature.shape
+            and np.abs(self._reference - signature).mean() <= self.threshold
+        ):
+            self.hits += 1
+            return self._bounds
+        self.misses += 1
+        return None
+
+    def update(self, signature, bounds):
+        """Makes `signature` the new reference frame with its OCR bounds."""
+        self._reference = signature
+        self._bounds = bounds
+
+    def invalidate(self, bounds):
+        """Drops the reference frame if it is still the one that produced `bounds`."""
+        if self._bounds is bounds:
+            self._reference = None
+            self._bounds = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "threshold": self.threshold,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+Vertex = namedtuple("Vertex", ["x", "y"])
+Polygon = namedtuple("Polygon", ["vertices"])
+
+
+def shift_bounds(bounds, dx, dy):
+    """Returns a copy of paragraph bounds translated by (dx, dy) pixels."""
+    return [
+        (text, Polygon([Vertex(v.x + dx, v.y + dy) for v in polygon.vertices]))
+        for text, polygon in bounds
+    ]
+
+
+class BoxTracker:
+    """Follows camera motion between OCR results so boxes can be redrawn on every frame.
+
+    The translation between the frame that was last sent to OCR (the anchor)
+    and the current frame is estimated with phase correlation on a subsampled
+    luma plane. Tracking gives up, and OCR is requested, when the correlation
+    peak falls below `min_confidence` or the anchor is older than
+    `ocr_interval` seconds.
+    """
+
+    def __init__(self, min_confidence=0.1, ocr_interval=1.0, stride=4):
+        self.min_confidence = min_confidence
+        self.ocr_interval = ocr_interval
+        self.stride = stride
+        self.tracked = 0
+        self.lost = 0
+        self.expired = 0
+        self._anchor = None
+        self._anchor_fft = None
+        self._anchor_time = 0.0
+        self._bounds = None
+        self._window = None
+
+    def _thumbnail(self, frame):
+        luma = plane_array(frame.planes[0], frame.height, frame.width)[
+            :: self.stride, :: self.stride
+        ].astype(np.float32)
+        if self._window is None or self._window.shape != luma.shape:
+            self._window = np.outer(
+                np.hanning(luma.shape[0]), np.hanning(luma.shape[1])
+            ).astype(np.float32)
+        return (luma - luma.mean()) * self._window
+
+    def set_anchor(self, frame, bounds):
+        """Makes `frame` the reference for tracking the OCR `bounds`."""
+        self._anchor = self._thumbnail(frame)
+        self._anchor_fft = np.conj(np.fft.rfft2(self._anchor))
+        self._anchor_time = time.monotonic()
+        self._bounds = bounds
+
+    def invalidate(self, bounds):
+        """Drops the anchor if it is still the one that produced `bounds`."""
+        if self._bounds is bounds:
+            self._anchor = None
+            self._bounds = None
+
+    def track(self, frame):
+        """Estimates the shift of `frame` relative to the anchor.
+
+        Returns:
+            A (bounds, dx, dy) tuple, or None if OCR should be run instead.
+        """
+        if self._anchor is None:
+            return None
+        if time.monotonic() - self._anchor_time > self.ocr_interval:
+            self.expired += 1
+            return None
+        current = self._thumbnail(frame)
+        if current.shape != self._anchor.shape:
+            return None
+        cross_power = self._anchor_fft * np.fft.rfft2(current)
+        cross_power /= np.abs(cross_power) + 1e-9
+        correlation = np.fft.irfft2(cross_power, s=current.shape)
+        peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+        if correlation[peak] < self.min_confidence:
+            self.lost += 1
+            return None
+        h, w = current.shape
+        dy = peak[0] - h if peak[0] > h // 2 else peak[0]
+        dx = peak[1] - w if peak[1] > w // 2 else peak[1]
+        self.tracked += 1
+        return self._bounds, int(dx) * self.stride, int(dy) * self.stride
+
+    def stats(self):
+        return {
+            "tracked": self.tracked,
+            "lost": self.lost,
+            "expired": self.expired,
+            "min_confidence": self.min_confidence,
+        }
+
+
+def unmap_bounds(bounds, offset_x, offset_y, scale):
+    """Maps bounds found on a cropped, rescaled upload back to frame coordinates."""
+    return [
+        (
+            text,
+            Polygon(
+                [
+                    Vertex(offset_x + v.x / scale, offset_y + v.y / scale)
+                    for v in polygon.vertices
+                ]
+            ),
+        )
+        for text, polygon in bounds
+    ]
 
+
+class AdaptiveEncoder:
+    """Chooses the crop, scale and JPEG quality of each OCR upload.
+
+    Uploads are cropped to the region where text was found last time (plus
+    `margin`), downscaled as long as the smallest paragraph stays at least
+    `min_text_height` pixels tall, and encoded at a quality that steps down
+    while recognition confidence holds. Everything resets to the full frame
+    when confidence drops below `min_confidence`, when no text is found, or
+    every `full_frame_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        min_confidence=0.8,
+        margin=0.15,
+        min_scale=0.4,
+        min_text_height=16,
+        max_quality=90,
+        min_quality=60,
+        quality_step=5,
+        full_frame_interval=5.0,
+    ):
+        self.min_confidence = min_confidence
+        self.margin = margin
+        self.min_scale = min_scale
+        self.min_text_height = min_text_height
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+        self.quality_step = quality_step
+        self.full_frame_interval = full_frame_interval
+        self.scale = 1.0
+        self.quality = max_quality
+        self.uploads = 0
+        self.bytes_sent = 0
+        self._region = None
+        self._last_full_frame = 0.0
+
+    def plan(self, width, height):
+        """Returns the (crop, scale, quality) to use for the next upload."""
+        now = time.monotonic()
+        if (
+            self._region is None
+            or now - self._last_full_frame > self.full_frame_interval
+        ):
+            self._last_full_frame = now
+            # Text may have appeared anywhere, at any size, so start over.
+            self.scale = 1.0
+            self.quality = self.max_quality
+            crop = (0, 0, width, height)
+        else:
+            crop = self._region
+        return crop, self.scale, self.quality
+
+    def feedback(self, bounds, confidence, frame_size, content_size):
+        """Updates the encoder after an OCR response.
+
+        Args:
+            bounds: the paragraph bounds in frame coordinates.
+            confidence: the mean paragraph confidence of the response.
+            frame_size: the (width, height) of the frame.
+            content_size: the number of bytes that were uploaded.
+        """
+        self.uploads += 1
+        self.bytes_sent += content_size
+        if not bounds or confidence < self.min_confidence:
+            self._region = None
+            self.scale = 1.0
+            self.quality = self.max_quality
+            return
+
+        width, height = frame_size
+        xs = [v.x for _, polygon in bounds for v in polygon.vertices]
+        ys = [v.y for _, polygon in bounds for v in polygon.vertices]
+        margin_x = (max(xs) - min(xs)) * self.margin
+        margin_y = (max(ys) - min(ys)) * self.margin
+        self._region = (
+            max(int(min(xs) - margin_x), 0),
+            max(int(min(ys) - margin_y), 0),
+            min(int(max(xs) + margin_x) + 1, width),
+            min(int(max(ys) + margin_y) + 1, height),
+        )
+
+        text_height = min(
+            max(v.y for v in polygon.vertices) - min(v.y for v in polygon.vertices)
+            for _, polygon in bounds
+        )
+        floor = max(
+            self.min_scale, min(1.0, self.min_text_height / max(text_height, 1))
+        )
+        self.scale = max(self.scale * 0.9, floor)
+        self.quality = max(self.quality - self.quality_step, self.min_quality)
+
+    def stats(self):
+        return {
+            "uploads": self.uploads,
+            "bytes_sent": self.bytes_sent,
+            "scale": round(self.scale, 2),
+            "quality": self.quality,
+            "region": self._region,
+        }
+
+
+def encode_jpeg(pil_image, quality=75):
+    """Encodes a PIL image as JPEG bytes for upload to the Vision API."""
     buffer = BytesIO()
-    pil_image.save(buffer, format="JPEG")
-    content = buffer.getvalue()
+    pil_image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
 
-    image = vision.Image(content=content)
 
-    response = await asyncio.get_event_loop().run_in_executor(
-        executor,
-        client.document_text_detection,  # the synchronous function
-        image,  # the function argument
-    )
-    document = response.full_text_annotation
+def document_confidence(document):
+    """Returns the mean paragraph confidence of a Vision document, or 0 if it has no text."""
+    confidences = [
+        paragraph.confidence
+        for page in document.pages
+        for block in page.blocks
+        for paragraph in block.paragraphs
+    ]
+    return sum(confidences) / len(confidences) if confidences else 0.0
+
+
+def parse_document_bounds(document, feature):
+    """Collects and sorts the bounds of the given feature type from a Vision document.
+
+    Args:
+        document: the `full_text_annotation` of a Vision response.
+        feature: feature type to detect.
+
+    Returns:
+        List of coordinates for the corresponding feature type.
+    """
+    bounds = []
 
     # Collect specified feature bounds by enumerating all document features
     for page in document.pages:
@@ -148,6 +437,39 @@ async def get_document_bounds(pil_image, feature, client, executor):
     return bounds
 
 
+async def request_document(content, client, executor):
+    """Sends JPEG bytes to the Vision API and returns the `full_text_annotation`."""
+    image = vision.Image(content=content)
+
+    response = await asyncio.get_event_loop().run_in_executor(
+        executor,
+        client.document_text_detection,  # the synchronous function
+        image,  # the function argument
+    )
+    return response.full_text_annotation
+
+
+async def detect_document_bounds(content, feature, client, executor):
+    """Sends JPEG bytes to the Vision API and returns the bounds of the given feature type."""
+    document = await request_document(content, client, executor)
+    return parse_document_bounds(document, feature)
+
+
+async def get_document_bounds(pil_image, feature, client, executor):
+    """Finds the document bounds given an image and feature type.
+
+    Args:
+        pil_image: the input PIL image.
+        feature: feature type to detect.
+
+    Returns:
+        List of coordinates for the corresponding feature type.
+    """
+    return await detect_document_bounds(
+        encode_jpeg(pil_image), feature, client, executor
+    )
+
+
 async def render_doc_text(pil_image, client, executor):
     """Outlines document features (blocks, paragraphs and words) given an image.
 
@@ -167,51 +489,321 @@ async def render_doc_text(pil_image, client, executor):
     return rgb_image
 
 
+def prepare_frame(frame, crop=None, scale=1.0, quality=75):
+    """Decodes, crops, rescales and JPEG-encodes a frame for OCR. Runs on a CPU worker thread."""
+    pil_image = convert_yuv420_to_pil(frame)
+    if crop is not None:
+        pil_image = pil_image.crop(crop)
+    if scale < 1.0:
+        pil_image = pil_image.resize(
+            (
+                max(round(pil_image.width * scale), 1),
+                max(round(pil_image.height * scale), 1),
+            ),
+            Image.BILINEAR,
+        )
+    return encode_jpeg(pil_image, quality)
+
+
+def rgb_to_yuv(color):
+    """Converts an RGB color to limited-range BT.601 YUV."""
+    r, g, b = color
+    y = 16 + (65.738 * r + 129.057 * g + 25.064 * b) / 256
+    u = 128 + (-37.945 * r - 74.494 * g + 112.439 * b) / 256
+    v = 128 + (112.439 * r - 94.154 * g - 18.285 * b) / 256
+    return round(y), round(u), round(v)
+
+
+def polygon_mask(vertices, x0, y0, x1, y1):
+    """Rasterizes a convex polygon into a boolean mask covering [y0:y1, x0:x1]."""
+    ys = np.arange(y0, y1, dtype=np.float32)[:, None] + 0.5
+    xs = np.arange(x0, x1, dtype=np.float32)[None, :] + 0.5
+    positive = np.ones((y1 - y0, x1 - x0), dtype=bool)
+    negative = np.ones((y1 - y0, x1 - x0), dtype=bool)
+    for i, a in enumerate(vertices):
+        b = vertices[(i + 1) % len(vertices)]
+        cross = (b.x - a.x) * (ys - a.y) - (b.y - a.y) * (xs - a.x)
+        positive &= cross >= 0
+        negative &= cross <= 0
+    return positive | negative
+
+
+def mask_outline(mask):
+    """Returns the pixels of `mask` that have a 4-neighbour outside of it.
+
+    Pixels beyond the edges of the array count as outside, so a polygon that
+    fills its whole bounding box still gets an outline.
+    """
+    padded = np.pad(mask, 1)
+    inner = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+    return mask & ~inner
+
+
+def subsample_mask(mask):
+    """Halves a luma mask to chroma resolution.
+
+    A chroma sample is set when any of the 2x2 luma pixels it covers is, and an
+    odd trailing row or column maps onto a chroma row or column of its own.
+    """
+    h, w = mask.shape
+    padded = np.pad(mask, ((0, h % 2), (0, w % 2)))
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).any(
+        axis=(1, 3)
+    )
+
+
+def blend(region, mask, value, alpha):
+    """Blends `value` into the masked pixels of `region` in place with 8-bit `alpha`."""
+    pixels = region[mask].astype(np.int32)
+    region[mask] = pixels + (((value - pixels) * alpha) >> 8)
+
+
+def composite_boxes(frame, bounds, color=RGB_tuples[0], alpha=64):
+    """Draws translucent bounds straight into a copy of a yuv420p frame.
+
+    This is the NumPy equivalent of `draw_boxes` for the streaming path: the
+    polygons are rasterized into the Y, U and V planes of the output frame, so
+    no RGB or PIL intermediate is created.
+
+    Args:
+        frame: the input av.VideoFrame.
+        bounds: list of (text, polygon) paragraph bounds.
+        color: the RGB color of the boxes.
+        alpha: the fill opacity (0-255); outlines are drawn opaque.
+
+    Returns:
+        A new yuv420p av.VideoFrame with the boxes drawn.
+    """
+    if frame.format.name != "yuv420p":
+        frame = frame.reformat(format="yuv420p")
+    width, height = frame.width, frame.height
+    sizes = [(height, width), ((height + 1) // 2, (width + 1) // 2)]
+    sizes.append(sizes[1])
+
+    # The output frame is allocated per call rather than taken from a pool:
+    # once delivered it is owned by the output stream and the WebRTC encoder,
+    # which give no signal when they are done with it, so a pooled frame could
+    # be overwritten while it is still queued for encoding.
+    out = av.VideoFrame(width, height, "yuv420p")
+    planes = []
+    for src, dst, (h, w) in zip(frame.planes, out.planes, sizes):
+        plane = plane_array(dst, h, w)
+        np.copyto(plane, plane_array(src, h, w))
+        planes.append(plane)
+
+    yuv = rgb_to_yuv(color)
+    for _, polygon in bounds:
+        xs = [v.x for v in polygon.vertices]
+        ys = [v.y for v in polygon.vertices]
+        # Align the box to even coordinates so it maps cleanly onto chroma.
+        x0, y0 = max(int(min(xs)), 0) & ~1, max(int(min(ys)), 0) & ~1
+        x1, y1 = min(int(max(xs)) + 1, width), min(int(max(ys)) + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        mask = polygon_mask(polygon.vertices, x0, y0, x1, y1)
+        outline = mask_outline(mask)
+        # Subsample the luma outline rather than outlining the chroma mask, so
+        # the colored edge sits exactly under the luma one.
+        chroma_mask, chroma_outline = subsample_mask(mask), subsample_mask(outline)
+        for i, plane in enumerate(planes):
+            if i == 0:
+                region = plane[y0:y1, x0:x1]
+                plane_mask, plane_outline = mask, outline
+            else:
+                cy0, cx0 = y0 // 2, x0 // 2
+                region = plane[
+                    cy0 : cy0 + chroma_mask.shape[0], cx0 : cx0 + chroma_mask.shape[1]
+                ]
+                plane_mask, plane_outline = chroma_mask, chroma_outline
+            blend(region, plane_mask & ~plane_outline, yuv[i], alpha)
+            region[plane_outline] = yuv[i]
+    return out
+
+
+class OCRPipeline:
+    """Runs frame preparation, OCR and rendering as overlapping stages.
+
+    Up to `max_in_flight` frames are processed concurrently and delivered in
+    pts order. Frames that pile up while the pipeline is full are skipped in
+    favour of the latest one, and results older than `max_latency` seconds by
+    the time they are ready are dropped.
+    """
+
+    def __init__(
+        self,
+        client,
+        ocr_executor,
+        cpu_executor,
+        similarity_filter,
+        tracker=None,
+        encoder=None,
+        max_in_flight=4,
+        max_latency=2.0,
+    ):
+        self.client = client
+        self.ocr_executor = ocr_executor
+        self.cpu_executor = cpu_executor
+        self.similarity_filter = similarity_filter
+        self.tracker = tracker
+        self.encoder = encoder
+        self.max_in_flight = max_in_flight
+        self.max_latency = max_latency
+        self.delivered = 0
+        self.dropped = 0
+        self.skipped = 0
+        self._skipped_pts = 0
+
+    async def _ocr(self, frame):
+        if self.encoder is not None:
+            crop, scale, quality = self.encoder.plan(frame.width, frame.height)
+        else:
+            crop, scale, quality = None, 1.0, 75
+        content = await asyncio.get_running_loop().run_in_executor(
+            self.cpu_executor, prepare_frame, frame, crop, scale, quality
+        )
+        try:
+            document = await request_document(content, self.client, self.ocr_executor)
+            bounds = parse_document_bounds(document, FeatureType.PARA)
+            if crop is not None:
+                bounds = unmap_bounds(bounds, crop[0], crop[1], scale)
+            if self.encoder is not None:
+                self.encoder.feedback(
+                    bounds,
+                    document_confidence(document),
+                    (frame.width, frame.height),
+                    len(content),
+                )
+            return bounds
+        except Exception as e:
+            logging.error("OCR request failed: %s", e)
+            # Do not let later frames reuse a failed result.
+            self.similarity_filter.invalidate(asyncio.current_task())
+            if self.tracker is not None:
+                self.tracker.invalidate(asyncio.current_task())
+            return []
+
+    async def _shift(self, bounds, dx, dy):
+        return shift_bounds(await bounds, dx, dy)
+
+    async def _render(self, frame, bounds):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.cpu_executor, composite_boxes, frame, await bounds
+        )
+
+    def _submit(self, frame):
+        signature = self.similarity_filter.signature(frame)
+        bounds = self.similarity_filter.lookup(signature)
+        if bounds is None and self.tracker is not None:
+            tracked = self.tracker.track(frame)
+            if tracked is not None:
+                bounds = asyncio.ensure_future(self._shift(*tracked))
+        if bounds is None:
+            bounds = asyncio.ensure_future(self._ocr(frame))
+            self.similarity_filter.update(signature, bounds)
+            if self.tracker is not None:
+                self.tracker.set_anchor(frame, bounds)
+        return asyncio.ensure_future(self._render(frame, bounds))
+
+    def _skip(self, frame):
+        # Skipped frames still advance the output timestamps.
+        self._skipped_pts += frame.pts
+        self.skipped += 1
+
+    async def _read(self, input_stream, pending):
+        frame_pts = 0
+        while True:
+            frame = await input_stream.get()
+            frame_pts += self._skipped_pts + frame.pts
+            self._skipped_pts = 0
+            received_at = time.monotonic()
+            task = self._submit(frame)
+            await pending.put((frame_pts, frame.time_base, received_at, task))
+
+    async def _deliver(self, output_stream, pending):
+        while True:
+            frame_pts, time_base, received_at, task = await pending.get()
+            try:
+                video_frame = await task
+            except Exception as e:
+                logging.error("Error processing frame: %s", e)
+                self.dropped += 1
+                continue
+            if time.monotonic() - received_at > self.max_latency:
+                self.dropped += 1
+                continue
+            video_frame.pts = frame_pts
+            video_frame.time_base = time_base
+            await output_stream.put(video_frame)
+            self.delivered += 1
+            if self.delivered % 100 == 0:
+                logging.info(
+                    "OCR pipeline: delivered=%d dropped=%d skipped=%d output=%s similarity=%s tracker=%s encoder=%s",
+                    self.delivered,
+                    self.dropped,
+                    self.skipped,
+                    output_stream.stats() if hasattr(output_stream, "stats") else None,
+                    self.similarity_filter.stats(),
+                    self.tracker.stats() if self.tracker is not None else None,
+                    self.encoder.stats() if self.encoder is not None else None,
+                )
+
+    async def run(self, input_stream, output_stream):
+        # The bounded queue of in-flight frames keeps delivery in pts order and
+        # applies backpressure to the reader.
+        pending = asyncio.Queue(maxsize=self.max_in_flight)
+        # Frames that arrive while the reader waits for room replace the one
+        # waiting, so only the latest frame is ever buffered.
+        latest = BoundedVideoStream(
+            policy=OverflowPolicy.KEEP_LATEST, name="ocr_input", on_drop=self._skip
+        )
+        await asyncio.gather(
+            pipe(input_stream, latest),
+            self._read(latest, pending),
+            self._deliver(output_stream, pending),
+        )
+
+
 @realtime.App()
 class ReplayBot:
     async def setup(self):
         self.client = vision.ImageAnnotatorClient(
             client_options={"api_key": os.getenv("GOOGLE_VISION_KEY")}
         )
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.max_in_flight = int(os.getenv("OCR_MAX_IN_FLIGHT", 4))
+        self.max_latency = float(os.getenv("OCR_MAX_LATENCY", 2.0))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        self.cpu_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
 
     @realtime.streaming_endpoint()
     async def run(self, video_input_stream: VideoStream):
-        output_stream = VideoStream()
-
-        async def process_frame():
-            frame_count = 0
-            # if not os.path.exists("./data"):
-            #     os.makedirs("./data")
-            frame_pts = 0
-            while True:
-                frame = await video_input_stream.get()
-                frame_pts += frame.pts
-                while video_input_stream.qsize() > 0:
-                    frame = video_input_stream.get_nowait()
-                    frame_pts += frame.pts
-                pil_image = convert_yuv420_to_pil(frame)
-                # pil_image.save(f"./data/test_{frame_count}.jpeg")
-                rgb_image = await render_doc_text(
-                    pil_image,
-                    self.client,
-                    self.executor,
-                )
-                array = np.array(rgb_image)  # shape (height, width, 3)
-
-                # Create PyAV VideoFrame from NumPy array
-                video_frame = av.VideoFrame.from_ndarray(array, format="rgb24")
-                video_frame.pts = frame_pts
-                video_frame.time_base = frame.time_base
-                await output_stream.put(video_frame)
-                frame_count += 1
-
-        asyncio.create_task(process_frame())
+        # Delivery waits for the transport rather than queueing without limit.
+        output_stream = BoundedVideoStream(
+            maxsize=8, policy=OverflowPolicy.BLOCK, name="ocr_output"
+        )
+        similarity_filter = FrameSimilarityFilter(
+            threshold=float(os.getenv("OCR_SIMILARITY_THRESHOLD", 4.0))
+        )
+        tracker = BoxTracker(
+            min_confidence=float(os.getenv("OCR_TRACK_MIN_CONFIDENCE", 0.1)),
+            ocr_interval=float(os.getenv("OCR_TRACK_INTERVAL", 1.0)),
+        )
+        pipeline = OCRPipeline(
+            self.client,
+            self.executor,
+            self.cpu_executor,
+            similarity_filter,
+            tracker=tracker,
+            encoder=AdaptiveEncoder(),
+            max_in_flight=self.max_in_flight,
+            max_latency=self.max_latency,
+        )
+        asyncio.create_task(pipeline.run(video_input_stream, output_stream))
 
         return output_stream
 
     async def teardown(self):
-        pass
+        self.executor.shutdown(wait=False)
+        self.cpu_executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
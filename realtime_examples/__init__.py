@@ -0,0 +1 @@
+"""Modules shared by the example apps; install the project with `poetry install` to import them."""
@@ -0,0 +1,686 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import aiohttp
+import websockets
+from openai import AsyncOpenAI
+
+import realtime as rt
+from realtime.streams import ByteStream
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open and ready for new sessions, per pool.
+POOL_MIN_IDLE = int(os.getenv("POOL_MIN_IDLE", 2))
+# Idle connections beyond this are closed when sessions return them.
+POOL_MAX_IDLE = int(os.getenv("POOL_MAX_IDLE", 8))
+# Idle connections above the minimum are closed after this many seconds.
+POOL_IDLE_TIMEOUT = float(os.getenv("POOL_IDLE_TIMEOUT", 300))
+
+_KEEPALIVE_MSG: str = json.dumps({"type": "KeepAlive"})
+
+
+class ResourcePool:
+    """
+    A pool of pre-warmed connections shared by all sessions in the process.
+
+    `start()` opens `min_idle` connections up front. Sessions lease one with
+    `acquire()`, which hands out an idle connection or opens a new one if none
+    is left, and give it back with `release()`. A maintenance task checks
+    idle connections every `check_interval` seconds, closes the unhealthy
+    ones and the ones idle for longer than `idle_timeout` above `min_idle`,
+    and tops the pool back up to `min_idle`.
+
+    Args:
+        name (str): The name used in logs.
+        create (Callable[[], Awaitable[Any]]): Opens a new connection.
+        close (Callable[[Any], Awaitable[None]]): Closes a connection.
+        check (Optional[Callable[[Any], Awaitable[bool]]]): Returns whether an idle connection is healthy.
+        reusable (bool): Whether connections may be handed to another session after release.
+        min_idle (int): Connections kept open and ready.
+        max_idle (int): Maximum idle connections kept.
+        idle_timeout (float): Seconds after which idle connections above `min_idle` are closed.
+        check_interval (float): Seconds between health checks.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        create: Callable[[], Awaitable[Any]],
+        close: Callable[[Any], Awaitable[None]],
+        check: Optional[Callable[[Any], Awaitable[bool]]] = None,
+        reusable: bool = True,
+        min_idle: int = POOL_MIN_IDLE,
+        max_idle: int = POOL_MAX_IDLE,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        check_interval: float = 30.0,
+    ) -> None:
+        self.name: str = name
+        self._create = create
+        self._close = close
+        self._check = check
+        self.reusable: bool = reusable
+        self.min_idle: int = min_idle
+        self.max_idle: int = max_idle
+        self.idle_timeout: float = idle_timeout
+        self.check_interval: float = check_interval
+        # (connection, time it became idle), most recently used last.
+        self._idle: List[Tuple[Any, float]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.leased: int = 0
+        self.created: int = 0
+        self.reused: int = 0
+        self.evicted: int = 0
+
+    async def start(self) -> None:
+        await self._fill()
+        self._task = asyncio.create_task(self._maintain())
+
+    async def _open(self) -> Any:
+        connection = await self._create()
+        self.created += 1
+        return connection
+
+    async def _discard(self, connection: Any) -> None:
+        try:
+            await self._close(connection)
+        except Exception as e:
+            logger.debug("Error closing %s connection: %s", self.name, e)
+
+    async def _fill(self) -> None:
+        missing = self.min_idle - len(self._idle)
+        if missing <= 0:
+            return
+        results = await asyncio.gather(
+            *(self._open() for _ in range(missing)), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Error opening %s connection: %s", self.name, result)
+            else:
+                self._idle.append((result, time.monotonic()))
+
+    async def acquire(self) -> Any:
+        # streaming_endpoint cancels every task on the loop when a session
+        # ends, the maintenance task included.
+        if self._task is not None and self._task.done():
+            self._task = asyncio.create_task(self._maintain())
+        if self._idle:
+            connection, _ = self._idle.pop()
+            self.reused += 1
+        else:
+            connection = await self._open()
+        self.leased += 1
+        return connection
+
+    async def release(self, connection: Any, reusable: bool = True) -> None:
+        self.leased -= 1
+        if self.reusable and reusable and len(self._idle) < self.max_idle:
+            self._idle.append((connection, time.monotonic()))
+        else:
+            await self._discard(connection)
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = time.monotonic()
+            # Oldest first, so the least recently used are evicted.
+            for entry in list(self._idle):
+                # Skip connections leased while earlier ones were checked.
+                if entry not in self._idle:
+                    continue
+                connection, since = entry
+                expired = (
+                    now - since > self.idle_timeout and len(self._idle) > self.min_idle
+                )
+                healthy = True
+                if not expired and self._check is not None:
+                    try:
+                        healthy = await self._check(connection)
+                    except Exception:
+                        healthy = False
+                if (expired or not healthy) and entry in self._idle:
+                    self._idle.remove(entry)
+                    await self._discard(connection)
+                    self.evicted += 1
+            await self._fill()
+            logger.debug(
+                "%s pool: idle=%d leased=%d created=%d reused=%d evicted=%d",
+                self.name,
+                len(self._idle),
+                self.leased,
+                self.created,
+                self.reused,
+                self.evicted,
+            )
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        for connection, _ in self._idle:
+            await self._discard(connection)
+        self._idle = []
+
+
+class DeepgramPool(ResourcePool):
+    """
+    Pre-opened Deepgram streaming connections for one transcription config.
+
+    Deepgram closes a stream that receives neither audio nor keepalives for
+    about ten seconds, so idle connections are kept alive by the health
+    check. A connection is specific to one session's audio, so it is closed
+    rather than reused once the session is done.
+
+    Args:
+        sample_rate (int): The sample rate of the session audio.
+        interim_results (bool): Whether to ask Deepgram for interim transcripts.
+        **kwargs: Options of rt.DeepgramSTT, e.g. `model` or
+            `confidence_threshold`, used for the connections and the nodes alike.
+    """
+
+    def __init__(
+        self, sample_rate: int = 16000, interim_results: bool = False, **kwargs
+    ) -> None:
+        self.sample_rate: int = sample_rate
+        self.interim_results: bool = interim_results
+        self.options: Dict[str, Any] = kwargs
+        self._api_key: str = kwargs.get("api_key") or os.environ.get("DEEPGRAM_API_KEY")
+        live_config = {
+            "model": kwargs.get("model", "nova-2"),
+            "punctuate": kwargs.get("punctuate", True),
+            "smart_format": kwargs.get("smart_format", True),
+            "encoding": "linear16",
+            "sample_rate": sample_rate,
+            "channels": kwargs.get("num_channels", 1),
+            "endpointing": kwargs.get("min_silence_duration", 100),
+            "language": kwargs.get("language", "en-US"),
+        }
+        if interim_results:
+            live_config["interim_results"] = True
+        self.url: str = (
+            f"wss://api.deepgram.com/v1/listen?{urlencode(live_config).lower()}"
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        super().__init__(
+            "deepgram",
+            self._connect,
+            lambda ws: ws.close(),
+            self._keepalive,
+            reusable=False,
+            check_interval=5.0,
+        )
+
+    async def _connect(self) -> aiohttp.ClientWebSocketResponse:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return await self._session.ws_connect(
+            self.url, headers={"Authorization": f"Token {self._api_key}"}
+        )
+
+    async def _keepalive(self, ws: aiohttp.ClientWebSocketResponse) -> bool:
+        if ws.closed:
+            return False
+        await ws.send_str(_KEEPALIVE_MSG)
+        return True
+
+    async def close(self) -> None:
+        await super().close()
+        if self._session:
+            await self._session.close()
+
+
+class CartesiaPool(ResourcePool):
+    """
+    Pre-opened Cartesia TTS websockets.
+
+    Contexts on a Cartesia websocket are independent and each session only
+    reads the audio of its own contexts, so connections are handed from one
+    session to the next.
+
+    Args:
+        voice_id (str): The voice the pooled nodes synthesize with.
+        model (str): The Cartesia model.
+        output_sample_rate (int): The sample rate of the synthesized audio.
+        **kwargs: `api_key`, `base_url` and `cartesia_version`, as for rt.CartesiaTTS.
+    """
+
+    def __init__(
+        self,
+        voice_id: str = "a0e99841-438c-4a64-b679-ae501e7d6091",
+        model: str = "sonic-english",
+        output_sample_rate: int = 16000,
+        **kwargs,
+    ) -> None:
+        self.voice_id: str = voice_id
+        self.model: str = model
+        self.output_sample_rate: int = output_sample_rate
+        self.options: Dict[str, Any] = kwargs
+        query_params = {
+            "cartesia_version": kwargs.get("cartesia_version", "2024-06-10"),
+            "api_key": kwargs.get("api_key") or os.environ.get("CARTESIA_API_KEY"),
+        }
+        base_url = kwargs.get("base_url", "wss://api.cartesia.ai/tts/websocket")
+        self.url: str = f"{base_url}?{urlencode(query_params)}"
+        super().__init__("cartesia", self._connect, lambda ws: ws.close(), self._ping)
+
+    async def _connect(self):
+        return await websockets.connect(self.url)
+
+    async def _ping(self, ws) -> bool:
+        pong_waiter = await ws.ping()
+        await asyncio.wait_for(pong_waiter, timeout=5)
+        return True
+
+
+class AzureSynthesizerPool(ResourcePool):
+    """
+    Azure speech synthesizers with their service connection already open.
+
+    Args:
+        voice_id (str): The voice the synthesizers use.
+        **kwargs: `api_key` and `azure_speech_region`, as for rt.AzureTTS.
+    """
+
+    def __init__(self, voice_id: str = "en-US-AvaMultilingualNeural", **kwargs) -> None:
+        self.voice_id: str = voice_id
+        self.options: Dict[str, Any] = kwargs
+        self._api_key: str = kwargs.get("api_key") or os.getenv("AZURE_SPEECH_KEY")
+        self._region: str = kwargs.get("azure_speech_region") or os.getenv(
+            "AZURE_SPEECH_REGION"
+        )
+        super().__init__("azure", self._connect, self._disconnect, self._connected)
+
+    def _open_synthesizer(self):
+        import azure.cognitiveservices.speech as speechsdk
+
+        speech_config = speechsdk.SpeechConfig(
+            subscription=self._api_key, region=self._region
+        )
+        speech_config.set_speech_synthesis_output_format(
+            speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm
+        )
+        speech_config.speech_synthesis_voice_name = self.voice_id
+        synthesizer = speechsdk.SpeechSynthesizer(
+            speech_config=speech_config, audio_config=None
+        )
+        connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+        connection.disconnected.connect(
+            lambda evt: setattr(synthesizer, "_pool_disconnected", True)
+        )
+        connection.open(True)
+        synthesizer._pool_connection = connection
+        return synthesizer
+
+    async def _connect(self):
+        return await asyncio.to_thread(self._open_synthesizer)
+
+    async def _disconnect(self, synthesizer) -> None:
+        await asyncio.to_thread(synthesizer._pool_connection.close)
+
+    async def _connected(self, synthesizer) -> bool:
+        return not getattr(synthesizer, "_pool_disconnected", False)
+
+
+_deepgram_pools: Dict[int, DeepgramPool] = {}
+
+
+async def deepgram_pool(sample_rate: int) -> DeepgramPool:
+    """Return the started process-wide Deepgram pool for `sample_rate`, creating it on first use."""
+    if sample_rate not in _deepgram_pools:
+        _deepgram_pools[sample_rate] = DeepgramPool(sample_rate=sample_rate)
+        await _deepgram_pools[sample_rate].start()
+    return _deepgram_pools[sample_rate]
+
+
+async def close_deepgram_pools() -> None:
+    for pool in _deepgram_pools.values():
+        await pool.close()
+    _deepgram_pools.clear()
+
+
+_llm_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+
+
+def shared_llm_client(
+    base_url: str, api_key_env: str, max_connections: int = 32
+) -> AsyncOpenAI:
+    """Return the process-wide client for an OpenAI-compatible API, so its HTTP connections are reused."""
+    key = (base_url, api_key_env)
+    if key not in _llm_clients:
+        import httpx
+
+        _llm_clients[key] = AsyncOpenAI(
+            api_key=os.environ.get(api_key_env),
+            base_url=base_url,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=POOL_IDLE_TIMEOUT,
+                )
+            ),
+        )
+    return _llm_clients[key]
+
+
+async def warm_llm_client(
+    client: AsyncOpenAI, connections: int = POOL_MIN_IDLE
+) -> None:
+    """Open connections to the LLM API ahead of the first session."""
+    results = await asyncio.gather(
+        *(client.models.list() for _ in range(connections)), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Error warming LLM client: %s", result)
+
+
+class SharedClientLLM:
+    """
+    Mixin for the OpenAI-compatible LLM plugins that sends their requests through `shared_llm_client`.
+
+    The plugins keep their client in `_client`. Here that attribute reads the
+    process-wide client for `base_url`, and the client the plugin assigns in
+    its constructor is dropped before it opens a connection.
+
+    Raises:
+        TypeError: If the plugin no longer assigns `_client`, so its requests
+            would not go through the shared client.
+    """
+
+    base_url: str
+    api_key_env: str
+
+    def __init__(self, **kwargs) -> None:
+        self._replaced_client: bool = False
+        super().__init__(**kwargs)
+        if not self._replaced_client:
+            raise TypeError(
+                f"{type(self).__name__}: the plugin no longer sets _client, "
+                "so the shared client would not be used"
+            )
+
+    @classmethod
+    def shared_client(cls) -> AsyncOpenAI:
+        return shared_llm_client(cls.base_url, cls.api_key_env)
+
+    @property
+    def _client(self) -> AsyncOpenAI:
+        return self.shared_client()
+
+    @_client.setter
+    def _client(self, client: AsyncOpenAI) -> None:
+        self._replaced_client = True
+
+
+class PooledFireworksLLM(SharedClientLLM, rt.FireworksLLM):
+    """rt.FireworksLLM on the process-wide Fireworks client."""
+
+    base_url = "https://api.fireworks.ai/inference/v1"
+    api_key_env = "FIREWORKS_API_KEY"
+
+
+class PooledGroqLLM(SharedClientLLM, rt.GroqLLM):
+    """rt.GroqLLM on the process-wide Groq client."""
+
+    base_url = "https://api.groq.com/openai/v1"
+    api_key_env = "GROQ_API_KEY"
+
+
+class PooledDeepgramSTT(rt.DeepgramSTT):
+    """
+    rt.DeepgramSTT over a connection leased from a `DeepgramPool`.
+
+    The plugin's keepalive, send and receive loops run unchanged on the leased
+    connection instead of one opened by the node. The connection is leased
+    when the node starts, so the session does not wait for the handshake, and
+    given back when the node's task ends on `close()`.
+
+    Args:
+        pool (DeepgramPool): The pool to lease the connection from. The node is
+            configured like the pool's connections.
+    """
+
+    def __init__(self, pool: DeepgramPool) -> None:
+        super().__init__(
+            sample_rate=pool.sample_rate,
+            interim_results=pool.interim_results,
+            **pool.options,
+        )
+        self.pool: DeepgramPool = pool
+
+    async def _run_ws(self) -> None:
+        try:
+            ws = await self.pool.acquire()
+        except Exception:
+            logger.error("Error connecting to Deepgram", exc_info=True)
+            return
+        try:
+            await asyncio.gather(
+                self._keepalive_task(ws), self._send_task(ws), self._recv_task(ws)
+            )
+        except Exception:
+            logger.error("Deepgram task failed", exc_info=True)
+        finally:
+            await self.pool.release(ws)
+
+
+class SessionWebsocket:
+    """
+    A Cartesia websocket leased from a `CartesiaPool`, as seen by one session.
+
+    Messages for contexts the session did not open, such as the tail of a
+    context an earlier session left unfinished, are skipped. Word timestamps
+    are requested for every transcript and put on `timestamp_stream` rather
+    than returned, since the plugin only expects audio and end markers.
+
+    Args:
+        ws: The leased websocket.
+        timestamp_stream (asyncio.Queue): Where to put the word timestamps.
+    """
+
+    def __init__(self, ws, timestamp_stream: asyncio.Queue) -> None:
+        self.ws = ws
+        self.timestamp_stream: asyncio.Queue = timestamp_stream
+        # Contexts opened by this session that are still owed audio.
+        self.contexts: Set[str] = set()
+
+    async def send(self, message: str) -> None:
+        payload = json.loads(message)
+        self.contexts.add(payload["context_id"])
+        if payload["transcript"]:
+            payload["add_timestamps"] = True
+            message = json.dumps(payload)
+        await self.ws.send(message)
+
+    async def recv(self) -> str:
+        while True:
+            message = await self.ws.recv()
+            response = json.loads(message)
+            if response.get("context_id") not in self.contexts:
+                continue
+            if response["type"] == "timestamps":
+                self.timestamp_stream.put_nowait(response["word_timestamps"])
+                continue
+            if response["type"] == "done":
+                self.contexts.discard(response["context_id"])
+            return message
+
+    async def cancel(self) -> None:
+        """Cancel the contexts still being synthesized and skip the rest of their audio."""
+        contexts, self.contexts = self.contexts, set()
+        for context_id in contexts:
+            await self.ws.send(json.dumps({"context_id": context_id, "cancel": True}))
+
+
+class PooledCartesiaTTS(rt.CartesiaTTS):
+    """
+    rt.CartesiaTTS over a websocket leased from a `CartesiaPool`.
+
+    The plugin's send and receive loops run unchanged. The websocket is leased
+    where the plugin would open its own, on the first text chunk, and given
+    back to the pool by `close()`. Contexts left unfinished by an interrupt or
+    by `close()` are cancelled. The word timestamps of each context are put on
+    `timestamp_stream` ahead of its end marker, as dicts of `words`, `start`
+    and `end` lists with times in seconds from the start of the context.
+
+    Args:
+        pool (CartesiaPool): The pool to lease the websocket from. The node
+            synthesizes with the pool's voice, model and sample rate.
+    """
+
+    def __init__(self, pool: CartesiaPool) -> None:
+        super().__init__(
+            voice_id=pool.voice_id,
+            model=pool.model,
+            output_sample_rate=pool.output_sample_rate,
+            **pool.options,
+        )
+        self.pool: CartesiaPool = pool
+        self.timestamp_stream: asyncio.Queue = asyncio.Queue()
+
+    async def connect_websocket(self) -> None:
+        # Called by every synthesis loop, including those restarted by an
+        # interrupt, which keep the websocket already leased.
+        if self._ws is not None:
+            return
+        try:
+            self._ws = SessionWebsocket(
+                await self.pool.acquire(), self.timestamp_stream
+            )
+        except Exception as e:
+            logger.error("Error connecting to Cartesia TTS: %s", e)
+            raise asyncio.CancelledError()
+
+    async def synthesize_speech(self) -> None:
+        if self._ws is not None:
+            # Restarted by an interrupt, so the old contexts are not wanted.
+            try:
+                await self._ws.cancel()
+            except Exception as e:
+                logger.error("Error cancelling Cartesia TTS contexts: %s", e)
+        await super().synthesize_speech()
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        session_ws, self._ws = self._ws, None
+        if session_ws is None:
+            return
+        try:
+            await session_ws.cancel()
+        except Exception as e:
+            logger.error("Error cancelling Cartesia TTS contexts: %s", e)
+            await self.pool.release(session_ws.ws, reusable=False)
+            return
+        await self.pool.release(session_ws.ws)
+
+
+class PooledAzureTTS(rt.AzureTTS):
+    """
+    rt.AzureTTS with a connected synthesizer leased from an `AzureSynthesizerPool`.
+
+    The plugin's synthesis loop runs unchanged with the leased synthesizer in
+    place of the one the plugin creates, which is never connected. The
+    synthesizer is leased when the node starts and given back by `close()`.
+
+    Args:
+        pool (AzureSynthesizerPool): The pool to lease the synthesizer from.
+        stream (bool): Whether to stream the audio of each phrase, rather than send it whole.
+
+    Raises:
+        TypeError: If the plugin no longer keeps its synthesizer where it can be replaced.
+    """
+
+    def __init__(self, pool: AzureSynthesizerPool, stream: bool = True) -> None:
+        self._leased = None
+        self._replaced: bool = False
+        super().__init__(voice_id=pool.voice_id, stream=stream, **pool.options)
+        if not self._replaced:
+            raise TypeError(
+                "rt.AzureTTS no longer sets _speech_synthesizer, "
+                "so the leased synthesizer would not be used"
+            )
+        self.pool: AzureSynthesizerPool = pool
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def _speech_synthesizer(self):
+        return self._leased
+
+    @_speech_synthesizer.setter
+    def _speech_synthesizer(self, synthesizer) -> None:
+        # The plugin's own synthesizer is dropped for the leased one.
+        self._replaced = True
+
+    def run(self, input_queue: rt.TextStream) -> Tuple[ByteStream, rt.TextStream]:
+        self._loop = asyncio.get_running_loop()
+        return super().run(input_queue)
+
+    async def synthesize_speech(self) -> None:
+        # Also called by the plugin's interrupt, which keeps the synthesizer.
+        if self._leased is None:
+            try:
+                self._leased = await self.pool.acquire()
+            except Exception as e:
+                logger.error("Error connecting to Azure TTS: %s", e)
+                return
+            self._leased.viseme_received.connect(self.viseme_received_cb)
+        await super().synthesize_speech()
+
+    def viseme_received_cb(self, evt) -> None:
+        # Called on a speech SDK thread.
+        self._loop.call_soon_threadsafe(super().viseme_received_cb, evt)
+
+    async def close(self) -> None:
+        await super().close()
+        self.thread_pool_executor.shutdown(wait=False)
+        synthesizer, self._leased = self._leased, None
+        if synthesizer is None:
+            return
+        synthesizer.viseme_received.disconnect_all()
+        try:
+            # One still speaking would hold up the next session's first phrase.
+            await asyncio.to_thread(lambda: synthesizer.stop_speaking_async().get())
+        except Exception as e:
+            logger.error("Error stopping Azure TTS: %s", e)
+            await self.pool.release(synthesizer, reusable=False)
+            return
+        await self.pool.release(synthesizer)
+
+
+_closing: Set[asyncio.Task] = set()
+
+
+async def _close_node(node) -> None:
+    try:
+        await node.close()
+    except Exception as e:
+        logger.error("Error closing %s: %s", type(node).__name__, e)
+
+
+def close_on_disconnect(nodes: list) -> None:
+    """
+    Close `nodes` when the current session ends, so their pooled connections are given back.
+
+    Call it from the endpoint function: `rt.websocket` and
+    `rt.streaming_endpoint` both run it in the task that serves the client,
+    which ends when the client disconnects.
+
+    Args:
+        nodes (list): The session's nodes, e.g. `PooledDeepgramSTT` or `PooledCartesiaTTS`.
+    """
+
+    def close(_: asyncio.Task) -> None:
+        for node in nodes:
+            task = asyncio.create_task(_close_node(node))
+            # Held until done, since the loop only keeps weak references.
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+
+    asyncio.current_task().add_done_callback(close)
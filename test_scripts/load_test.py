@@ -0,0 +1,846 @@
+"""
+Load test for the VoiceBot, Chatbot and ReplayBot apps.
+
+Opens a growing number of concurrent sessions against one app in this
+process, the way the realtime server would, with local stand-ins for the
+Deepgram, LLM and TTS providers that have configurable latency. Voice apps
+get a spoken utterance, synthetic or from a recording, followed by a pause,
+over and over, and the time from the end of each utterance to the first
+reply audio is measured. ReplayBot gets audio, video and text, and the time
+each item takes to come back is measured.
+
+Sessions are added at `--ramp` per second up to each of the `--sessions`
+counts in turn. Every step is held for `--hold` seconds, and the report has
+its latency percentiles, event loop lag, and CPU and RSS per session. The
+first step where replies are missed, latency grows past `--latency-factor`
+times that of the first step, the event loop lags or the CPU is used up is
+reported as the saturation point. No network access or API keys are needed.
+
+VoiceBot and ReplayBot are driven by calling their streaming endpoints with
+the input streams directly, like benchmark.py in ocr/backend, so the WebRTC
+transport is not part of the measurement. Chatbot is driven through its
+websocket handler, including the JSON and base64 encoding of every message.
+
+Usage:
+    python load_test.py voice_bot --sessions 1,2,4,8,16,32 --hold 20
+    python load_test.py chatbot --audio question.wav --llm-ttft 0.2 --json
+    python load_test.py replay_bot --sessions 8,16,32,64 --fps 30
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+import av
+import numpy as np
+
+import realtime as rt
+from realtime.streams import ByteStream
+
+APPS = {
+    "voice_bot": ("multimodal_ai_demos/backend", "voice_bot", "VoiceBot"),
+    "chatbot": ("3d_avatar_chatbot/backend", "chatbot", "Chatbot"),
+    "replay_bot": ("test_scripts", "replay_bot", "ReplayBot"),
+}
+
+# The plugins refuse to start without API keys, even though the stand-ins
+# never use them.
+API_KEYS = [
+    "DEEPGRAM_API_KEY",
+    "FIREWORKS_API_KEY",
+    "GROQ_API_KEY",
+    "CARTESIA_API_KEY",
+    "AZURE_SPEECH_KEY",
+    "AZURE_SPEECH_REGION",
+]
+
+FRAME_SECONDS = 0.02
+TTS_CHUNK_SECONDS = 0.1
+SECONDS_PER_WORD = 0.35
+# 16-bit RMS above which a frame counts as speech.
+VOICED_RMS = 500
+
+QUESTIONS = [
+    "What should I cook for dinner tonight?",
+    "How long do I boil the pasta for?",
+    "Can you tell me a fun fact about space?",
+    "What is the weather usually like in spring?",
+]
+REPLIES = [
+    "Sure, that sounds like a great idea. How about a simple tomato pasta with fresh basil?",
+    "Boil it for about nine minutes, then taste a piece to check that it is done.",
+    "A day on Venus is longer than its year, which surprises most people.",
+    "Spring is usually mild, with cool mornings, warm afternoons and a bit of rain.",
+]
+
+
+def is_voiced(pcm):
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    return len(samples) > 0 and np.sqrt(np.mean(samples**2)) > VOICED_RMS
+
+
+def tone(sample_rate, seconds, frequency=220, amplitude=4000):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16).tobytes()
+
+
+class FakePool:
+    """Stand-in for the connection pools in realtime_examples.pools."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeSTT:
+    """Stand-in for the Deepgram STT nodes.
+
+    Sends a transcript `latency` seconds after each utterance ends, i.e.
+    after `endpointing` seconds of silence following speech. With `interim`,
+    the transcript is also sent twice to the interim stream as soon as the
+    utterance ends, which counts as stable for speculation.
+
+    Args:
+        latency: the delay of the final transcript in seconds.
+        interim: whether to return an interim transcript stream too.
+        endpointing: the silence in seconds that ends an utterance.
+    """
+
+    def __init__(self, latency, interim=False, endpointing=0.1):
+        self.latency = latency
+        self.interim = interim
+        self.endpointing = endpointing
+        self.output_queue = rt.TextStream()
+        self.interim_queue = rt.TextStream()
+        self.utterances = 0
+        self._task = None
+
+    def run(self, input_queue):
+        self.input_queue = input_queue
+        self._task = asyncio.create_task(self._transcribe())
+        if self.interim:
+            return self.output_queue, self.interim_queue
+        return self.output_queue
+
+    async def _transcribe(self):
+        speaking = False
+        silence = 0.0
+        while True:
+            audio_data = await self.input_queue.get()
+            if audio_data is None:
+                continue
+            if is_voiced(audio_data.get_bytes()):
+                speaking, silence = True, 0.0
+                continue
+            if not speaking:
+                continue
+            silence += audio_data.get_duration_seconds()
+            if silence < self.endpointing:
+                continue
+            speaking = False
+            transcript = QUESTIONS[self.utterances % len(QUESTIONS)]
+            self.utterances += 1
+            if self.interim:
+                self.interim_queue.put_nowait(transcript)
+                self.interim_queue.put_nowait(transcript)
+            asyncio.get_running_loop().call_later(
+                self.latency, self.output_queue.put_nowait, transcript
+            )
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+
+class FakeLLMClient:
+    """Stand-in for the OpenAI-compatible client used by the LLM nodes.
+
+    Streams a canned reply word by word, the first token after `ttft`
+    seconds and the rest at `tokens_per_second`.
+
+    Args:
+        ttft: the time to first token in seconds.
+        tokens_per_second: the rate of the remaining tokens.
+        json_replies: whether to wrap replies in the avatar's JSON format.
+    """
+
+    def __init__(self, ttft=0.3, tokens_per_second=100, json_replies=False):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.json_replies = json_replies
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=self._list)
+
+    async def _list(self):
+        return []
+
+    def _reply(self):
+        text = REPLIES[self.requests % len(REPLIES)]
+        if self.json_replies:
+            return json.dumps(
+                {"facialExpression": "smile", "animation": "Talking_1", "text": text}
+            )
+        return text
+
+    async def _create(self, stream=False, **kwargs):
+        self.requests += 1
+        tokens = re.findall(r"\S+\s*", self._reply())
+        await asyncio.sleep(self.ttft)
+        if not stream:
+            await asyncio.sleep((len(tokens) - 1) / self.tokens_per_second)
+            message = SimpleNamespace(content="".join(tokens))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return self._stream(tokens)
+
+    async def _stream(self, tokens):
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeTTS:
+    """Stand-in for the Cartesia and Azure TTS nodes.
+
+    Each phrase becomes a tone of about `SECONDS_PER_WORD` per word. The first
+    chunk comes `latency` seconds after the phrase is sent and the rest at
+    `speed` times real time. Like CartesiaTTS, phrases go into one context
+    until an empty chunk ends it, the word timestamps of the context go to
+    `timestamp_stream`, and None follows its audio. With `visemes`, every
+    phrase is synthesized on its own and followed by None, its mouth cues are
+    sent first and the audio goes to a ByteStream, like AzureTTS does.
+
+    Args:
+        latency: the time to first audio in seconds.
+        speed: how much faster than real time the audio is produced.
+        visemes: whether to behave like AzureTTS rather than CartesiaTTS.
+        sample_rate: the sample rate of the audio.
+    """
+
+    def __init__(self, latency, speed, visemes=False, sample_rate=16000):
+        self.latency = latency
+        self.speed = speed
+        self.sample_rate = sample_rate
+        self.output_queue = ByteStream() if visemes else rt.AudioStream()
+        # CachedTTS looks for these attributes to decide how to split the audio.
+        if visemes:
+            self.viseme_stream = rt.TextStream()
+        else:
+            self.timestamp_stream = asyncio.Queue()
+        self._chunk = tone(sample_rate, TTS_CHUNK_SECONDS)
+        self._generating = False
+        self._task = None
+
+    def run(self, input_queue):
+        self.input_queue = input_queue
+        self._task = asyncio.create_task(self._synthesize())
+        if hasattr(self, "viseme_stream"):
+            return self.output_queue, self.viseme_stream
+        return self.output_queue
+
+    def _visemes(self, duration):
+        cues = []
+        for i in range(int(duration / TTS_CHUNK_SECONDS)):
+            cues.append(
+                {
+                    "value": "ABCDEF"[i % 6],
+                    "azure_viseme_id": i % 22,
+                    "start": round(i * TTS_CHUNK_SECONDS, 3),
+                    "end": round((i + 1) * TTS_CHUNK_SECONDS, 3),
+                }
+            )
+        return json.dumps({"mouthCues": cues})
+
+    async def _speak(self, words, first):
+        """Send the audio for `words` and return its duration in seconds."""
+        chunks = max(round(SECONDS_PER_WORD * words / TTS_CHUNK_SECONDS), 1)
+        for i in range(chunks):
+            await asyncio.sleep(
+                self.latency if first and not i else TTS_CHUNK_SECONDS / self.speed
+            )
+            self.output_queue.put_nowait(
+                rt.AudioData(self._chunk, sample_rate=self.sample_rate)
+            )
+        return chunks * TTS_CHUNK_SECONDS
+
+    async def _synthesize(self):
+        timestamps, offset = None, 0.0
+        while True:
+            text = await self.input_queue.get()
+            if not text:
+                if timestamps is not None:
+                    self.timestamp_stream.put_nowait(timestamps)
+                    self.output_queue.put_nowait(None)
+                    self._generating = False
+                    timestamps = None
+                continue
+            words = text.split()
+            if not words:
+                continue
+            self._generating = True
+            if hasattr(self, "viseme_stream"):
+                self.viseme_stream.put_nowait(
+                    self._visemes(SECONDS_PER_WORD * len(words))
+                )
+                await self._speak(len(words), first=True)
+                self.output_queue.put_nowait(None)
+                self._generating = False
+                continue
+            first = timestamps is None
+            if first:
+                timestamps, offset = {"words": [], "start": [], "end": []}, 0.0
+            duration = await self._speak(len(words), first)
+            for i, word in enumerate(words):
+                timestamps["words"].append(word)
+                timestamps["start"].append(offset + duration * i / len(words))
+                timestamps["end"].append(offset + duration * (i + 1) / len(words))
+            offset += duration
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+
+class FakeWebSocket:
+    """The server end of a client's websocket, for `@rt.websocket` handlers.
+
+    Args:
+        session: the session that receives what the app sends.
+        sample_rate: the sample rate announced to the app.
+    """
+
+    def __init__(self, session, sample_rate):
+        self.session = session
+        self.incoming = asyncio.Queue()
+        self.incoming.put_nowait({"sampleRate": sample_rate})
+
+    async def accept(self):
+        pass
+
+    async def receive_json(self):
+        return await self.incoming.get()
+
+    async def send_json(self, data):
+        # Serialized, since a real websocket would.
+        self.session.bytes_received += len(json.dumps(data))
+        if data["type"] == "audio":
+            self.session.on_reply()
+
+
+class Session:
+    """One simulated client.
+
+    Voice sessions speak the utterance, pause, and repeat, timing the first
+    reply audio after each utterance. Replay sessions time every item sent.
+
+    Args:
+        index: the session number.
+        clip: the utterance as PCM frames and the index of its last voiced frame.
+        args: the command line arguments.
+    """
+
+    def __init__(self, index, clip, args):
+        self.index = index
+        self.frames, self.speech_end = clip
+        self.args = args
+        # (time, value) samples, so they can be counted per step.
+        self.latencies = []
+        self.turns = []
+        self.missed = []
+        self.bytes_received = 0
+        self._utterance_end = None
+        self._sent_at = {}
+
+    def on_reply(self):
+        if self._utterance_end is not None:
+            now = time.perf_counter()
+            self.latencies.append((now, now - self._utterance_end))
+            self._utterance_end = None
+
+    async def speak(self, send):
+        """Calls `send` with every frame of the utterance and the pause after it, in real time."""
+        silence = bytes(len(self.frames[0]))
+        script = self.frames + [silence] * int(self.args.pause / FRAME_SECONDS)
+        start = time.perf_counter()
+        sent = 0
+        while True:
+            for i, pcm in enumerate(script):
+                await asyncio.sleep(
+                    max(start + sent * FRAME_SECONDS - time.perf_counter(), 0)
+                )
+                send(pcm)
+                sent += 1
+                if i == self.speech_end:
+                    now = time.perf_counter()
+                    if self._utterance_end is not None:
+                        self.missed.append((now, 1))
+                    self._utterance_end = now
+                    self.turns.append((now, 1))
+
+    async def replay(self, inputs, outputs):
+        """Sends audio, video and text to ReplayBot and times what comes back."""
+
+        def send(stream, item):
+            now = time.perf_counter()
+            self._sent_at[id(item)] = (now, item)
+            self.turns.append((now, 1))
+            stream.put_nowait(item)
+
+        async def collect(stream):
+            while True:
+                item = await stream.get()
+                sent = self._sent_at.pop(id(item), None)
+                if sent is not None:
+                    now = time.perf_counter()
+                    self.latencies.append((now, now - sent[0]))
+
+        async def feed(interval, make_item, stream):
+            start = time.perf_counter()
+            for i in itertools.count():
+                await asyncio.sleep(max(start + i * interval - time.perf_counter(), 0))
+                send(stream, make_item(i))
+
+        pcm = self.frames[0]
+        width, height = self.args.width, self.args.height
+        tasks = [asyncio.create_task(collect(stream)) for stream in outputs.values()]
+        if rt.AudioStream in inputs:
+            make_audio = lambda i: rt.AudioData(pcm, sample_rate=self.args.sample_rate)
+            tasks.append(
+                asyncio.create_task(
+                    feed(FRAME_SECONDS, make_audio, inputs[rt.AudioStream])
+                )
+            )
+        if rt.VideoStream in inputs:
+            make_frame = lambda i: av.VideoFrame(width, height, "yuv420p")
+            tasks.append(
+                asyncio.create_task(
+                    feed(1 / self.args.fps, make_frame, inputs[rt.VideoStream])
+                )
+            )
+        if rt.TextStream in inputs:
+            make_text = lambda i: f"session {self.index} message {i}"
+            tasks.append(asyncio.create_task(feed(1, make_text, inputs[rt.TextStream])))
+        await asyncio.gather(*tasks)
+
+
+def import_app(app):
+    directory, module_name, _ = APPS[app]
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", directory))
+    return importlib.import_module(module_name)
+
+
+def install_stand_ins(app, module, args):
+    """Replaces the app's provider nodes and pools with the stand-ins; returns the LLM client."""
+    llm = FakeLLMClient(args.llm_ttft, args.llm_tps, json_replies=app == "chatbot")
+    # The LLM nodes look the shared client up on every request.
+    importlib.import_module("realtime_examples.pools").shared_llm_client = (
+        lambda *args, **kwargs: llm
+    )
+    stt = lambda pool: FakeSTT(args.stt_latency)
+    if app == "voice_bot":
+        module.DeepgramPool = FakePool
+        module.CartesiaPool = FakePool
+        module.PooledDeepgramSTT = stt
+        module.PooledInterimDeepgramSTT = lambda pool: FakeSTT(
+            args.stt_latency, interim=True
+        )
+        module.PooledCartesiaTTS = lambda pool: FakeTTS(
+            args.tts_latency, args.tts_speed
+        )
+    elif app == "chatbot":
+
+        async def deepgram_pool(sample_rate):
+            return FakePool()
+
+        async def close_deepgram_pools():
+            pass
+
+        module.deepgram_pool = deepgram_pool
+        module.close_deepgram_pools = close_deepgram_pools
+        module.azure_pool = FakePool()
+        module.PooledDeepgramSTT = stt
+        module.PooledAzureTTS = lambda pool, stream=True: FakeTTS(
+            args.tts_latency, args.tts_speed, visemes=True
+        )
+    if not args.tts_cache and "tts_cache" in sys.modules:
+        # The canned replies would all be cache hits after the first few turns.
+        sys.modules["tts_cache"].tts_cache.max_bytes = 0
+    return llm
+
+
+def websocket_handler(path="/"):
+    """Returns the handler `@rt.websocket` registered for `path`."""
+    from fastapi.routing import APIWebSocketRoute
+    from realtime.server import RealtimeServer
+
+    for route in RealtimeServer().get_app().routes:
+        if isinstance(route, APIWebSocketRoute) and route.path == path:
+            return route.endpoint
+    raise RuntimeError(f"No websocket handler at {path}")
+
+
+async def call_streaming_endpoint(bot):
+    """Calls the bot's `@streaming_endpoint` with new input streams; returns the inputs and outputs by type."""
+    function = type(bot).run
+    # streaming_endpoint() returns a RealtimeFunction around a functools.wraps wrapper.
+    function = inspect.unwrap(getattr(function, "raw_f", function))
+    inputs = {}
+    kwargs = {}
+    for name, param in inspect.signature(function).parameters.items():
+        if param.annotation in (rt.AudioStream, rt.VideoStream, rt.TextStream):
+            inputs[param.annotation] = kwargs[name] = param.annotation()
+    output_streams = await function(bot, **kwargs)
+    if not isinstance(output_streams, (list, tuple)):
+        output_streams = (output_streams,)
+    outputs = {}
+    for stream in output_streams:
+        for stream_type in (rt.AudioStream, rt.VideoStream, rt.TextStream):
+            if isinstance(stream, stream_type):
+                outputs[stream_type] = stream
+    return inputs, outputs
+
+
+async def start_session(app, bot, session, args):
+    """Connects `session` to the app; returns its tasks."""
+    if app == "chatbot":
+        ws = FakeWebSocket(session, args.sample_rate)
+        payloads = {pcm: base64.b64encode(pcm).decode() for pcm in session.frames}
+        payloads[bytes(len(session.frames[0]))] = base64.b64encode(
+            bytes(len(session.frames[0]))
+        ).decode()
+
+        def send(pcm):
+            ws.incoming.put_nowait({"type": "audio", "data": payloads[pcm]})
+
+        return [
+            asyncio.create_task(websocket_handler()(ws)),
+            asyncio.create_task(session.speak(send)),
+        ]
+
+    inputs, outputs = await call_streaming_endpoint(bot)
+    if app == "replay_bot":
+        return [asyncio.create_task(session.replay(inputs, outputs))]
+
+    def send(pcm):
+        inputs[rt.AudioStream].put_nowait(
+            rt.AudioData(pcm, sample_rate=args.sample_rate)
+        )
+
+    async def collect():
+        while True:
+            if await outputs[rt.AudioStream].get() is not None:
+                session.on_reply()
+
+    return [
+        asyncio.create_task(session.speak(send)),
+        asyncio.create_task(collect()),
+    ]
+
+
+def load_clip(args):
+    """Returns the utterance as 20 ms PCM frames and the index of its last voiced frame."""
+    samples_per_frame = int(args.sample_rate * FRAME_SECONDS)
+    if args.audio:
+        resampler = av.AudioResampler(
+            format="s16", layout="mono", rate=args.sample_rate
+        )
+        pcm = []
+        with av.open(args.audio) as container:
+            for frame in container.decode(audio=0):
+                resampled = resampler.resample(frame)
+                if not isinstance(resampled, list):
+                    resampled = [resampled]
+                pcm += [f.to_ndarray().reshape(-1) for f in resampled]
+        samples = np.concatenate(pcm).astype(np.int16)
+    else:
+        # A tone with a syllable-rate envelope and some noise, loud enough to
+        # count as speech.
+        t = np.arange(int(args.utterance * args.sample_rate)) / args.sample_rate
+        envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+        samples = 8000 * envelope * np.sin(2 * np.pi * 220 * t)
+        samples = (samples + np.random.normal(0, 300, len(t))).astype(np.int16)
+    frames = [
+        samples[i : i + samples_per_frame].tobytes()
+        for i in range(0, len(samples) - samples_per_frame + 1, samples_per_frame)
+    ]
+    voiced = [i for i, pcm in enumerate(frames) if is_voiced(pcm)]
+    if not voiced:
+        raise ValueError("The utterance has no speech in it")
+    return frames, voiced[-1]
+
+
+def process_usage():
+    """Returns the CPU time used by the process in seconds, and its RSS in bytes."""
+    times = os.times()
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        # The peak RSS, in KiB on Linux and bytes on macOS.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss *= 1 if sys.platform == "darwin" else 1024
+    return times.user + times.system, rss
+
+
+async def measure_loop_lag(samples, interval=0.05):
+    """Records how late the event loop wakes up from `interval` second sleeps."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        samples.append((now, now - start - interval))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 50),
+        "p90_ms": 1000 * percentile(values, 90),
+        "p99_ms": 1000 * percentile(values, 99),
+    }
+
+
+def summarize_step(sessions, loop_lag, start, end, cpu_time, rss, rss_growth):
+    def window(samples):
+        return [value for t, value in samples if start <= t < end]
+
+    latencies = [value for s in sessions for value in window(s.latencies)]
+    session_p50s = [
+        1000 * percentile(window(s.latencies), 50)
+        for s in sessions
+        if window(s.latencies)
+    ]
+    cpu = 100 * cpu_time / (end - start)
+    return {
+        "sessions": len(sessions),
+        "turns": sum(len(window(s.turns)) for s in sessions),
+        "missed": sum(len(window(s.missed)) for s in sessions),
+        "latency": summarize(latencies),
+        "session_p50_ms": {
+            "min": min(session_p50s, default=0.0),
+            "max": max(session_p50s, default=0.0),
+        },
+        "loop_lag": summarize(window(loop_lag)),
+        "cpu_percent": cpu,
+        "cpu_percent_per_session": cpu / len(sessions),
+        "rss_mb": rss / 2**20,
+        "rss_mb_per_session": rss_growth / len(sessions) / 2**20,
+    }
+
+
+def saturation(step, first_step, args):
+    """Returns why the app is saturated at `step`, or None."""
+    if step["missed"]:
+        return f"{step['missed']} utterances got no reply before the next one"
+    baseline = first_step["latency"]["p90_ms"]
+    if baseline and step["latency"]["p90_ms"] > args.latency_factor * baseline:
+        return (
+            f"p90 latency {step['latency']['p90_ms']:.0f} ms is over "
+            f"{args.latency_factor:g}x the {baseline:.0f} ms of the first step"
+        )
+    if step["loop_lag"]["p99_ms"] > args.max_loop_lag:
+        return f"p99 event loop lag {step['loop_lag']['p99_ms']:.0f} ms"
+    if step["cpu_percent"] > args.max_cpu:
+        return f"CPU at {step['cpu_percent']:.0f}%"
+    return None
+
+
+async def load_test(args):
+    for key in API_KEYS:
+        os.environ.setdefault(key, "load-test")
+    os.environ.setdefault("TTS_CACHE_DIRECTORY", "")
+    module = import_app(args.app)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    llm = install_stand_ins(args.app, module, args)
+    bot = getattr(module, APPS[args.app][2])()._user_cls_instance
+    await bot.setup()
+
+    clip = load_clip(args)
+    loop_lag = []
+    lag_task = asyncio.create_task(measure_loop_lag(loop_lag))
+    _, baseline_rss = process_usage()
+    sessions, tasks, steps = [], [], []
+    saturated_at = None
+    for count in args.sessions:
+        while len(sessions) < count:
+            session = Session(len(sessions), clip, args)
+            tasks += await start_session(args.app, bot, session, args)
+            sessions.append(session)
+            await asyncio.sleep(1 / args.ramp)
+        await asyncio.sleep(args.warmup)
+        start = time.perf_counter()
+        cpu_start, _ = process_usage()
+        await asyncio.sleep(args.hold)
+        cpu_end, rss = process_usage()
+        step = summarize_step(
+            sessions,
+            loop_lag,
+            start,
+            time.perf_counter(),
+            cpu_end - cpu_start,
+            rss,
+            rss - baseline_rss,
+        )
+        step["saturated"] = saturation(step, steps[0] if steps else step, args)
+        steps.append(step)
+        if step["saturated"]:
+            saturated_at = saturated_at or step
+            if not args.keep_going:
+                break
+
+    if not args.verbose:
+        # The websocket handler logs its cancellation as an error.
+        logging.disable(logging.ERROR)
+    for task in tasks + [lag_task]:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.teardown()
+
+    limit = saturated_at["sessions"] if saturated_at else float("inf")
+    return {
+        "app": args.app,
+        "llm_requests": llm.requests,
+        "bytes_received": sum(s.bytes_received for s in sessions),
+        "steps": steps,
+        "saturated_at": saturated_at and saturated_at["sessions"],
+        "saturation_reason": saturated_at and saturated_at["saturated"],
+        "max_sustained_sessions": max(
+            (s["sessions"] for s in steps if s["sessions"] < limit), default=0
+        ),
+    }
+
+
+def print_report(report):
+    print(
+        f"{'sessions':>8}{'turns':>8}{'missed':>8}{'p50':>9}{'p90':>9}{'p99':>9}"
+        f"{'lag p99':>9}{'cpu %':>8}{'cpu %/s':>9}{'rss MB':>9}{'MB/s':>8}"
+    )
+    for step in report["steps"]:
+        latency = step["latency"]
+        print(
+            f"{step['sessions']:>8}{step['turns']:>8}{step['missed']:>8}"
+            f"{latency['p50_ms']:>9.1f}{latency['p90_ms']:>9.1f}{latency['p99_ms']:>9.1f}"
+            f"{step['loop_lag']['p99_ms']:>9.1f}{step['cpu_percent']:>8.1f}"
+            f"{step['cpu_percent_per_session']:>9.2f}{step['rss_mb']:>9.1f}"
+            f"{step['rss_mb_per_session']:>8.2f}"
+        )
+    if report["saturated_at"]:
+        print(
+            f"saturated at {report['saturated_at']} sessions: "
+            f"{report['saturation_reason']}"
+        )
+    else:
+        print("not saturated")
+    print(f"max sustained sessions: {report['max_sustained_sessions']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("app", choices=sorted(APPS))
+    parser.add_argument(
+        "--sessions",
+        type=lambda s: [int(n) for n in s.split(",")],
+        default=[1, 2, 4, 8, 16, 32, 64],
+        help="comma-separated session counts to step through",
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=4, help="sessions added per second"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="seconds before each step is measured"
+    )
+    parser.add_argument(
+        "--hold", type=float, default=20, help="seconds each step is measured"
+    )
+    parser.add_argument("--audio", help="recorded utterance to send instead of a tone")
+    parser.add_argument(
+        "--utterance", type=float, default=1.5, help="synthetic utterance length (s)"
+    )
+    parser.add_argument(
+        "--pause", type=float, default=4, help="silence after each utterance (s)"
+    )
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument(
+        "--fps", type=float, default=30, help="ReplayBot video frame rate"
+    )
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument(
+        "--stt-latency", type=float, default=0.3, help="final transcript delay (s)"
+    )
+    parser.add_argument(
+        "--llm-ttft", type=float, default=0.3, help="LLM time to first token (s)"
+    )
+    parser.add_argument(
+        "--llm-tps", type=float, default=100, help="LLM tokens per second"
+    )
+    parser.add_argument(
+        "--tts-latency", type=float, default=0.2, help="TTS time to first audio (s)"
+    )
+    parser.add_argument(
+        "--tts-speed", type=float, default=5, help="TTS speed relative to real time"
+    )
+    parser.add_argument(
+        "--tts-cache", action="store_true", help="keep the TTS cache enabled"
+    )
+    parser.add_argument(
+        "--latency-factor",
+        type=float,
+        default=2,
+        help="p90 growth that counts as saturated",
+    )
+    parser.add_argument(
+        "--max-loop-lag",
+        type=float,
+        default=100,
+        help="p99 event loop lag (ms) that counts as saturated",
+    )
+    parser.add_argument(
+        "--max-cpu", type=float, default=90, help="CPU %% that counts as saturated"
+    )
+    parser.add_argument(
+        "--keep-going", action="store_true", help="run every step even after saturation"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="keep the apps' logs and prints"
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    # The plugins print every LLM response; keep them out of the report.
+    with contextlib.redirect_stdout(
+        sys.stdout if args.verbose else open(os.devnull, "w")
+    ):
+        report = asyncio.run(load_test(args))
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
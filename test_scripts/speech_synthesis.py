@@ -9,6 +9,8 @@ from realtime.plugins.eleven_labs_tts import ElevenLabsTTS
 from realtime.plugins.audio_convertor import AudioConverter
 from realtime.streams import AudioStream
 
+from bounded_stream import BoundedTextStream, OverflowPolicy
+
 
 @realtime.App()
 class SpeechSynthesis:
@@ -20,7 +22,8 @@ class SpeechSynthesis:
 
     @realtime.streaming_endpoint()
     async def run(self, audio_input_queue: AudioStream):
-        tq = asyncio.Queue()
+        # The producer waits for the TTS instead of queueing text without limit.
+        tq = BoundedTextStream(maxsize=8, policy=OverflowPolicy.BLOCK, name="tts_input")
         eq = await self.tts.run(tq)
         aq = await self.ac.run(eq)
 
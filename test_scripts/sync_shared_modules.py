@@ -0,0 +1,73 @@
+"""
+Keeps the helper modules that several apps share in sync.
+
+Every backend directory is run and deployed on its own (`python app.py`,
+`realtime deploy app.py`), so the helper modules listed here are copied next
+to each entry point that uses them. The first directory listed for a module
+holds the copy to edit; this script copies it over the others. Modules in the
+`realtime_examples` package are installed by `poetry install` and imported
+from there instead.
+
+Usage:
+    python test_scripts/sync_shared_modules.py          # update the copies
+    python test_scripts/sync_shared_modules.py --check  # fail if any copy differs
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module file name -> directories that hold a copy, the one to edit first.
+SHARED_MODULES = {
+    "tts_cache.py": [
+        "multimodal_ai_demos/backend",
+        "3d_avatar_chatbot/backend",
+    ],
+    "adaptive_aggregator.py": [
+        "multimodal_ai_demos/backend",
+        "3d_avatar_chatbot/backend",
+    ],
+    "bounded_stream.py": [
+        "multimodal_ai_demos/backend",
+        "ocr/backend",
+        "test_scripts",
+    ],
+}
+
+
+def out_of_sync():
+    """Yield (source, copy) paths for every copy that differs from its source."""
+    for name, directories in SHARED_MODULES.items():
+        source = os.path.join(ROOT, directories[0], name)
+        for directory in directories[1:]:
+            copy = os.path.join(ROOT, directory, name)
+            if not os.path.exists(copy) or not filecmp.cmp(source, copy, shallow=False):
+                yield source, copy
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only report copies that differ from their source, and exit with 1 if any do.",
+    )
+    args = parser.parse_args()
+
+    stale = list(out_of_sync())
+    for source, copy in stale:
+        source, copy = os.path.relpath(source, ROOT), os.path.relpath(copy, ROOT)
+        if args.check:
+            print(f"{copy} differs from {source}")
+        else:
+            shutil.copyfile(os.path.join(ROOT, source), os.path.join(ROOT, copy))
+            print(f"Copied {source} to {copy}")
+    return 1 if args.check and stale else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
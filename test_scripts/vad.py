@@ -10,6 +10,13 @@ from aiortc.contrib.media import MediaPlayer
 import realtime
 from realtime.plugins import SileroVAD
 
+from bounded_stream import (
+    BoundedAudioStream,
+    BoundedVideoStream,
+    OverflowPolicy,
+    monitor,
+)
+
 
 @realtime.App()
 class SpeechSynthesis:
@@ -21,8 +28,9 @@ class SpeechSynthesis:
 
     @realtime.streaming_endpoint(audio_input=True, video_input=True)
     async def video_transform(self, audio_input_queue, video_input_queue):
-        aq = asyncio.Queue()
-        vq = asyncio.Queue()
+        aq = BoundedAudioStream(policy=OverflowPolicy.DROP_OLDEST, name="audio_output")
+        vq = BoundedVideoStream(policy=OverflowPolicy.KEEP_LATEST, name="video_output")
+        monitor([aq, vq])
 
         # vad = SileroVAD()
         # oq = await vad.arun(audio_input_queue)
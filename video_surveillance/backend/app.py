@@ -1,74 +1,970 @@
 import asyncio
+import contextlib
+import hashlib
+import math
 import json
+import re
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, File, UploadFile, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
+from typing import List, Optional, Tuple
+import av
+import numpy as np
 import google.generativeai as genai
 import time
 import realtime
 
+# Uploads are streamed to disk in chunks of this size so memory per request
+# stays bounded regardless of clip size.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Number of submissions that may be uploading or running inference at once.
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 4))
+# Backoff bounds (seconds) while Gemini processes an uploaded video.
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 8.0
+
+# Result cache settings. Gemini deletes uploaded files after 48 hours, so
+# remote file handles are only reused for slightly less than that.
+CACHE_DIRECTORY = os.path.join("data", "cache")
+CACHE_TTL = float(os.getenv("CACHE_TTL", 24 * 60 * 60))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 100 * 1024 * 1024))
+REMOTE_FILE_TTL = 47 * 60 * 60
+
+# Optional local motion pre-filter. Clips without motion are answered locally
+# and clips with motion are trimmed to the moving part before upload.
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "0") == "1"
+# Fraction of pixels that must change between samples to count as motion.
+PREFILTER_MOTION_THRESHOLD = float(os.getenv("PREFILTER_MOTION_THRESHOLD", 0.01))
+# Seconds of context kept around detected motion.
+PREFILTER_PADDING = float(os.getenv("PREFILTER_PADDING", 2.0))
+PREFILTER_SAMPLE_FPS = 2.0
+PREFILTER_WIDTH = 160
+
+NO_MOTION_RESULT = {
+    "accident": False,
+    "time": None,
+    "description": "No significant motion was detected in the video.",
+}
+
+# Job mode: worker count, how many jobs may wait, and how long finished jobs
+# stay available for polling (seconds).
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", MAX_CONCURRENT_JOBS))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", 32))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 60 * 60))
+
+# Overlap (seconds) between consecutive segments in segmented analysis.
+SEGMENT_OVERLAP = float(os.getenv("SEGMENT_OVERLAP", 5.0))
+
+# The blocking genai file APIs run on this executor instead of the event loop.
+genai_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS)
+_job_semaphore = None
+
+
+def job_semaphore() -> asyncio.Semaphore:
+    """Returns the semaphore limiting concurrent Gemini jobs, creating it on the running loop."""
+    global _job_semaphore
+    if _job_semaphore is None:
+        _job_semaphore = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+    return _job_semaphore
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Runs a blocking genai call on `genai_executor`."""
+    return await asyncio.get_running_loop().run_in_executor(
+        genai_executor, lambda: fn(*args, **kwargs)
+    )
+
+
+def find_motion_windows(
+    file_path: str,
+    threshold: float = PREFILTER_MOTION_THRESHOLD,
+    padding: float = PREFILTER_PADDING,
+) -> Tuple[List[Tuple[float, float]], float]:
+    """Finds the parts of a clip that contain motion.
+
+    The clip is decoded, sampled at `PREFILTER_SAMPLE_FPS` and downscaled to
+    `PREFILTER_WIDTH` pixels wide; motion energy is the fraction of pixels
+    whose luma changed by more than 25 levels since the previous sample.
+
+    Returns:
+        The merged (start, end) motion windows in seconds, padded by `padding`,
+        and the duration of the clip.
+    """
+    windows = []
+    previous = None
+    next_time = 0.0
+    duration = 0.0
+    with av.open(file_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        height = max(
+            2,
+            round(
+                stream.codec_context.height
+                * PREFILTER_WIDTH
+                / stream.codec_context.width
+            ),
+        )
+        for frame in container.decode(stream):
+            if frame.time is None:
+                continue
+            duration = max(duration, frame.time)
+            if frame.time < next_time:
+                continue
+            next_time = frame.time + 1 / PREFILTER_SAMPLE_FPS
+            luma = (
+                frame.reformat(width=PREFILTER_WIDTH, height=height, format="gray")
+                .to_ndarray()
+                .astype(np.int16)
+            )
+            if previous is not None:
+                energy = (np.abs(luma - previous) > 25).mean()
+                if energy > threshold:
+                    start, end = max(frame.time - padding, 0.0), frame.time + padding
+                    if windows and start <= windows[-1][1]:
+                        windows[-1] = (windows[-1][0], end)
+                    else:
+                        windows.append((start, end))
+            previous = luma
+    return [(start, min(end, duration)) for start, end in windows], duration
+
+
+def cut_clip(src_path: str, dst_path: str, start: float, end: float) -> float:
+    """Copies the [start, end] seconds of a clip's video track without re-encoding.
+
+    The cut starts at the keyframe at or before `start`, and timestamps in the
+    output start at zero.
+
+    Returns:
+        The time in the source clip at which the output starts.
+    """
+    with av.open(src_path) as src, av.open(dst_path, "w", format="mp4") as dst:
+        in_stream = src.streams.video[0]
+        if hasattr(dst, "add_stream_from_template"):
+            out_stream = dst.add_stream_from_template(in_stream)
+        else:
+            out_stream = dst.add_stream(template=in_stream)
+        time_base = in_stream.time_base
+        src.seek(int(start / time_base), stream=in_stream, backward=True)
+        offset = None
+        for packet in src.demux(in_stream):
+            if packet.dts is None or packet.pts is None:
+                continue
+            if offset is None:
+                offset = packet.dts
+            if packet.is_keyframe and packet.pts * time_base > end:
+                break
+            packet.pts -= offset
+            packet.dts -= offset
+            packet.stream = out_stream
+            dst.mux(packet)
+    return float((offset or 0) * time_base)
+
+
+@contextlib.asynccontextmanager
+async def cut_clip_file(src_path: str, dst_path: str, start: float, end: float):
+    """Cuts a clip with `cut_clip` off the event loop and removes the cut on exit.
+
+    Yields:
+        The time in the source clip at which the cut starts.
+    """
+    # Shielded, so that when the caller is cancelled mid-cut the file is only
+    # removed once the thread has stopped writing it.
+    cut = asyncio.ensure_future(
+        asyncio.to_thread(cut_clip, src_path, dst_path, start, end)
+    )
+    try:
+        yield await asyncio.shield(cut)
+    finally:
+        if cut.done():
+            remove_file(dst_path)
+        else:
+            cut.add_done_callback(lambda _: remove_file(dst_path))
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """Parses a model-reported time such as 12, "12.5", "0:12" or "00:01:12" into seconds."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = re.search(r"(\d+(?::\d+){0,2}(?:\.\d+)?)", value)
+    if match is None:
+        return None
+    seconds = 0.0
+    for part in match.group(1).split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def remove_file(path: str):
+    """Removes a file that another request may have removed already."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def offset_timestamp(value, offset: float):
+    """Shifts a model-reported time by `offset` seconds, keeping numbers numeric.
+
+    Values that cannot be parsed are returned unchanged.
+    """
+    seconds = parse_timestamp(value)
+    if seconds is None:
+        return value
+    seconds += offset
+    if isinstance(value, (int, float)):
+        return round(seconds, 2)
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+class ResultCache:
+    """On-disk cache of analysis results keyed by video content and prompt.
+
+    Parsed responses are stored per (video hash, prompt) and the name of the
+    uploaded Gemini file per video hash, so a repeated clip skips both upload
+    and inference, and a clip queried with a new prompt skips the upload.
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = CACHE_TTL,
+        max_bytes: int = CACHE_MAX_BYTES,
+        remote_ttl: float = REMOTE_FILE_TTL,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.remote_ttl = remote_ttl
+        self._created = False
+
+    def _create_directories(self):
+        # Created on the first write, so importing the module touches no files.
+        if not self._created:
+            os.makedirs(os.path.join(self.directory, "results"), exist_ok=True)
+            os.makedirs(os.path.join(self.directory, "remote"), exist_ok=True)
+            self._created = True
+
+    def _result_path(self, video_hash: str, prompt: str) -> str:
+        key = hashlib.sha256(f"{video_hash}\0{prompt}".encode()).hexdigest()
+        return os.path.join(self.directory, "results", f"{key}.json")
+
+    def _remote_path(self, video_hash: str) -> str:
+        return os.path.join(self.directory, "remote", f"{video_hash}.json")
+
+    def _read(self, path: str, ttl: float):
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["created"] > ttl:
+            remove_file(path)
+            return None
+        # Touch the entry so eviction is least-recently-used.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["value"]
+
+    def _write(self, path: str, value):
+        self._create_directories()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"created": time.time(), "value": value}, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def get_result(self, video_hash: str, prompt: str):
+        return self._read(self._result_path(video_hash, prompt), self.ttl)
+
+    def put_result(self, video_hash: str, prompt: str, result):
+        self._write(self._result_path(video_hash, prompt), result)
+
+    def get_remote_file(self, video_hash: str) -> Optional[str]:
+        return self._read(self._remote_path(video_hash), self.remote_ttl)
+
+    def put_remote_file(self, video_hash: str, name: str):
+        self._write(self._remote_path(video_hash), name)
+
+    def evict(self):
+        """Removes expired entries, then the least recently used ones until under `max_bytes`."""
+        self._create_directories()
+        entries = []
+        now = time.time()
+        for subdirectory, ttl in (("results", self.ttl), ("remote", self.remote_ttl)):
+            directory = os.path.join(self.directory, subdirectory)
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # mtime is refreshed on reads, so an entry not read for `ttl`
+                # seconds is certainly expired; others are checked on read.
+                if now - stat.st_mtime > ttl:
+                    remove_file(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            remove_file(path)
+            total -= size
+
+
+result_cache = ResultCache(CACHE_DIRECTORY)
+
+
+async def upload_video(file_path: str, video_hash: str, start_time: float):
+    """Uploads a video to Gemini and waits, with backoff, until it has been processed.
+
+    A file already uploaded for the same content is reused while it is still
+    active on the Gemini side.
+    """
+    video_file = None
+    name = await asyncio.to_thread(result_cache.get_remote_file, video_hash)
+    if name:
+        try:
+            video_file = await run_blocking(genai.get_file, name)
+            if video_file.state.name == "FAILED":
+                video_file = None
+            else:
+                print(f"Reusing upload: {video_file.uri}", time.time() - start_time)
+        except Exception:
+            video_file = None
+
+    if video_file is None:
+        print(f"Uploading file...", time.time() - start_time)
+        video_file = await run_blocking(genai.upload_file, path=file_path)
+        print(f"Completed upload: {video_file.uri}", time.time() - start_time)
+        await asyncio.to_thread(
+            result_cache.put_remote_file, video_hash, video_file.name
+        )
+
+    delay = POLL_INITIAL_DELAY
+    while video_file.state.name == "PROCESSING":
+        print("Waiting for video to be processed.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY)
+        video_file = await run_blocking(genai.get_file, video_file.name)
+
+    if video_file.state.name == "FAILED":
+        raise ValueError(video_file.state.name)
+
+    print(
+        f"Video processing complete: " + video_file.uri,
+        time.time() - start_time,
+    )
+    return video_file
+
+
+async def analyze_video(video_file, prompt: str, start_time: float):
+    """Runs the accident detection prompt on an uploaded video and returns the raw JSON text."""
+    # Set the model to Gemini 1.5 Flash.
+    model = genai.GenerativeModel(
+        model_name="models/gemini-1.5-flash",
+        generation_config={"response_mime_type": "application/json"},
+    )
+
+    # Make the LLM request.
+    print("Making LLM inference request...", time.time() - start_time)
+    response = await model.generate_content_async(
+        [prompt, video_file], request_options={"timeout": 600}
+    )
+    print("LLM inference request complete", time.time() - start_time)
+    return response.text
+
+
+async def save_upload(file: UploadFile, file_path: str) -> Tuple[int, str]:
+    """Streams an uploaded file to `file_path` in fixed-size chunks.
+
+    Reads and writes happen off the event loop, so other requests keep being
+    served while a large clip is being received. The content is hashed on the
+    way through for the result cache.
+
+    Returns:
+        The number of bytes written and the SHA-256 hex digest of the content.
+    """
+    size = 0
+    digest = hashlib.sha256()
+    f = await asyncio.to_thread(open, file_path, "wb")
+
+    def write_chunk(chunk: bytes):
+        digest.update(chunk)
+        f.write(chunk)
+
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await asyncio.to_thread(write_chunk, chunk)
+            size += len(chunk)
+    finally:
+        await asyncio.to_thread(f.close)
+    return size, digest.hexdigest()
+
+
+def build_prompt(prompt: str) -> str:
+    """Returns the final prompt sent to Gemini for a user prompt."""
+    if not prompt:
+        prompt = "Detect if an accident happened in the video."
+
+    prompt += " Output a JSON with 'accident' set to True/False, 'time' in the video the accident happened and 'description' of the accident."
+    return prompt
+
+
+def parse_response(response_text: str) -> dict:
+    """Parses a model response, raising ValueError unless it is a JSON object."""
+    result = json.loads(response_text)
+    if not isinstance(result, dict):
+        raise ValueError(f"Expected a JSON object, got {type(result).__name__}")
+    return result
+
+
+def is_accident(result: dict) -> bool:
+    """Returns whether a parsed model response reports an accident."""
+    accident = result.get("accident")
+    if isinstance(accident, str):
+        return accident.strip().lower() == "true"
+    return bool(accident)
+
+
+def clip_duration(file_path: str) -> float:
+    """Returns the duration of a clip in seconds."""
+    with av.open(file_path) as container:
+        if container.duration is not None:
+            return container.duration / av.time_base
+        stream = container.streams.video[0]
+        return float(stream.duration * stream.time_base)
+
+
+def merge_segment_results(segments: List[dict]) -> dict:
+    """Merges per-segment responses into a single result with an accident timeline.
+
+    Accidents reported by neighbouring segments within `SEGMENT_OVERLAP`
+    seconds of each other are assumed to be the same event. Segments that
+    could not be analyzed are listed under `failed_segments`.
+    """
+    segments = sorted(segments, key=lambda r: r["segment"][0])
+    failed = [r for r in segments if "error" in r]
+    segments = [r for r in segments if "error" not in r]
+    timeline = []
+    for result in segments:
+        if not is_accident(result):
+            continue
+        seconds = parse_timestamp(result.get("time"))
+        if timeline and seconds is not None:
+            previous = parse_timestamp(timeline[-1]["time"])
+            if previous is not None and seconds - previous <= SEGMENT_OVERLAP:
+                continue
+        timeline.append(
+            {
+                "time": result.get("time"),
+                "description": result.get("description"),
+                "segment": result["segment"],
+            }
+        )
+
+    if timeline:
+        merged = {
+            "accident": True,
+            "time": timeline[0]["time"],
+            "description": timeline[0]["description"],
+        }
+    else:
+        merged = {
+            "accident": False,
+            "time": None,
+            "description": "No accident was detected in any segment.",
+        }
+    merged["timeline"] = timeline
+    merged["segments_analyzed"] = len(segments)
+    merged["failed_segments"] = failed
+    return merged
+
+
+def validate_segment_length(segment_length: float) -> Optional[str]:
+    """Returns why `segment_length` is invalid, or None; zero disables segmentation."""
+    if segment_length == 0:
+        return None
+    if not math.isfinite(segment_length) or segment_length <= SEGMENT_OVERLAP:
+        return (
+            f"segment_length must be 0 or longer than the {SEGMENT_OVERLAP:g} "
+            "second segment overlap"
+        )
+    return None
+
+
+async def analyze_segments(
+    file_path: str,
+    video_hash: str,
+    prompt: str,
+    segment_length: float,
+    early_exit: bool,
+    windows: Optional[List[Tuple[float, float]]],
+    start_time: float,
+) -> dict:
+    """Splits a clip into overlapping segments and analyzes them concurrently.
+
+    Segments are `segment_length` seconds long plus `SEGMENT_OVERLAP` seconds
+    of overlap, so an event on a boundary is fully visible in one of them.
+    Only segments overlapping the motion `windows` are analyzed when given.
+    With `early_exit`, the remaining segments are cancelled as soon as one
+    reports an accident. A segment that fails is reported in the result
+    instead of failing the others; an error is raised only if all of them
+    fail.
+    """
+    duration = await asyncio.to_thread(clip_duration, file_path)
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(start + segment_length + SEGMENT_OVERLAP, duration)
+        if windows is None or any(s < end and e > start for s, e in windows):
+            segments.append((start, end))
+        if end >= duration:
+            break
+        start += segment_length
+    print(f"Analyzing {len(segments)} segments", time.time() - start_time)
+
+    async def analyze_segment(index: int, start: float, end: float) -> dict:
+        segment_path = f"{file_path}.segment{index}.mp4"
+        try:
+            # Cut inside the semaphore, so only as many segments as can be
+            # analyzed at once are being cut or kept on disk.
+            async with job_semaphore():
+                async with cut_clip_file(file_path, segment_path, start, end) as offset:
+                    video_file = await upload_video(
+                        segment_path,
+                        f"{video_hash}-{start:.1f}-{end:.1f}",
+                        start_time,
+                    )
+                    response_text = await analyze_video(video_file, prompt, start_time)
+            result = parse_response(response_text)
+            result["time"] = offset_timestamp(result.get("time"), offset)
+        except Exception as e:
+            print(f"Segment {start:.1f}-{end:.1f} failed: {e}")
+            return {"segment": [round(start, 2), round(end, 2)], "error": str(e)}
+        result["segment"] = [round(offset, 2), round(end, 2)]
+        return result
+
+    tasks = [
+        asyncio.create_task(analyze_segment(i, start, end))
+        for i, (start, end) in enumerate(segments)
+    ]
+    results = []
+    try:
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            results.append(result)
+            if early_exit and is_accident(result):
+                print("Accident found, skipping remaining segments")
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    if results and all("error" in result for result in results):
+        raise RuntimeError(f"All segments failed: {results[0]['error']}")
+    return merge_segment_results(results)
+
+
+def result_cache_key(prompt: str, segment_length: float, early_exit: bool) -> str:
+    """Returns the result cache key for a prompt and the settings that change how a clip is analyzed."""
+    settings = {"prefilter": PREFILTER_ENABLED}
+    if PREFILTER_ENABLED:
+        settings["motion_threshold"] = PREFILTER_MOTION_THRESHOLD
+        settings["padding"] = PREFILTER_PADDING
+    if segment_length > 0:
+        settings["segment_length"] = segment_length
+        settings["overlap"] = SEGMENT_OVERLAP
+        settings["early_exit"] = early_exit
+    return f"{prompt}\n{json.dumps(settings, sort_keys=True)}"
+
+
+async def process_video(
+    file_path: str,
+    video_hash: str,
+    prompt: str,
+    start_time: float,
+    segment_length: float = 0.0,
+    early_exit: bool = False,
+) -> Tuple[dict, bool]:
+    """Analyzes a saved clip, going through the cache, pre-filter and Gemini.
+
+    With a positive `segment_length` the clip is analyzed as concurrent
+    overlapping segments (see `analyze_segments`).
+
+    Returns:
+        The parsed result and whether it was served from the cache.
+    """
+    cache_key = result_cache_key(prompt, segment_length, early_exit)
+    result = await asyncio.to_thread(result_cache.get_result, video_hash, cache_key)
+    if result is not None:
+        print("Cache hit", time.time() - start_time)
+        return result, True
+
+    windows = None
+    upload_path, remote_key, offset = file_path, video_hash, 0.0
+    if PREFILTER_ENABLED:
+        windows, duration = await asyncio.to_thread(find_motion_windows, file_path)
+        print(f"Motion windows: {windows}", time.time() - start_time)
+        if not windows:
+            result = dict(NO_MOTION_RESULT)
+            await asyncio.to_thread(
+                result_cache.put_result, video_hash, cache_key, result
+            )
+            return result, False
+        start, end = windows[0][0], windows[-1][1]
+        if segment_length <= 0 and end - start < 0.8 * duration:
+            upload_path = f"{file_path}.trimmed.mp4"
+            # The remote file holds the trimmed clip, so key it separately.
+            remote_key = f"{video_hash}-{start:.1f}-{end:.1f}"
+
+    if segment_length > 0:
+        result = await analyze_segments(
+            file_path,
+            video_hash,
+            prompt,
+            segment_length,
+            early_exit,
+            windows,
+            start_time,
+        )
+    else:
+        async with contextlib.AsyncExitStack() as stack:
+            if upload_path != file_path:
+                offset = await stack.enter_async_context(
+                    cut_clip_file(file_path, upload_path, start, end)
+                )
+            async with job_semaphore():
+                video_file = await upload_video(upload_path, remote_key, start_time)
+                response_text = await analyze_video(video_file, prompt, start_time)
+        result = parse_response(response_text)
+        if offset:
+            result["time"] = offset_timestamp(result.get("time"), offset)
+    # Partial results are returned but not cached, so the failed segments are
+    # retried next time.
+    if not result.get("failed_segments"):
+        await asyncio.to_thread(result_cache.put_result, video_hash, cache_key, result)
+    return result, False
+
+
+class Job:
+    """A submission processed in the background by the job queue."""
+
+    def __init__(
+        self,
+        file_name: str,
+        file_path: str,
+        prompt: str,
+        priority: int,
+        segment_length: float = 0.0,
+        early_exit: bool = False,
+    ):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.file_path = file_path
+        self.prompt = prompt
+        self.priority = priority
+        self.segment_length = segment_length
+        self.early_exit = early_exit
+        self.video_hash = None
+        self.status = "queued"
+        self.result = None
+        self.cached = False
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def update(self, status: str):
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif self.finished:
+            self.finished_at = time.time()
+        # Wake up everyone waiting on the previous state.
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait_for_update(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self) -> dict:
+        job = {
+            "job_id": self.id,
+            "file": self.file_name,
+            "status": self.status,
+            "queue_wait": (self.started_at or time.time()) - self.submitted_at,
+        }
+        if self.started_at is not None:
+            job["service_time"] = (self.finished_at or time.time()) - self.started_at
+        if self.status == "done":
+            job["response"] = json.dumps(self.result, indent=4)
+            job["cached"] = self.cached
+        elif self.status == "failed":
+            job["message"] = f"There was an error processing the file {self.error}"
+        return job
+
+
+class JobQueue:
+    """Bounded priority queue of submissions served by a fixed pool of workers.
+
+    Higher `priority` jobs are started first. `submit` raises `asyncio.QueueFull`
+    once `depth` jobs are waiting, so callers can push back on clients.
+    Finished jobs are kept for `retention` seconds for polling.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        depth: int = JOB_QUEUE_DEPTH,
+        retention: float = JOB_RETENTION,
+    ):
+        self.workers = workers
+        self.depth = depth
+        self.retention = retention
+        self.jobs = {}
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_waits = deque(maxlen=1000)
+        self.service_times = deque(maxlen=1000)
+        self._queue = None
+        self._sequence = 0
+        self._tasks = []
+
+    def _start(self):
+        # Created lazily so the queue and workers live on the server's loop.
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=self.depth)
+            self._tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    def full(self) -> bool:
+        self._start()
+        return self._queue.full()
+
+    def submit(self, job: Job):
+        self._start()
+        self._evict()
+        try:
+            self._queue.put_nowait((-job.priority, self._sequence, job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        self._sequence += 1
+        self.jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished_at > self.retention:
+                del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            job.update("running")
+            self.queue_waits.append(job.started_at - job.submitted_at)
+            try:
+                job.result, job.cached = await process_video(
+                    job.file_path,
+                    job.video_hash,
+                    job.prompt,
+                    job.started_at,
+                    job.segment_length,
+                    job.early_exit,
+                )
+                self.completed += 1
+                job.update("done")
+            except Exception as e:
+                job.error = e
+                self.failed += 1
+                job.update("failed")
+            finally:
+                # Unset if the job was cancelled before it finished.
+                if job.finished_at is not None and job.started_at is not None:
+                    self.service_times.append(job.finished_at - job.started_at)
+                remove_file(job.file_path)
+                self._queue.task_done()
+
+    def metrics(self) -> dict:
+        def summary(values):
+            values = sorted(values)
+            if not values:
+                return {"count": 0}
+            return {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+            }
+
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.depth,
+            "running": sum(job.status == "running" for job in self.jobs.values()),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_wait": summary(self.queue_waits),
+            "service_time": summary(self.service_times),
+        }
+
+
+job_queue = JobQueue()
+
 
 @realtime.App()
 class VideoSurveillanceApp:
     @realtime.web_endpoint(method="POST", path="/submit")
-    async def run(file: UploadFile = File(None), prompt: str = ""):
+    async def run(
+        file: UploadFile = File(None),
+        prompt: str = "",
+        segment_length: float = 0.0,
+        early_exit: bool = False,
+    ):
+        error = validate_segment_length(segment_length)
+        if error:
+            await file.close()
+            return JSONResponse(status_code=400, content={"message": error})
+
         directory = "data"
-        filename = file.filename
-        file_path = os.path.join(directory, filename)
+        filename = os.path.basename(file.filename)
+        # Prefixed so concurrent requests for the same file name never share a file.
+        file_path = os.path.join(directory, f"{uuid.uuid4().hex}-{filename}")
 
         # Ensure the directory exists
         os.makedirs(directory, exist_ok=True)
         start_time = time.time()
         try:
             try:
-                with open(file_path, "wb") as f:
-                    contents = file.file.read()
-                    f.write(contents)
+                _, video_hash = await save_upload(file, file_path)
             except Exception:
                 return {"message": "There was an error uploading the file"}
             finally:
-                file.file.close()
+                await file.close()
 
-            print(f"Uploading file...", time.time() - start_time)
-            video_file = genai.upload_file(path=file_path)
-            print(f"Completed upload: {video_file.uri}", time.time() - start_time)
+            result, cached = await process_video(
+                file_path,
+                video_hash,
+                build_prompt(prompt),
+                start_time,
+                segment_length,
+                early_exit,
+            )
+        except Exception as e:
+            return {"message": f"There was an error processing the file {e}"}
+        finally:
+            remove_file(file_path)
 
-            while video_file.state.name == "PROCESSING":
-                print("Waiting for video to be processed.")
-                time.sleep(1)
-                video_file = genai.get_file(video_file.name)
+        return {
+            "file": file.filename,
+            "response": json.dumps(result, indent=4),
+            "cached": cached,
+        }
 
-            if video_file.state.name == "FAILED":
-                raise ValueError(video_file.state.name)
+    @realtime.web_endpoint(method="POST", path="/jobs")
+    async def submit_job(
+        file: UploadFile = File(None),
+        prompt: str = "",
+        priority: int = 0,
+        segment_length: float = 0.0,
+        early_exit: bool = False,
+    ):
+        error = validate_segment_length(segment_length)
+        if error:
+            await file.close()
+            return JSONResponse(status_code=400, content={"message": error})
 
-            print(
-                f"Video processing complete: " + video_file.uri,
-                time.time() - start_time,
+        if job_queue.full():
+            await file.close()
+            job_queue.rejected += 1
+            return JSONResponse(
+                status_code=503, content={"message": "Job queue is full, retry later"}
             )
 
-            if not prompt:
-                prompt = "Detect if an accident happened in the video."
-
-            prompt += " Output a JSON with 'accident' set to True/False, 'time' in the video the accident happened and 'description' of the accident."
+        directory = "data"
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.basename(file.filename)
+        job = Job(
+            filename, "", build_prompt(prompt), priority, segment_length, early_exit
+        )
+        # Prefix with the job id so concurrent jobs never share a file.
+        job.file_path = os.path.join(directory, f"{job.id}-{filename}")
+        try:
+            _, job.video_hash = await save_upload(file, job.file_path)
+        except Exception:
+            remove_file(job.file_path)
+            return {"message": "There was an error uploading the file"}
+        finally:
+            await file.close()
 
-            # Set the model to Gemini 1.5 Flash.
-            model = genai.GenerativeModel(
-                model_name="models/gemini-1.5-flash",
-                generation_config={"response_mime_type": "application/json"},
+        try:
+            job_queue.submit(job)
+        except asyncio.QueueFull:
+            remove_file(job.file_path)
+            return JSONResponse(
+                status_code=503, content={"message": "Job queue is full, retry later"}
             )
+        return {"job_id": job.id, "status": job.status}
 
-            # Make the LLM request.
-            print("Making LLM inference request...", time.time() - start_time)
-            response = model.generate_content(
-                [prompt, video_file], request_options={"timeout": 600}
-            )
-            print("LLM inference request complete", time.time() - start_time)
-        except Exception as e:
-            return {"message": f"There was an error processing the file {e}"}
+    @realtime.web_endpoint(method="GET", path="/jobs/{job_id}")
+    async def get_job(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            return JSONResponse(status_code=404, content={"message": "Unknown job"})
+        return job.to_dict()
 
-        return {
-            "file": file.filename,
-            "response": json.dumps(json.loads(response.text), indent=4),
-        }
+    @realtime.web_endpoint(method="GET", path="/jobs/{job_id}/events")
+    async def job_events(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            return JSONResponse(status_code=404, content={"message": "Unknown job"})
+
+        async def events():
+            while True:
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    break
+                # Re-send the state periodically as a keep-alive.
+                await job.wait_for_update(timeout=15)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @realtime.web_endpoint(method="GET", path="/metrics")
+    async def metrics():
+        return job_queue.metrics()
 
 
 if __name__ == "__main__":